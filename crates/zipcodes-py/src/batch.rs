@@ -0,0 +1,103 @@
+//! Batch lookups: one native loop per call, with the GIL released while
+//! zipcodes are looked up. Invalid items yield the exception the single-item
+//! function would have raised, instead of raising it.
+
+use pyo3::prelude::*;
+use pyo3::types::{PyDict, PyList, PyString};
+use pyo3::IntoPyObjectExt;
+use zipcodes::{Database, Record};
+
+use crate::to_dict;
+use crate::validate::{clean, Rejection};
+
+pub(crate) type Found<'a> = Result<Option<&'a Record<'a>>, Rejection>;
+
+/// Collect and validate the items of `zips`, then look them all up in `db`
+/// off the GIL.
+pub(crate) fn lookup_all<'py, 'a>(
+    py: Python<'py>,
+    db: &'a Database,
+    zips: &Bound<'py, PyAny>,
+) -> PyResult<(Vec<Bound<'py, PyAny>>, Vec<Found<'a>>)> {
+    let items = zips.try_iter()?.collect::<PyResult<Vec<_>>>()?;
+    // Non-ASCII items are checked by the interpreter, so all are cleaned
+    // before the GIL is released.
+    let mut cleaned = Vec::with_capacity(items.len());
+    for item in &items {
+        cleaned.push(match item.cast::<PyString>() {
+            Ok(s) => clean(py, &s.to_cow()?).map(str::to_owned),
+            Err(_) => Err(Rejection::Type),
+        });
+    }
+    let found: Vec<Found> = py.detach(|| {
+        cleaned
+            .iter()
+            .map(|zipcode| match zipcode {
+                Ok(zipcode) => Ok(db.lookup(zipcode)),
+                Err(r) => Err(*r),
+            })
+            .collect()
+    });
+    Ok((items, found))
+}
+
+fn rejected<'py>(py: Python<'py>, rejection: Rejection) -> Bound<'py, PyAny> {
+    rejection.to_err().into_value(py).into_bound(py).into_any()
+}
+
+#[pyfunction]
+pub(crate) fn is_real_many<'py>(
+    py: Python<'py>,
+    zips: &Bound<'py, PyAny>,
+) -> PyResult<Bound<'py, PyList>> {
+    let db = zipcodes::current_database();
+    let (_, found) = lookup_all(py, &db, zips)?;
+    let results = found
+        .into_iter()
+        .map(|found| match found {
+            Ok(z) => z.is_some().into_bound_py_any(py),
+            Err(r) => Ok(rejected(py, r)),
+        })
+        .collect::<PyResult<Vec<_>>>()?;
+    PyList::new(py, results)
+}
+
+#[pyfunction]
+pub(crate) fn matching_many<'py>(
+    py: Python<'py>,
+    zips: &Bound<'py, PyAny>,
+) -> PyResult<Bound<'py, PyList>> {
+    let db = zipcodes::current_database();
+    let (_, found) = lookup_all(py, &db, zips)?;
+    let results = found
+        .into_iter()
+        .map(|found| match found {
+            Ok(z) => Ok(crate::to_list(py, &db, z, false)?.into_any()),
+            Err(r) => Ok(rejected(py, r)),
+        })
+        .collect::<PyResult<Vec<_>>>()?;
+    PyList::new(py, results)
+}
+
+#[pyfunction]
+pub(crate) fn lookup_many<'py>(
+    py: Python<'py>,
+    zips: &Bound<'py, PyAny>,
+) -> PyResult<Bound<'py, PyDict>> {
+    let db = zipcodes::current_database();
+    let (items, found) = lookup_all(py, &db, zips)?;
+    // Every item becomes a key, so an unhashable one fails the whole call up
+    // front, as it would in `dict.fromkeys`.
+    for item in &items {
+        item.hash()?;
+    }
+    let results = PyDict::new(py);
+    for (item, found) in items.into_iter().zip(found) {
+        match found {
+            Ok(Some(z)) => results.set_item(item, to_dict(py, z)?)?,
+            Ok(None) => results.set_item(item, py.None())?,
+            Err(r) => results.set_item(item, rejected(py, r))?,
+        }
+    }
+    Ok(results)
+}
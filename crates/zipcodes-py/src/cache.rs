@@ -0,0 +1,265 @@
+//! An optional, size-bounded LRU cache of query results.
+//!
+//! Entries are keyed on the normalized arguments and hold the list of records
+//! built on the miss. The cached objects themselves are never handed out:
+//! views are immutable, so a hit returns a new list of the same views, and
+//! dicts are copied along with their list fields, so callers still get fresh
+//! dicts they are free to mutate.
+//!
+//! Entries belong to one [`zipcodes::database_version`]: the first query
+//! after the database is swapped drops them all, and a query still running
+//! on an older snapshot bypasses the cache.
+
+use std::collections::{BTreeMap, HashMap};
+use std::sync::{LazyLock, Mutex, MutexGuard, PoisonError};
+
+use pyo3::prelude::*;
+use pyo3::types::{PyDict, PyList};
+use serde_json::Value;
+use zipcodes::Database;
+
+/// The list-valued fields of a record dict, copied on every hit.
+const LIST_FIELDS: [&str; 3] = ["acceptable_cities", "unacceptable_cities", "area_codes"];
+
+/// The normalized arguments of a cached query.
+#[derive(Clone, Debug, PartialEq, Eq, Hash)]
+pub(crate) enum Args {
+    Prefix(String),
+    Fragment(String),
+    /// `filter_by` filters as JSON, sorted by field name.
+    Fields(String),
+    /// The bits of `(lat, long, radius_in_miles)`.
+    Within([u64; 3]),
+}
+
+impl Args {
+    pub(crate) fn fields(filters: &[(String, Value)]) -> Self {
+        let mut filters: Vec<&(String, Value)> = filters.iter().collect();
+        filters.sort_by(|a, b| a.0.cmp(&b.0));
+        Args::Fields(serde_json::to_string(&filters).expect("filters serialize"))
+    }
+
+    pub(crate) fn within(lat: f64, long: f64, radius_in_miles: f64) -> Self {
+        Args::Within([lat, long, radius_in_miles].map(f64::to_bits))
+    }
+}
+
+type Key = (Args, bool);
+
+struct Entry {
+    records: Py<PyList>,
+    bytes: usize,
+    last_used: u64,
+}
+
+#[derive(Default)]
+struct Cache {
+    max_entries: usize,
+    max_bytes: Option<usize>,
+    entries: HashMap<Key, Entry>,
+    /// The database version the entries were built from.
+    version: u64,
+    /// Keys by last use, least recent first.
+    recency: BTreeMap<u64, Key>,
+    clock: u64,
+    bytes: usize,
+    hits: u64,
+    misses: u64,
+}
+
+static CACHE: LazyLock<Mutex<Cache>> = LazyLock::new(Default::default);
+
+fn cache() -> MutexGuard<'static, Cache> {
+    CACHE.lock().unwrap_or_else(PoisonError::into_inner)
+}
+
+impl Cache {
+    fn tick(&mut self) -> u64 {
+        self.clock += 1;
+        self.clock
+    }
+
+    /// Empty the cache if its entries predate database `version`, returning
+    /// them for the caller to drop once the lock is released.
+    fn refresh(&mut self, version: u64) -> HashMap<Key, Entry> {
+        // A query that read an older version may finish after a newer one.
+        if self.version >= version {
+            return HashMap::new();
+        }
+        self.version = version;
+        self.recency.clear();
+        self.bytes = 0;
+        std::mem::take(&mut self.entries)
+    }
+
+    fn get(&mut self, py: Python<'_>, key: &Key) -> Option<Py<PyList>> {
+        let now = self.tick();
+        let entry = self.entries.get_mut(key)?;
+        let key = self.recency.remove(&entry.last_used)?;
+        entry.last_used = now;
+        self.recency.insert(now, key);
+        Some(entry.records.clone_ref(py))
+    }
+
+    /// Add an entry built from database `version`, returning the ones it
+    /// displaced (or the new one, if it is stale or can never fit) so that
+    /// the caller can drop them once the lock is released.
+    fn insert(&mut self, version: u64, key: Key, records: Py<PyList>, bytes: usize) -> Vec<Entry> {
+        let entry = Entry {
+            records,
+            bytes,
+            last_used: self.tick(),
+        };
+        if self.version != version
+            || self.max_entries == 0
+            || self.max_bytes.is_some_and(|max| bytes > max)
+        {
+            return vec![entry];
+        }
+        let mut evicted = Vec::new();
+        if let Some(old) = self.entries.remove(&key) {
+            self.recency.remove(&old.last_used);
+            self.bytes -= old.bytes;
+            evicted.push(old);
+        }
+        self.recency.insert(entry.last_used, key.clone());
+        self.entries.insert(key, entry);
+        self.bytes += bytes;
+        evicted.extend(self.evict());
+        evicted
+    }
+
+    /// Drop least recently used entries until the limits are met.
+    fn evict(&mut self) -> Vec<Entry> {
+        let mut evicted = Vec::new();
+        while self.entries.len() > self.max_entries
+            || self.max_bytes.is_some_and(|max| self.bytes > max)
+        {
+            let Some((_, key)) = self.recency.pop_first() else {
+                break;
+            };
+            if let Some(entry) = self.entries.remove(&key) {
+                self.bytes -= entry.bytes;
+                evicted.push(entry);
+            }
+        }
+        evicted
+    }
+}
+
+/// The shallow size of a result list and its records.
+fn shallow_size(records: &Bound<'_, PyList>) -> PyResult<usize> {
+    let mut bytes: usize = records.call_method0("__sizeof__")?.extract()?;
+    for record in records.iter() {
+        bytes += record.call_method0("__sizeof__")?.extract::<usize>()?;
+    }
+    Ok(bytes)
+}
+
+/// A copy of cached `records` that shares no mutable object with them.
+fn fresh<'py>(records: &Bound<'py, PyList>, views: bool) -> PyResult<Bound<'py, PyList>> {
+    if views {
+        return Ok(records.get_slice(0, records.len()));
+    }
+    let copies = records
+        .iter()
+        .map(|record| {
+            let copy = record.cast::<PyDict>()?.copy()?;
+            for field in LIST_FIELDS {
+                if let Some(list) = copy.get_item(field)? {
+                    let list = list.cast::<PyList>()?;
+                    copy.set_item(field, list.get_slice(0, list.len()))?;
+                }
+            }
+            Ok(copy)
+        })
+        .collect::<PyResult<Vec<_>>>()?;
+    PyList::new(records.py(), copies)
+}
+
+/// The result of the query `args` on `db`, from the cache if enabled and
+/// present, or else from `build`, which is cached for next time. `args` is
+/// only called when caching is enabled.
+pub(crate) fn cached<'py>(
+    py: Python<'py>,
+    db: &Database,
+    args: impl FnOnce() -> Args,
+    views: bool,
+    build: impl FnOnce() -> PyResult<Bound<'py, PyList>>,
+) -> PyResult<Bound<'py, PyList>> {
+    let version = db.version();
+    // Python objects are only copied or dropped with the lock released.
+    let (key, hit, stale) = {
+        let mut cache = cache();
+        if cache.max_entries == 0 {
+            drop(cache);
+            return build();
+        }
+        let stale = cache.refresh(version);
+        // Entries from a newer database are no answer for this snapshot.
+        if cache.version != version {
+            drop(cache);
+            return build();
+        }
+        let key = (args(), views);
+        let hit = cache.get(py, &key);
+        match hit {
+            Some(_) => cache.hits += 1,
+            None => cache.misses += 1,
+        }
+        (key, hit, stale)
+    };
+    drop(stale);
+    if let Some(records) = hit {
+        return fresh(records.bind(py), views);
+    }
+    let records = build()?;
+    let bytes = shallow_size(&records)?;
+    let copy = fresh(&records, views)?.unbind();
+    let evicted = cache().insert(version, key, copy, bytes);
+    drop(evicted);
+    Ok(records)
+}
+
+/// Cache up to `max_entries` results, or none if 0, optionally also bounded
+/// by `max_bytes`, the shallow size of the cached lists and records. Caching
+/// is off until this is first called.
+#[pyfunction]
+#[pyo3(signature = (max_entries, max_bytes=None))]
+pub(crate) fn set_cache(max_entries: usize, max_bytes: Option<usize>) {
+    let evicted = {
+        let mut cache = cache();
+        cache.max_entries = max_entries;
+        cache.max_bytes = max_bytes;
+        cache.evict()
+    };
+    drop(evicted);
+}
+
+/// `(hits, misses, entries, bytes, max_entries, max_bytes)`.
+#[pyfunction]
+pub(crate) fn cache_info() -> (u64, u64, usize, usize, usize, Option<usize>) {
+    let cache = cache();
+    (
+        cache.hits,
+        cache.misses,
+        cache.entries.len(),
+        cache.bytes,
+        cache.max_entries,
+        cache.max_bytes,
+    )
+}
+
+/// Drop every cached result and reset the hit and miss counters.
+#[pyfunction]
+pub(crate) fn cache_clear() {
+    let entries = {
+        let mut cache = cache();
+        cache.recency.clear();
+        cache.bytes = 0;
+        cache.hits = 0;
+        cache.misses = 0;
+        std::mem::take(&mut cache.entries)
+    };
+    drop(entries);
+}
@@ -0,0 +1,113 @@
+//! Columnar export of the whole database, built straight from the records
+//! rather than from per-record dicts.
+
+use std::collections::{BTreeSet, HashMap};
+
+use pyo3::prelude::*;
+use pyo3::types::{PyBytes, PyDict};
+use zipcodes::{Record, Str};
+
+use crate::str_list;
+
+type TextField = for<'a> fn(&'a Record<'a>) -> &'a str;
+type ListField = for<'a> fn(&'a Record<'a>) -> &'a [Str<'a>];
+
+/// String fields exported dictionary-encoded, as `(codes, categories)`.
+const CATEGORICAL: [(&str, TextField); 7] = [
+    ("zip_code_type", |z| z.zip_code_type().as_str()),
+    ("city", |z| z.city()),
+    ("state", |z| z.state()),
+    ("county", |z| z.county()),
+    ("timezone", |z| z.timezone()),
+    ("world_region", |z| z.world_region()),
+    ("country", |z| z.country()),
+];
+
+/// List fields exported as a list of lists of strings.
+const LISTS: [(&str, ListField); 3] = [
+    ("acceptable_cities", |z| z.acceptable_cities()),
+    ("unacceptable_cities", |z| z.unacceptable_cities()),
+    ("area_codes", |z| z.area_codes()),
+];
+
+/// A dictionary-encoded column: sorted distinct values and, per record, the
+/// index of its value among them.
+struct Categorical<'a> {
+    codes: Vec<u32>,
+    categories: Vec<&'a str>,
+}
+
+impl<'a> Categorical<'a> {
+    fn new(zips: &'a [Record<'a>], field: TextField) -> Self {
+        let categories: Vec<&str> = zips
+            .iter()
+            .map(field)
+            .collect::<BTreeSet<_>>()
+            .into_iter()
+            .collect();
+        let code_of: HashMap<&str, u32> = categories
+            .iter()
+            .enumerate()
+            .map(|(code, &value)| (value, code as u32))
+            .collect();
+        let codes = zips.iter().map(|z| code_of[field(z)]).collect();
+        Categorical { codes, categories }
+    }
+}
+
+fn parse_or_nan(text: &str) -> f64 {
+    text.parse().unwrap_or(f64::NAN)
+}
+
+/// Build an `array.array` of `typecode` over the native-endian `bytes`.
+fn array<'py>(py: Python<'py>, typecode: &str, bytes: &[u8]) -> PyResult<Bound<'py, PyAny>> {
+    let array = py.import("array")?.getattr("array")?.call1((typecode,))?;
+    array.call_method1("frombytes", (PyBytes::new(py, bytes),))?;
+    Ok(array)
+}
+
+#[pyfunction]
+pub(crate) fn columns(py: Python<'_>) -> PyResult<Bound<'_, PyDict>> {
+    let db = zipcodes::current_database();
+    let (zips, lat, long, active, categorical) = py.detach(|| {
+        // Decoding a cold database is the slow part, so it too runs detached.
+        let zips = db.records();
+        let lat: Vec<u8> = zips
+            .iter()
+            .flat_map(|z| parse_or_nan(z.lat()).to_ne_bytes())
+            .collect();
+        let long: Vec<u8> = zips
+            .iter()
+            .flat_map(|z| parse_or_nan(z.long()).to_ne_bytes())
+            .collect();
+        let active: Vec<u8> = zips.iter().map(|z| u8::from(z.active())).collect();
+        let categorical: Vec<Categorical> = CATEGORICAL
+            .iter()
+            .map(|&(_, field)| Categorical::new(zips, field))
+            .collect();
+        (zips, lat, long, active, categorical)
+    });
+
+    let columns = PyDict::new(py);
+    columns.set_item(
+        "zip_code",
+        zips.iter()
+            .map(|z| z.zip_code().as_str())
+            .collect::<Vec<_>>(),
+    )?;
+    for ((name, _), column) in CATEGORICAL.iter().zip(categorical) {
+        let codes: Vec<u8> = column.codes.iter().flat_map(|c| c.to_ne_bytes()).collect();
+        columns.set_item(*name, (array(py, "I", &codes)?, column.categories))?;
+    }
+    for (name, field) in LISTS {
+        let lists = zips
+            .iter()
+            .map(|z| str_list(py, field(z)))
+            .collect::<PyResult<Vec<_>>>()?;
+        columns.set_item(name, lists)?;
+    }
+    columns.set_item("active", array(py, "B", &active)?)?;
+    columns.set_item("lat", array(py, "d", &lat)?)?;
+    columns.set_item("long", array(py, "d", &long)?)?;
+    Ok(columns)
+}
@@ -0,0 +1,147 @@
+//! Vectorized great-circle distances. Inputs arrive from the Python shim as
+//! packed native-endian float64 bytes (or scalars, which broadcast), and the
+//! results are written straight into a new `bytes` object with the GIL
+//! released.
+
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use pyo3::types::{PyBytes, PyString, PyTuple};
+use zipcodes::Database;
+
+use crate::batch::lookup_all;
+
+const F64_SIZE: usize = std::mem::size_of::<f64>();
+
+#[derive(FromPyObject)]
+enum Column<'py> {
+    Packed(Bound<'py, PyBytes>),
+    Scalar(f64),
+}
+
+/// A borrowed column: packed doubles, or one value repeated.
+#[derive(Clone, Copy)]
+enum Values<'a> {
+    Packed(&'a [u8]),
+    Scalar(f64),
+}
+
+impl Values<'_> {
+    fn len(&self) -> Option<usize> {
+        match self {
+            Values::Packed(bytes) => Some(bytes.len() / F64_SIZE),
+            Values::Scalar(_) => None,
+        }
+    }
+
+    fn get(&self, i: usize) -> f64 {
+        match self {
+            Values::Packed(bytes) => {
+                let start = i * F64_SIZE;
+                f64::from_ne_bytes(bytes[start..start + F64_SIZE].try_into().unwrap())
+            }
+            Values::Scalar(value) => *value,
+        }
+    }
+}
+
+/// The common length of the non-scalar inputs, 1 if every input is a scalar.
+fn broadcast_len(lens: impl IntoIterator<Item = Option<usize>>) -> PyResult<usize> {
+    let mut common = None;
+    for len in lens.into_iter().flatten() {
+        match common {
+            Some(common) if common != len => {
+                return Err(PyValueError::new_err(format!(
+                    "input lengths differ: {} and {}",
+                    common, len
+                )))
+            }
+            _ => common = Some(len),
+        }
+    }
+    Ok(common.unwrap_or(1))
+}
+
+/// A new `bytes` of `len` doubles, filled by `f(i)` with the GIL released.
+fn packed<'py, F>(py: Python<'py>, len: usize, f: F) -> PyResult<Bound<'py, PyBytes>>
+where
+    F: Fn(usize) -> f64 + Sync,
+{
+    PyBytes::new_with(py, len * F64_SIZE, |out| {
+        py.detach(|| {
+            for (i, slot) in out.chunks_exact_mut(F64_SIZE).enumerate() {
+                slot.copy_from_slice(&f(i).to_ne_bytes());
+            }
+        });
+        Ok(())
+    })
+}
+
+#[pyfunction]
+pub(crate) fn haversine_many<'py>(
+    py: Python<'py>,
+    lon1: Column<'py>,
+    lat1: Column<'py>,
+    lon2: Column<'py>,
+    lat2: Column<'py>,
+) -> PyResult<Bound<'py, PyBytes>> {
+    let columns = [&lon1, &lat1, &lon2, &lat2].map(|column| match column {
+        Column::Packed(bytes) => Values::Packed(bytes.as_bytes()),
+        Column::Scalar(value) => Values::Scalar(*value),
+    });
+    let len = broadcast_len(columns.iter().map(Values::len))?;
+    let [lon1, lat1, lon2, lat2] = columns;
+    packed(py, len, |i| {
+        zipcodes::haversine(lon1.get(i), lat1.get(i), lon2.get(i), lat2.get(i))
+    })
+}
+
+/// The `(long, lat)` of each zipcode in `zips`, None where it is invalid,
+/// unknown, or has unparseable coordinates; and whether `zips` was a single
+/// zipcode string, which broadcasts.
+fn zip_coordinates(
+    py: Python<'_>,
+    db: &Database,
+    zips: &Bound<'_, PyAny>,
+) -> PyResult<(Vec<Option<(f64, f64)>>, bool)> {
+    let single = zips.is_instance_of::<PyString>();
+    let items = if single {
+        PyTuple::new(py, [zips])?.into_any()
+    } else {
+        zips.clone()
+    };
+    let (_, found) = lookup_all(py, db, &items)?;
+    let coordinates = found
+        .into_iter()
+        .map(|found| {
+            let z = found.ok().flatten()?;
+            Some((z.long().parse().ok()?, z.lat().parse().ok()?))
+        })
+        .collect();
+    Ok((coordinates, single))
+}
+
+/// Distances in miles between paired zipcodes; NaN where either zipcode is
+/// invalid, unknown, or has no usable coordinates.
+#[pyfunction]
+pub(crate) fn distance_between_zips<'py>(
+    py: Python<'py>,
+    zips_a: &Bound<'py, PyAny>,
+    zips_b: &Bound<'py, PyAny>,
+) -> PyResult<Bound<'py, PyBytes>> {
+    // Both sides are looked up in the same snapshot.
+    let db = zipcodes::current_database();
+    let (a, a_single) = zip_coordinates(py, &db, zips_a)?;
+    let (b, b_single) = zip_coordinates(py, &db, zips_b)?;
+    let len = broadcast_len([
+        (!a_single).then_some(a.len()),
+        (!b_single).then_some(b.len()),
+    ])?;
+    packed(py, len, |i| {
+        let a = a[if a_single { 0 } else { i }];
+        let b = b[if b_single { 0 } else { i }];
+        match (a, b) {
+            (Some((lon1, lat1)), Some((lon2, lat2))) => zipcodes::haversine(lon1, lat1, lon2, lat2),
+            _ => f64::NAN,
+        }
+    })
+}
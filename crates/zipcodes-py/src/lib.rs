@@ -1,45 +1,107 @@
 //! Native module `zipcodes._zipcodes`.
 //!
-//! The Python-facing compat layer (validation, exact 1.x exception messages,
-//! `zips=` chaining over caller-supplied dicts) lives in
-//! `python/zipcodes/__init__.py`; this module only handles scans over the
-//! embedded database, materializing matching records as Python dicts.
+//! The Python-facing compat layer (`zips=` chaining over caller-supplied
+//! dicts, the 1.x helpers) lives in `python/zipcodes/__init__.py`; this
+//! module handles scans over a snapshot of the current database, taken when
+//! each call starts, materializing matching records as Python dicts. Zipcode
+//! arguments of the single-zip functions and of the batch entry points in
+//! [`batch`] are validated natively by [`validate`], with the shim's exact
+//! 1.x exception messages, so a call costs one crossing into Rust.
+//!
+//! Scans and index builds run with the GIL released; only converting the
+//! matching records to Python objects holds it. The module keeps no
+//! Python-side state of its own, so it is declared safe to run without the
+//! GIL on free-threaded builds.
+
+use std::path::PathBuf;
+use std::sync::Arc;
 
+use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
 use pyo3::types::{PyBool, PyDict, PyList};
 use serde_json::Value;
-use zipcodes::Zipcode;
+use zipcodes::{Database, Record, Str};
+
+mod batch;
+mod cache;
+mod columns;
+mod distance;
+mod query;
+mod validate;
+mod view;
+mod zipset;
+
+use cache::{cached, Args};
+use validate::with_clean;
+
+/// A Python list of the strings in `items`.
+pub(crate) fn str_list<'py>(py: Python<'py>, items: &[Str]) -> PyResult<Bound<'py, PyList>> {
+    PyList::new(py, items.iter().map(Str::as_str))
+}
 
 /// Build a dict with the same field order the 1.x pure-Python package produced.
-fn to_dict<'py>(py: Python<'py>, z: &Zipcode) -> PyResult<Bound<'py, PyDict>> {
+pub(crate) fn to_dict<'py>(py: Python<'py>, z: &Record) -> PyResult<Bound<'py, PyDict>> {
     let dict = PyDict::new(py);
-    dict.set_item("zip_code", &z.zip_code)?;
-    dict.set_item("zip_code_type", &z.zip_code_type)?;
-    dict.set_item("active", z.active)?;
-    dict.set_item("city", &z.city)?;
-    dict.set_item("acceptable_cities", &z.acceptable_cities)?;
-    dict.set_item("unacceptable_cities", &z.unacceptable_cities)?;
-    dict.set_item("state", &z.state)?;
-    dict.set_item("county", &z.county)?;
-    dict.set_item("timezone", &z.timezone)?;
-    dict.set_item("area_codes", &z.area_codes)?;
-    dict.set_item("world_region", &z.world_region)?;
-    dict.set_item("country", &z.country)?;
-    dict.set_item("lat", &z.lat)?;
-    dict.set_item("long", &z.long)?;
+    dict.set_item("zip_code", z.zip_code().as_str())?;
+    dict.set_item("zip_code_type", z.zip_code_type().as_str())?;
+    dict.set_item("active", z.active())?;
+    dict.set_item("city", z.city())?;
+    dict.set_item("acceptable_cities", str_list(py, z.acceptable_cities())?)?;
+    dict.set_item(
+        "unacceptable_cities",
+        str_list(py, z.unacceptable_cities())?,
+    )?;
+    dict.set_item("state", z.state())?;
+    dict.set_item("county", z.county())?;
+    dict.set_item("timezone", z.timezone())?;
+    dict.set_item("area_codes", str_list(py, z.area_codes())?)?;
+    dict.set_item("world_region", z.world_region())?;
+    dict.set_item("country", z.country())?;
+    dict.set_item("lat", z.lat())?;
+    dict.set_item("long", z.long())?;
     Ok(dict)
 }
 
-fn collect<'py, F>(py: Python<'py>, predicate: F) -> PyResult<Bound<'py, PyList>>
-where
-    F: Fn(&Zipcode) -> bool,
-{
-    let dicts = zipcodes::database()
-        .iter()
-        .filter(|z| predicate(z))
-        .map(|z| to_dict(py, z))
+/// A record of `db` as a fresh dict, or as a lazy [`view::ZipcodeView`],
+/// which keeps `db` alive, if `views`.
+pub(crate) fn to_record<'py>(
+    py: Python<'py>,
+    db: &Arc<Database>,
+    z: &Record<'_>,
+    views: bool,
+) -> PyResult<Bound<'py, PyAny>> {
+    if views {
+        Ok(Bound::new(py, view::ZipcodeView::new(Arc::clone(db), z))?.into_any())
+    } else {
+        Ok(to_dict(py, z)?.into_any())
+    }
+}
+
+pub(crate) fn to_list<'py, 'a>(
+    py: Python<'py>,
+    db: &Arc<Database>,
+    zips: impl IntoIterator<Item = &'a Record<'a>>,
+    views: bool,
+) -> PyResult<Bound<'py, PyList>> {
+    let records = zips
+        .into_iter()
+        .map(|z| to_record(py, db, z, views))
         .collect::<PyResult<Vec<_>>>()?;
-    PyList::new(py, dicts)
+    PyList::new(py, records)
+}
+
+/// `(record, miles)` pairs as a list of tuples.
+pub(crate) fn to_pairs<'py>(
+    py: Python<'py>,
+    db: &Arc<Database>,
+    pairs: Vec<(&Record<'_>, f64)>,
+    views: bool,
+) -> PyResult<Bound<'py, PyList>> {
+    let pairs = pairs
+        .into_iter()
+        .map(|(z, miles)| Ok((to_record(py, db, z, views)?, miles)))
+        .collect::<PyResult<Vec<_>>>()?;
+    PyList::new(py, pairs)
 }
 
 /// Convert a Python filter value to JSON for comparison against record fields.
@@ -71,86 +133,228 @@ fn py_to_json(value: &Bound<'_, PyAny>) -> Option<Value> {
     None
 }
 
-/// `zipcode` arrives pre-validated by the Python shim (digits only, length <= 5).
+/// `filter_by` keyword arguments as `(field, value)` pairs, or None if some
+/// value is of a type no record field could ever equal, so that nothing
+/// matches all of them.
+pub(crate) fn filters_of(
+    kwargs: Option<&Bound<'_, PyDict>>,
+) -> PyResult<Option<Vec<(String, Value)>>> {
+    let mut filters = Vec::new();
+    if let Some(kwargs) = kwargs {
+        for (key, value) in kwargs.iter() {
+            let key: String = key.extract()?;
+            match py_to_json(&value) {
+                Some(value) => filters.push((key, value)),
+                None => return Ok(None),
+            }
+        }
+    }
+    Ok(Some(filters))
+}
+
+/// `zipcode` is validated natively, raising the shim's 1.x exceptions.
 #[pyfunction]
-fn matching<'py>(py: Python<'py>, zipcode: &str) -> PyResult<Bound<'py, PyList>> {
-    collect(py, |z| z.zip_code == zipcode)
+#[pyo3(signature = (zipcode, views=false))]
+fn matching<'py>(
+    py: Python<'py>,
+    zipcode: &Bound<'py, PyAny>,
+    views: bool,
+) -> PyResult<Bound<'py, PyList>> {
+    let db = zipcodes::current_database();
+    with_clean(zipcode, |zipcode| {
+        to_list(py, &db, db.lookup(zipcode), views)
+    })?
 }
 
+/// Determine whether a given zip or zip+4 zipcode is real.
 #[pyfunction]
-fn is_real(zipcode: &str) -> bool {
-    zipcodes::database().iter().any(|z| z.zip_code == zipcode)
+fn is_real(zipcode: &Bound<'_, PyAny>) -> PyResult<bool> {
+    // Shorter (prefix) zipcodes pass validation but are never real.
+    with_clean(zipcode, |zipcode| {
+        zipcodes::is_real(zipcode).unwrap_or(false)
+    })
 }
 
 #[pyfunction]
-fn similar_to<'py>(py: Python<'py>, prefix: &str) -> PyResult<Bound<'py, PyList>> {
-    collect(py, |z| z.zip_code.starts_with(prefix))
+#[pyo3(signature = (prefix, views=false))]
+fn similar_to<'py>(
+    py: Python<'py>,
+    prefix: &Bound<'py, PyAny>,
+    views: bool,
+) -> PyResult<Bound<'py, PyList>> {
+    let db = zipcodes::current_database();
+    with_clean(prefix, |prefix| {
+        cached(
+            py,
+            &db,
+            || Args::Prefix(prefix.to_string()),
+            views,
+            || {
+                let zips = py.detach(|| db.with_prefix(prefix));
+                to_list(py, &db, zips, views)
+            },
+        )
+    })?
 }
 
 #[pyfunction]
-fn contains<'py>(py: Python<'py>, fragment: &str) -> PyResult<Bound<'py, PyList>> {
-    collect(py, |z| z.zip_code.contains(fragment))
+#[pyo3(signature = (fragment, views=false))]
+fn contains<'py>(
+    py: Python<'py>,
+    fragment: &Bound<'py, PyAny>,
+    views: bool,
+) -> PyResult<Bound<'py, PyList>> {
+    let db = zipcodes::current_database();
+    with_clean(fragment, |fragment| {
+        cached(
+            py,
+            &db,
+            || Args::Fragment(fragment.to_string()),
+            views,
+            || {
+                let zips = py.detach(|| db.containing(fragment));
+                to_list(py, &db, zips, views)
+            },
+        )
+    })?
 }
 
 #[pyfunction]
-#[pyo3(signature = (**kwargs))]
+#[pyo3(signature = (*, views=false, **kwargs))]
 fn filter_by<'py>(
     py: Python<'py>,
+    views: bool,
     kwargs: Option<&Bound<'py, PyDict>>,
 ) -> PyResult<Bound<'py, PyList>> {
-    let mut filters = Vec::new();
-    if let Some(kwargs) = kwargs {
-        for (key, value) in kwargs.iter() {
-            let key: String = key.extract()?;
-            match py_to_json(&value) {
-                Some(value) => filters.push((key, value)),
-                // A value of an inconvertible type can never equal a record
-                // field, and all filters must match.
-                None => return Ok(PyList::empty(py)),
-            }
-        }
-    }
-    let filters = filters; // freeze for the closure
-    collect(py, |z| filters.iter().all(|(k, v)| z.field_matches(k, v)))
+    let Some(filters) = filters_of(kwargs)? else {
+        return Ok(PyList::empty(py));
+    };
+    let db = zipcodes::current_database();
+    cached(
+        py,
+        &db,
+        || Args::fields(&filters),
+        views,
+        || {
+            let zips = py.detach(|| db.with_fields(&filters));
+            to_list(py, &db, zips, views)
+        },
+    )
 }
 
 #[pyfunction]
+#[pyo3(signature = (lat, long, radius_in_miles, views=false))]
 fn filter_by_coordinates<'py>(
     py: Python<'py>,
     lat: f64,
     long: f64,
     radius_in_miles: f64,
+    views: bool,
 ) -> PyResult<Bound<'py, PyList>> {
-    collect(py, |z| {
-        match (z.lat.parse::<f64>(), z.long.parse::<f64>()) {
-            (Ok(z_lat), Ok(z_long)) => {
-                zipcodes::haversine(z_long, z_lat, long, lat) <= radius_in_miles
-            }
-            _ => false,
-        }
+    let db = zipcodes::current_database();
+    let args = || Args::within(lat, long, radius_in_miles);
+    cached(py, &db, args, views, || {
+        let zips = py.detach(|| db.within(lat, long, radius_in_miles));
+        to_list(py, &db, zips, views)
     })
 }
 
+/// Pairs of `(record, miles)` for the `k` closest records, nearest first.
+#[pyfunction]
+#[pyo3(signature = (lat, long, k, max_radius=None, views=false))]
+fn nearest<'py>(
+    py: Python<'py>,
+    lat: f64,
+    long: f64,
+    k: usize,
+    max_radius: Option<f64>,
+    views: bool,
+) -> PyResult<Bound<'py, PyList>> {
+    let db = zipcodes::current_database();
+    let pairs = py.detach(|| db.nearest(lat, long, k, max_radius));
+    to_pairs(py, &db, pairs, views)
+}
+
 #[pyfunction]
 fn haversine(lon1: f64, lat1: f64, lon2: f64, lat2: f64) -> f64 {
     zipcodes::haversine(lon1, lat1, lon2, lat2)
 }
 
 #[pyfunction]
-fn list_all<'py>(py: Python<'py>) -> PyResult<Bound<'py, PyList>> {
-    collect(py, |_| true)
+#[pyo3(signature = (views=false))]
+fn list_all<'py>(py: Python<'py>, views: bool) -> PyResult<Bound<'py, PyList>> {
+    let db = zipcodes::current_database();
+    let zips = py.detach(|| db.records());
+    to_list(py, &db, zips, views)
+}
+
+/// Decode the database and build every index with the GIL released.
+#[pyfunction]
+fn preload(py: Python<'_>) {
+    py.detach(zipcodes::preload)
+}
+
+#[pyfunction]
+fn is_loaded() -> bool {
+    zipcodes::is_loaded()
+}
+
+/// Swap in the database file at `path`, returning the new database version.
+#[pyfunction]
+fn load_database(py: Python<'_>, path: PathBuf) -> PyResult<u64> {
+    py.detach(|| zipcodes::load_database(path))
+        .map_err(|e| match e {
+            zipcodes::DatabaseError::Io(e) => e.into(),
+            e => PyValueError::new_err(e.to_string()),
+        })
+}
+
+#[pyfunction]
+fn database_version() -> u64 {
+    zipcodes::database_version()
+}
+
+#[pyfunction]
+fn set_threads(threads: usize) {
+    zipcodes::set_threads(threads)
+}
+
+#[pyfunction]
+fn threads() -> usize {
+    zipcodes::threads()
 }
 
-#[pymodule]
+#[pymodule(gil_used = false)]
 fn _zipcodes(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add("__version__", env!("CARGO_PKG_VERSION"))?;
+    m.add_class::<view::ZipcodeView>()?;
+    m.add_class::<zipset::ZipSet>()?;
+    m.add_class::<query::Query>()?;
     m.add_function(wrap_pyfunction!(matching, m)?)?;
     m.add_function(wrap_pyfunction!(is_real, m)?)?;
     m.add_function(wrap_pyfunction!(similar_to, m)?)?;
     m.add_function(wrap_pyfunction!(contains, m)?)?;
     m.add_function(wrap_pyfunction!(filter_by, m)?)?;
     m.add_function(wrap_pyfunction!(filter_by_coordinates, m)?)?;
+    m.add_function(wrap_pyfunction!(nearest, m)?)?;
     m.add_function(wrap_pyfunction!(haversine, m)?)?;
     m.add_function(wrap_pyfunction!(list_all, m)?)?;
+    m.add_function(wrap_pyfunction!(preload, m)?)?;
+    m.add_function(wrap_pyfunction!(is_loaded, m)?)?;
+    m.add_function(wrap_pyfunction!(load_database, m)?)?;
+    m.add_function(wrap_pyfunction!(database_version, m)?)?;
+    m.add_function(wrap_pyfunction!(view::use_record_views, m)?)?;
+    m.add_function(wrap_pyfunction!(view::record_views, m)?)?;
+    m.add_function(wrap_pyfunction!(set_threads, m)?)?;
+    m.add_function(wrap_pyfunction!(threads, m)?)?;
+    m.add_function(wrap_pyfunction!(cache::set_cache, m)?)?;
+    m.add_function(wrap_pyfunction!(cache::cache_info, m)?)?;
+    m.add_function(wrap_pyfunction!(cache::cache_clear, m)?)?;
+    m.add_function(wrap_pyfunction!(batch::is_real_many, m)?)?;
+    m.add_function(wrap_pyfunction!(batch::matching_many, m)?)?;
+    m.add_function(wrap_pyfunction!(batch::lookup_many, m)?)?;
+    m.add_function(wrap_pyfunction!(columns::columns, m)?)?;
+    m.add_function(wrap_pyfunction!(distance::haversine_many, m)?)?;
+    m.add_function(wrap_pyfunction!(distance::distance_between_zips, m)?)?;
     Ok(())
 }
@@ -0,0 +1,209 @@
+//! `Query`: the fluent query builder. Each step returns a new builder, and
+//! `run()` evaluates the combined criteria natively in one pass.
+
+use std::sync::Arc;
+
+use pyo3::exceptions::PyValueError;
+use pyo3::prelude::*;
+use pyo3::types::{PyDict, PyList};
+use zipcodes::Database;
+
+use crate::{filters_of, to_list, to_record};
+
+#[pyclass(frozen, module = "zipcodes._zipcodes")]
+#[derive(Clone)]
+pub(crate) struct Query {
+    query: zipcodes::Query,
+    /// The last `within` center, the default for `order_by_distance`.
+    center: Option<(f64, f64)>,
+    /// Set once a `filter_by` value is of a type no record field could equal.
+    matches_nothing: bool,
+    views: bool,
+}
+
+impl Query {
+    fn then(&self, step: impl FnOnce(zipcodes::Query) -> zipcodes::Query) -> Self {
+        Query {
+            query: step(self.query.clone()),
+            ..self.clone()
+        }
+    }
+}
+
+#[pymethods]
+impl Query {
+    #[new]
+    #[pyo3(signature = (views=false))]
+    fn py_new(views: bool) -> Self {
+        Query {
+            query: zipcodes::query(),
+            center: None,
+            matches_nothing: false,
+            views,
+        }
+    }
+
+    fn state(&self, state: &str) -> Self {
+        self.then(|q| q.state(state))
+    }
+
+    fn city(&self, city: &str) -> Self {
+        self.then(|q| q.city(city))
+    }
+
+    fn county(&self, county: &str) -> Self {
+        self.then(|q| q.county(county))
+    }
+
+    fn timezone(&self, timezone: &str) -> Self {
+        self.then(|q| q.timezone(timezone))
+    }
+
+    fn zip_code_type(&self, zip_code_type: &str) -> Self {
+        self.then(|q| q.zip_code_type(zip_code_type))
+    }
+
+    fn country(&self, country: &str) -> Self {
+        self.then(|q| q.country(country))
+    }
+
+    fn world_region(&self, world_region: &str) -> Self {
+        self.then(|q| q.world_region(world_region))
+    }
+
+    fn active(&self, active: bool) -> Self {
+        self.then(|q| q.active(active))
+    }
+
+    /// Field equality filters, as `zipcodes.filter_by(**filters)` takes.
+    #[pyo3(signature = (**kwargs))]
+    fn filter_by(&self, kwargs: Option<&Bound<'_, PyDict>>) -> PyResult<Self> {
+        Ok(match filters_of(kwargs)? {
+            Some(filters) => self.then(|q| {
+                filters
+                    .into_iter()
+                    .fold(q, |q, (field, value)| q.field(&field, value))
+            }),
+            None => Query {
+                matches_nothing: true,
+                ..self.clone()
+            },
+        })
+    }
+
+    fn prefix(&self, prefix: &str) -> Self {
+        self.then(|q| q.prefix(prefix))
+    }
+
+    fn contains(&self, fragment: &str) -> Self {
+        self.then(|q| q.containing(fragment))
+    }
+
+    fn within(&self, lat: f64, long: f64, radius_in_miles: f64) -> Self {
+        Query {
+            center: Some((lat, long)),
+            ..self.then(|q| q.within(lat, long, radius_in_miles))
+        }
+    }
+
+    /// Order by distance from (`lat`, `long`), by default the last `within`
+    /// center.
+    #[pyo3(signature = (lat=None, long=None))]
+    fn order_by_distance(&self, lat: Option<f64>, long: Option<f64>) -> PyResult<Self> {
+        let (lat, long) = match (lat, long, self.center) {
+            (Some(lat), Some(long), _) => (lat, long),
+            (None, None, Some(center)) => center,
+            (None, None, None) => {
+                return Err(PyValueError::new_err(
+                    "order_by_distance() needs lat and long unless within() was called",
+                ))
+            }
+            _ => {
+                return Err(PyValueError::new_err(
+                    "order_by_distance() needs both lat and long, or neither",
+                ))
+            }
+        };
+        Ok(self.then(|q| q.order_by_distance(lat, long)))
+    }
+
+    fn limit(&self, limit: usize) -> Self {
+        self.then(|q| q.limit(limit))
+    }
+
+    fn offset(&self, offset: usize) -> Self {
+        self.then(|q| q.offset(offset))
+    }
+
+    /// The matching records, as dicts or views.
+    #[pyo3(signature = (views=None))]
+    fn run<'py>(&self, py: Python<'py>, views: Option<bool>) -> PyResult<Bound<'py, PyList>> {
+        let db = zipcodes::current_database();
+        let zips = if self.matches_nothing {
+            Vec::new()
+        } else {
+            py.detach(|| self.query.run_on(&db))
+        };
+        to_list(py, &db, zips, views.unwrap_or(self.views))
+    }
+
+    /// The zip codes of the matching records.
+    fn zip_codes<'py>(&self, py: Python<'py>) -> PyResult<Bound<'py, PyList>> {
+        let db = zipcodes::current_database();
+        let zips = if self.matches_nothing {
+            Vec::new()
+        } else {
+            py.detach(|| self.query.run_on(&db))
+        };
+        PyList::new(py, zips.into_iter().map(|z| z.zip_code().as_str()))
+    }
+
+    /// Yield the matching records one at a time, scanning only as far as
+    /// each needs.
+    #[pyo3(signature = (views=None))]
+    fn iter(&self, py: Python<'_>, views: Option<bool>) -> QueryIterator {
+        let db = zipcodes::current_database();
+        let matches = if self.matches_nothing {
+            zipcodes::query().limit(0).iter_shared(Arc::clone(&db))
+        } else {
+            // Locating the candidates (and ranking them, when ordered) may
+            // build an index, so it runs without the GIL.
+            py.detach(|| self.query.iter_shared(Arc::clone(&db)))
+        };
+        QueryIterator {
+            matches,
+            db,
+            views: views.unwrap_or(self.views),
+        }
+    }
+
+    fn __iter__(&self, py: Python<'_>) -> QueryIterator {
+        self.iter(py, None)
+    }
+}
+
+#[pyclass(module = "zipcodes._zipcodes")]
+pub(crate) struct QueryIterator {
+    matches: zipcodes::SharedMatches,
+    /// The snapshot `matches` holds, for the views of its records.
+    db: Arc<Database>,
+    views: bool,
+}
+
+#[pymethods]
+impl QueryIterator {
+    fn __iter__(slf: PyRef<'_, Self>) -> PyRef<'_, Self> {
+        slf
+    }
+
+    fn __next__<'py>(mut slf: PyRefMut<'py, Self>) -> PyResult<Option<Bound<'py, PyAny>>> {
+        let py = slf.py();
+        let this = &mut *slf;
+        // Finding the next match may scan far, so only the record is built
+        // with the GIL held.
+        match py.detach(|| this.matches.next()) {
+            Some(z) => to_record(py, &this.db, z, this.views).map(Some),
+            None => Ok(None),
+        }
+    }
+}
@@ -0,0 +1,71 @@
+//! Native mirror of the Python shim's `_clean_zipcode`/`_clean` validation.
+
+use pyo3::exceptions::{PyTypeError, PyValueError};
+use pyo3::prelude::*;
+use pyo3::types::PyString;
+
+const ZIPCODE_LENGTH: usize = 5;
+
+/// Whether `text` is all decimal digits, as Python's `\d` decides for a
+/// `str`. Non-ASCII text is left to the running interpreter's
+/// `str.isdecimal()`, so digits added in later Unicode versions are accepted
+/// exactly when the shim's regex would accept them.
+fn is_decimal(py: Python<'_>, text: &str) -> bool {
+    if text.is_ascii() {
+        return text.bytes().all(|b| b.is_ascii_digit());
+    }
+    PyString::new(py, text)
+        .call_method0("isdecimal")
+        .and_then(|decimal| decimal.extract())
+        .unwrap_or(false)
+}
+
+/// Why a zipcode was rejected; each maps to the exact 1.x exception.
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub(crate) enum Rejection {
+    Type,
+    Format,
+    Characters,
+}
+
+impl Rejection {
+    pub(crate) fn to_err(self) -> PyErr {
+        match self {
+            Rejection::Type => PyTypeError::new_err("Invalid type, zipcode must be a string."),
+            Rejection::Format => PyValueError::new_err(zipcodes::Error::InvalidFormat.to_string()),
+            Rejection::Characters => {
+                PyValueError::new_err(zipcodes::Error::InvalidCharacters.to_string())
+            }
+        }
+    }
+}
+
+/// Strip a `-####` suffix and check what remains, as the shim does for a
+/// non-empty `str`: it must be as long as the input, capped at five
+/// characters, and contain only decimal digits. Other numeric characters,
+/// such as `²`, are rejected as the shim's regex rejects them.
+pub(crate) fn clean<'a>(py: Python<'_>, zipcode: &'a str) -> Result<&'a str, Rejection> {
+    if zipcode.is_empty() {
+        return Err(Rejection::Type);
+    }
+    let valid_length = zipcode.chars().count().min(ZIPCODE_LENGTH);
+    let zipcode = zipcode.split('-').next().unwrap_or_default();
+    if zipcode.chars().count() != valid_length {
+        return Err(Rejection::Format);
+    }
+    if !is_decimal(py, zipcode) {
+        return Err(Rejection::Characters);
+    }
+    Ok(zipcode)
+}
+
+/// Validate a single-zip function's `zipcode` argument and call `f` with
+/// the cleaned zipcode, raising what the shim's `_clean_zipcode` would for an
+/// invalid one. This lets one native call validate and look up.
+pub(crate) fn with_clean<R>(zipcode: &Bound<'_, PyAny>, f: impl FnOnce(&str) -> R) -> PyResult<R> {
+    let Ok(zipcode) = zipcode.cast::<PyString>() else {
+        return Err(Rejection::Type.to_err());
+    };
+    let text = zipcode.to_cow()?;
+    clean(zipcode.py(), &text).map(f).map_err(Rejection::to_err)
+}
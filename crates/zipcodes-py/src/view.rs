@@ -0,0 +1,190 @@
+//! `ZipcodeView`: a read-only mapping over a database record that converts
+//! fields to Python objects only when they are accessed.
+
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::Arc;
+
+use pyo3::basic::CompareOp;
+use pyo3::exceptions::PyKeyError;
+use pyo3::prelude::*;
+use pyo3::types::{PyDict, PyIterator, PyString, PyTuple};
+use pyo3::IntoPyObjectExt;
+use zipcodes::{Database, Record, Zip5};
+
+use crate::{str_list, to_dict};
+
+/// Field names, in the order `to_dict` inserts them.
+const FIELDS: [&str; 14] = [
+    "zip_code",
+    "zip_code_type",
+    "active",
+    "city",
+    "acceptable_cities",
+    "unacceptable_cities",
+    "state",
+    "county",
+    "timezone",
+    "area_codes",
+    "world_region",
+    "country",
+    "lat",
+    "long",
+];
+
+/// Whether queries return views when their `views` argument is None, as
+/// set by the shim's `use_record_views`.
+static RECORD_VIEWS: AtomicBool = AtomicBool::new(false);
+
+/// Resolve a `views=None` argument to the `use_record_views` setting.
+pub(crate) fn resolve(views: Option<bool>) -> bool {
+    views.unwrap_or_else(|| RECORD_VIEWS.load(Ordering::Relaxed))
+}
+
+#[pyfunction]
+pub(crate) fn use_record_views(enabled: bool) {
+    RECORD_VIEWS.store(enabled, Ordering::Relaxed)
+}
+
+#[pyfunction]
+pub(crate) fn record_views() -> bool {
+    RECORD_VIEWS.load(Ordering::Relaxed)
+}
+
+#[pyclass(frozen, mapping, module = "zipcodes._zipcodes")]
+pub(crate) struct ZipcodeView {
+    /// The snapshot the record belongs to, kept alive by the view.
+    db: Arc<Database>,
+    zip_code: Zip5,
+}
+
+impl ZipcodeView {
+    /// A view of `record`, a record of `db`.
+    pub(crate) fn new(db: Arc<Database>, record: &Record<'_>) -> Self {
+        ZipcodeView {
+            db,
+            zip_code: *record.zip_code(),
+        }
+    }
+
+    pub(crate) fn record(&self) -> &Record<'_> {
+        self.db
+            .lookup(self.zip_code.as_str())
+            .expect("a view's record is in its database")
+    }
+
+    fn field<'py>(
+        &self,
+        py: Python<'py>,
+        key: &Bound<'py, PyAny>,
+    ) -> PyResult<Option<Bound<'py, PyAny>>> {
+        let Ok(key) = key.cast::<PyString>() else {
+            return Ok(None);
+        };
+        let z = self.record();
+        let value = match &*key.to_cow()? {
+            "zip_code" => z.zip_code().as_str().into_bound_py_any(py),
+            "zip_code_type" => z.zip_code_type().as_str().into_bound_py_any(py),
+            "active" => z.active().into_bound_py_any(py),
+            "city" => z.city().into_bound_py_any(py),
+            "acceptable_cities" => str_list(py, z.acceptable_cities()).map(Bound::into_any),
+            "unacceptable_cities" => str_list(py, z.unacceptable_cities()).map(Bound::into_any),
+            "state" => z.state().into_bound_py_any(py),
+            "county" => z.county().into_bound_py_any(py),
+            "timezone" => z.timezone().into_bound_py_any(py),
+            "area_codes" => str_list(py, z.area_codes()).map(Bound::into_any),
+            "world_region" => z.world_region().into_bound_py_any(py),
+            "country" => z.country().into_bound_py_any(py),
+            "lat" => z.lat().into_bound_py_any(py),
+            "long" => z.long().into_bound_py_any(py),
+            _ => return Ok(None),
+        };
+        value.map(Some)
+    }
+
+    fn collections_abc<'py>(py: Python<'py>, name: &str) -> PyResult<Bound<'py, PyAny>> {
+        py.import("collections.abc")?.getattr(name)
+    }
+}
+
+#[pymethods]
+impl ZipcodeView {
+    fn __getitem__<'py>(
+        &self,
+        py: Python<'py>,
+        key: &Bound<'py, PyAny>,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        self.field(py, key)?
+            .ok_or_else(|| PyKeyError::new_err(key.clone().unbind()))
+    }
+
+    fn __len__(&self) -> usize {
+        FIELDS.len()
+    }
+
+    fn __iter__<'py>(&self, py: Python<'py>) -> PyResult<Bound<'py, PyIterator>> {
+        PyTuple::new(py, FIELDS)?.try_iter()
+    }
+
+    fn __contains__(&self, key: &Bound<'_, PyAny>) -> PyResult<bool> {
+        Ok(match key.cast::<PyString>() {
+            Ok(key) => FIELDS.contains(&&*key.to_cow()?),
+            Err(_) => false,
+        })
+    }
+
+    #[pyo3(signature = (key, default=None))]
+    fn get<'py>(
+        &self,
+        py: Python<'py>,
+        key: &Bound<'py, PyAny>,
+        default: Option<Bound<'py, PyAny>>,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        match self.field(py, key)? {
+            Some(value) => Ok(value),
+            None => Ok(default.unwrap_or_else(|| py.None().into_bound(py))),
+        }
+    }
+
+    fn keys<'py>(slf: &Bound<'py, Self>) -> PyResult<Bound<'py, PyAny>> {
+        Self::collections_abc(slf.py(), "KeysView")?.call1((slf,))
+    }
+
+    fn values<'py>(slf: &Bound<'py, Self>) -> PyResult<Bound<'py, PyAny>> {
+        Self::collections_abc(slf.py(), "ValuesView")?.call1((slf,))
+    }
+
+    fn items<'py>(slf: &Bound<'py, Self>) -> PyResult<Bound<'py, PyAny>> {
+        Self::collections_abc(slf.py(), "ItemsView")?.call1((slf,))
+    }
+
+    /// A new dict holding every field, as the non-view queries return.
+    fn to_dict<'py>(&self, py: Python<'py>) -> PyResult<Bound<'py, PyDict>> {
+        to_dict(py, self.record())
+    }
+
+    fn __richcmp__<'py>(
+        &self,
+        py: Python<'py>,
+        other: &Bound<'py, PyAny>,
+        op: CompareOp,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        if !matches!(op, CompareOp::Eq | CompareOp::Ne) {
+            return Ok(py.NotImplemented().into_bound(py));
+        }
+        let equal = if let Ok(other) = other.cast::<ZipcodeView>() {
+            self.record() == other.get().record()
+        } else if other.is_instance(&Self::collections_abc(py, "Mapping")?)? {
+            to_dict(py, self.record())?.eq(other)?
+        } else {
+            return Ok(py.NotImplemented().into_bound(py));
+        };
+        (equal == (op == CompareOp::Eq)).into_bound_py_any(py)
+    }
+
+    fn __repr__(&self, py: Python<'_>) -> PyResult<String> {
+        Ok(format!(
+            "ZipcodeView({})",
+            to_dict(py, self.record())?.repr()?
+        ))
+    }
+}
@@ -0,0 +1,389 @@
+//! `ZipSet`: a read-only sequence of database records, in zip code order.
+//! Every query accepts one as `zips=` and filters it natively, returning
+//! another `ZipSet`; records are converted to Python objects only when they
+//! are accessed.
+
+use std::sync::Arc;
+
+use pyo3::basic::CompareOp;
+use pyo3::exceptions::{PyIndexError, PyTypeError, PyValueError};
+use pyo3::prelude::*;
+use pyo3::types::{PyDict, PyList, PyMapping, PySlice, PyString};
+use pyo3::IntoPyObjectExt;
+use zipcodes::{Database, Record, Zip5};
+
+use crate::view::{self, ZipcodeView};
+use crate::{filters_of, to_dict, to_list, to_pairs, to_record};
+
+/// A read-only sequence of database records in zip code order.
+///
+/// ``ZipSet()`` holds the whole database, and ``ZipSet(zips)`` the records
+/// for an iterable of zipcode dicts, views or zip code strings. Every query
+/// given a ``ZipSet`` as ``zips=`` filters it natively and returns another
+/// ``ZipSet``, so chained queries build no dicts in between. Records become
+/// dicts (or views, with ``views=True``) only when accessed. ``views=None``
+/// takes the ``use_record_views()`` setting, or a given ``ZipSet``'s.
+///
+/// A set holds on to the database it was created from, and queries it even
+/// after ``load_database()`` swaps in another.
+#[pyclass(frozen, sequence, module = "zipcodes._zipcodes")]
+pub(crate) struct ZipSet {
+    /// The snapshot the records belong to, kept alive by the set.
+    db: Arc<Database>,
+    /// The records' zip codes, sorted, without duplicates: the database's
+    /// order.
+    zips: Vec<Zip5>,
+    /// Whether records are materialized as `ZipcodeView`s rather than dicts.
+    views: bool,
+}
+
+impl ZipSet {
+    /// A set of the records of this set's database with zip codes `zips`,
+    /// which must already be in database order. Sets derived from this one
+    /// keep its `views` unless `views` overrides it.
+    fn derive(&self, zips: Vec<Zip5>, views: Option<bool>) -> Self {
+        ZipSet {
+            db: Arc::clone(&self.db),
+            zips,
+            views: views.unwrap_or(self.views),
+        }
+    }
+
+    /// The record at position `i`.
+    fn record(&self, i: usize) -> &Record<'_> {
+        self.db
+            .lookup(self.zips[i].as_str())
+            .expect("a set's records are in its database")
+    }
+
+    /// The records, in order.
+    fn records(&self) -> impl Iterator<Item = &Record<'_>> {
+        (0..self.zips.len()).map(|i| self.record(i))
+    }
+
+    /// The position of the set's record for `zip_code`, if it has one.
+    fn position(&self, zip_code: &str) -> Option<usize> {
+        self.zips
+            .binary_search_by(|zip| zip.as_str().cmp(zip_code))
+            .ok()
+    }
+
+    /// The position of the record `item` equals, as for a list of the
+    /// records: a view of an equal record, or an equal dict.
+    fn position_of(&self, py: Python<'_>, item: &Bound<'_, PyAny>) -> PyResult<Option<usize>> {
+        if let Ok(view) = item.cast::<ZipcodeView>() {
+            let z = view.get().record();
+            return Ok(self
+                .position(z.zip_code().as_str())
+                .filter(|&i| self.record(i) == z));
+        }
+        let Ok(mapping) = item.cast::<PyMapping>() else {
+            return Ok(None);
+        };
+        let Ok(zip_code) = mapping.get_item("zip_code") else {
+            return Ok(None);
+        };
+        let Ok(zip_code) = zip_code.extract::<String>() else {
+            return Ok(None);
+        };
+        match self.position(&zip_code) {
+            Some(i) if to_dict(py, self.record(i))?.eq(item)? => Ok(Some(i)),
+            _ => Ok(None),
+        }
+    }
+
+    /// The zip codes of this set's records that are also in `found`, which
+    /// must be in database order.
+    fn intersect<'a>(&self, found: impl IntoIterator<Item = &'a Record<'a>>) -> Vec<Zip5> {
+        let mut ours = self.zips.iter().copied().peekable();
+        let mut zips = Vec::new();
+        for z in found {
+            let zip = *z.zip_code();
+            while ours.next_if(|&r| r < zip).is_some() {}
+            match ours.peek() {
+                Some(&r) if r == zip => zips.extend(ours.next()),
+                Some(_) => {}
+                None => break,
+            }
+        }
+        zips
+    }
+}
+
+/// The zip code of the record of `db` that `item` stands for: a
+/// `ZipcodeView`'s record, or the record for a zip code string or a mapping's
+/// `"zip_code"`, if it exists.
+fn zip_of(db: &Database, item: &Bound<'_, PyAny>) -> PyResult<Option<Zip5>> {
+    if let Ok(view) = item.cast::<ZipcodeView>() {
+        let zip_code = *view.get().record().zip_code();
+        return Ok(db.lookup(zip_code.as_str()).map(|z| *z.zip_code()));
+    }
+    let zip_code = if item.is_instance_of::<PyString>() {
+        item.clone()
+    } else if let Ok(mapping) = item.cast::<PyMapping>() {
+        mapping.get_item("zip_code")?
+    } else {
+        return Err(PyTypeError::new_err(format!(
+            "expected a zipcode record or zip code string, not {}",
+            item.get_type().name()?
+        )));
+    };
+    Ok(db
+        .lookup(&zip_code.extract::<String>()?)
+        .map(|z| *z.zip_code()))
+}
+
+#[pymethods]
+impl ZipSet {
+    /// The records `zips` stand for (each a record or zip code string), or
+    /// the whole database if `zips` is None.
+    #[new]
+    #[pyo3(signature = (zips=None, views=None))]
+    fn py_new(
+        py: Python<'_>,
+        zips: Option<&Bound<'_, PyAny>>,
+        views: Option<bool>,
+    ) -> PyResult<Self> {
+        if let Some(zips) = zips.and_then(|zips| zips.cast::<ZipSet>().ok()) {
+            return Ok(zips.get().derive(zips.get().zips.clone(), views));
+        }
+        let db = zipcodes::current_database();
+        let views = view::resolve(views);
+        let Some(zips) = zips else {
+            let zips = py.detach(|| db.records().iter().map(|z| *z.zip_code()).collect());
+            return Ok(ZipSet { db, zips, views });
+        };
+        let mut records = Vec::new();
+        for item in zips.try_iter()? {
+            let item = item?;
+            match zip_of(&db, &item)? {
+                Some(zip) => records.push(zip),
+                None => {
+                    return Err(PyValueError::new_err(format!(
+                        "{} is not a zipcode in the database",
+                        item.repr()?
+                    )))
+                }
+            }
+        }
+        records.sort_unstable();
+        records.dedup();
+        Ok(ZipSet {
+            db,
+            zips: records,
+            views,
+        })
+    }
+
+    fn __len__(&self) -> usize {
+        self.zips.len()
+    }
+
+    fn __getitem__<'py>(
+        &self,
+        py: Python<'py>,
+        index: &Bound<'py, PyAny>,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        if let Ok(slice) = index.cast::<PySlice>() {
+            let indices = slice.indices(self.zips.len() as isize)?;
+            let records = (0..indices.slicelength)
+                .map(|i| self.record((indices.start + i as isize * indices.step) as usize));
+            return Ok(to_list(py, &self.db, records, self.views)?.into_any());
+        }
+        let len = self.zips.len() as isize;
+        let mut i: isize = index.extract()?;
+        if i < 0 {
+            i += len;
+        }
+        if !(0..len).contains(&i) {
+            return Err(PyIndexError::new_err("ZipSet index out of range"));
+        }
+        to_record(py, &self.db, self.record(i as usize), self.views)
+    }
+
+    fn __iter__(slf: &Bound<'_, Self>) -> ZipSetIterator {
+        ZipSetIterator {
+            set: slf.clone().unbind(),
+            next: 0,
+        }
+    }
+
+    /// Like a list of the records: true for an equal dict or a view of a
+    /// record in the set.
+    fn __contains__(&self, py: Python<'_>, item: &Bound<'_, PyAny>) -> PyResult<bool> {
+        Ok(self.position_of(py, item)?.is_some())
+    }
+
+    /// Like `list.index`: the position of `value` among the records.
+    #[pyo3(signature = (value, start=0, stop=None))]
+    fn index(
+        &self,
+        py: Python<'_>,
+        value: &Bound<'_, PyAny>,
+        start: isize,
+        stop: Option<isize>,
+    ) -> PyResult<usize> {
+        let len = self.zips.len() as isize;
+        let clamp = |i: isize| (if i < 0 { i + len } else { i }).clamp(0, len) as usize;
+        let range = clamp(start)..clamp(stop.unwrap_or(len));
+        match self.position_of(py, value)? {
+            Some(i) if range.contains(&i) => Ok(i),
+            _ => Err(PyValueError::new_err(format!(
+                "{} is not in ZipSet",
+                value.repr()?
+            ))),
+        }
+    }
+
+    /// Like `list.count`: 1 if `value` is among the records, else 0.
+    fn count(&self, py: Python<'_>, value: &Bound<'_, PyAny>) -> PyResult<usize> {
+        Ok(usize::from(self.position_of(py, value)?.is_some()))
+    }
+
+    fn __richcmp__<'py>(
+        &self,
+        py: Python<'py>,
+        other: &Bound<'py, PyAny>,
+        op: CompareOp,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        if !matches!(op, CompareOp::Eq | CompareOp::Ne) {
+            return Ok(py.NotImplemented().into_bound(py));
+        }
+        let equal = if let Ok(other) = other.cast::<ZipSet>() {
+            self.records().eq(other.get().records())
+        } else if let Ok(other) = other.cast::<PyList>() {
+            to_list(py, &self.db, self.records(), self.views)?.eq(other)?
+        } else {
+            return Ok(py.NotImplemented().into_bound(py));
+        };
+        (equal == (op == CompareOp::Eq)).into_bound_py_any(py)
+    }
+
+    fn __repr__(&self) -> String {
+        format!("<ZipSet of {} zipcodes>", self.zips.len())
+    }
+
+    /// The zip codes of the records, in order.
+    fn zip_codes<'py>(&self, py: Python<'py>) -> PyResult<Bound<'py, PyList>> {
+        PyList::new(py, self.zips.iter().map(Zip5::as_str))
+    }
+
+    /// A new list of the records, as dicts or views.
+    #[pyo3(signature = (views=None))]
+    fn to_list<'py>(&self, py: Python<'py>, views: Option<bool>) -> PyResult<Bound<'py, PyList>> {
+        to_list(py, &self.db, self.records(), views.unwrap_or(self.views))
+    }
+
+    /// `zipcode` arrives pre-validated by the Python shim.
+    #[pyo3(signature = (zipcode, views=None))]
+    fn matching(&self, zipcode: &str, views: Option<bool>) -> Self {
+        let zips = self
+            .position(zipcode)
+            .map(|i| self.zips[i])
+            .into_iter()
+            .collect();
+        self.derive(zips, views)
+    }
+
+    #[pyo3(signature = (prefix, views=None))]
+    fn similar_to(&self, py: Python<'_>, prefix: &str, views: Option<bool>) -> Self {
+        let zips = py.detach(|| self.intersect(self.db.with_prefix(prefix)));
+        self.derive(zips, views)
+    }
+
+    #[pyo3(signature = (fragment, views=None))]
+    fn contains(&self, py: Python<'_>, fragment: &str, views: Option<bool>) -> Self {
+        let zips = py.detach(|| self.intersect(self.db.containing(fragment)));
+        self.derive(zips, views)
+    }
+
+    #[pyo3(signature = (*, views=None, **kwargs))]
+    fn filter_by(
+        &self,
+        py: Python<'_>,
+        views: Option<bool>,
+        kwargs: Option<&Bound<'_, PyDict>>,
+    ) -> PyResult<Self> {
+        let Some(filters) = filters_of(kwargs)? else {
+            return Ok(self.derive(Vec::new(), views));
+        };
+        // Checking the set's own records is cheaper than intersecting it with
+        // the index postings unless the set is most of the database.
+        let zips = py.detach(|| {
+            zipcodes::iter_filter_by_fields(&filters, self.records())
+                .map(|z| *z.zip_code())
+                .collect()
+        });
+        Ok(self.derive(zips, views))
+    }
+
+    #[pyo3(signature = (lat, long, radius_in_miles, views=None))]
+    fn filter_by_coordinates(
+        &self,
+        py: Python<'_>,
+        lat: f64,
+        long: f64,
+        radius_in_miles: f64,
+        views: Option<bool>,
+    ) -> Self {
+        let zips = py.detach(|| self.intersect(self.db.within(lat, long, radius_in_miles)));
+        self.derive(zips, views)
+    }
+
+    /// Pairs of `(record, miles)` for the `k` records of the set closest to
+    /// (`lat`, `long`), nearest first and ties in zip code order.
+    #[pyo3(signature = (lat, long, k, max_radius=None, views=None))]
+    fn nearest<'py>(
+        &self,
+        py: Python<'py>,
+        lat: f64,
+        long: f64,
+        k: usize,
+        max_radius: Option<f64>,
+        views: Option<bool>,
+    ) -> PyResult<Bound<'py, PyList>> {
+        let max_radius = max_radius.unwrap_or(f64::INFINITY);
+        let pairs = py.detach(|| {
+            let mut pairs: Vec<(&Record<'_>, f64)> = self
+                .records()
+                .filter_map(|z| {
+                    let (Ok(z_lat), Ok(z_long)) = (z.lat().parse::<f64>(), z.long().parse::<f64>())
+                    else {
+                        return None;
+                    };
+                    let miles = zipcodes::haversine(z_long, z_lat, long, lat);
+                    (miles <= max_radius).then_some((z, miles))
+                })
+                .collect();
+            // Stable, so records at equal distance stay in zip code order.
+            pairs.sort_by(|a, b| a.1.total_cmp(&b.1));
+            pairs.truncate(k);
+            pairs
+        });
+        to_pairs(py, &self.db, pairs, views.unwrap_or(self.views))
+    }
+}
+
+#[pyclass(module = "zipcodes._zipcodes")]
+pub(crate) struct ZipSetIterator {
+    set: Py<ZipSet>,
+    next: usize,
+}
+
+#[pymethods]
+impl ZipSetIterator {
+    fn __iter__(slf: PyRef<'_, Self>) -> PyRef<'_, Self> {
+        slf
+    }
+
+    fn __next__<'py>(mut slf: PyRefMut<'py, Self>) -> PyResult<Option<Bound<'py, PyAny>>> {
+        let py = slf.py();
+        let this = &mut *slf;
+        let set = this.set.get();
+        if this.next == set.zips.len() {
+            return Ok(None);
+        }
+        this.next += 1;
+        to_record(py, &set.db, set.record(this.next - 1), set.views).map(Some)
+    }
+}
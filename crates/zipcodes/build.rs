@@ -0,0 +1,31 @@
+//! Compiles `src/zips.json.bz2`, the dataset written by
+//! `scripts/update_zipcode_dataset.py`, into the binary layout described in
+//! `src/format.rs`. The crate embeds the result and reads it without
+//! decompressing or parsing JSON at run time.
+
+use std::env;
+use std::fs;
+use std::io::Read;
+use std::path::Path;
+
+use bzip2::read::BzDecoder;
+
+#[path = "src/format.rs"]
+mod format;
+
+const SOURCE: &str = "src/zips.json.bz2";
+
+fn main() {
+    println!("cargo:rerun-if-changed={}", SOURCE);
+    println!("cargo:rerun-if-changed=src/format.rs");
+
+    let mut json = String::new();
+    BzDecoder::new(fs::File::open(SOURCE).expect("failed to open zipcode dataset"))
+        .read_to_string(&mut json)
+        .expect("failed to decompress zipcode dataset");
+    let records: Vec<format::SourceRecord> =
+        serde_json::from_str(&json).expect("failed to deserialize zipcode dataset");
+
+    let out = Path::new(&env::var_os("OUT_DIR").unwrap()).join("zips.bin");
+    fs::write(out, format::encode(&records)).expect("failed to write compiled zipcode dataset");
+}
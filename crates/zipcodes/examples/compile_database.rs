@@ -0,0 +1,34 @@
+//! Compile a dataset in the `zips.json` format, optionally bzip2-compressed,
+//! into a database file for `zipcodes::Database::open`:
+//!
+//! ```text
+//! cargo run -p zipcodes --example compile_database -- zips.json.bz2 zips.bin
+//! ```
+
+use std::env;
+use std::fs;
+use std::io::Read;
+use std::process;
+
+fn main() {
+    let args: Vec<String> = env::args().skip(1).collect();
+    let [source, out] = &args[..] else {
+        eprintln!("usage: compile_database <zips.json[.bz2]> <out.bin>");
+        process::exit(2);
+    };
+    let bytes = fs::read(source).expect("failed to read dataset");
+    let mut json = String::new();
+    if source.ends_with(".bz2") {
+        bzip2::read::BzDecoder::new(&bytes[..])
+            .read_to_string(&mut json)
+            .expect("failed to decompress dataset");
+    } else {
+        json = String::from_utf8(bytes).expect("dataset is not UTF-8");
+    }
+    let database = zipcodes::Database::compile(&json).expect("failed to compile dataset");
+    fs::write(out, &database).expect("failed to write database");
+    let records = zipcodes::Database::from_bytes(database.leak())
+        .expect("compiled database failed to load")
+        .len();
+    println!("wrote {} records to {}", records, out);
+}
@@ -0,0 +1,418 @@
+//! Zipcode databases: the embedded one, and any loaded at run time.
+//!
+//! A [`Database`] owns a parsed dataset and the indexes built over it, each
+//! on first use. The crate's free functions query the default database; the
+//! methods here do the same work on a database of the caller's choosing.
+
+use std::fmt;
+use std::ops::Range;
+use std::path::Path;
+use std::ptr;
+use std::sync::{Arc, LazyLock, Mutex, Once, OnceLock, PoisonError, RwLock};
+
+use crate::dataset::Dataset;
+use crate::format::{self, SourceRecord};
+use crate::index::{self, FieldIndex, IndexedField, SubstringIndex};
+use crate::mmap::Mmap;
+use crate::spatial::{Point, SpatialIndex};
+use crate::{
+    clean_zipcode, parallel, zip_slot, Record, Result, Zip5, Zipcode, ZIPCODE_BYTES, ZIPCODE_LENGTH,
+};
+
+/// Why a database could not be loaded.
+#[derive(thiserror::Error, Debug)]
+#[non_exhaustive]
+pub enum DatabaseError {
+    #[error("failed to read zipcode database: {0}")]
+    Io(#[from] std::io::Error),
+    #[error("not a zipcode database")]
+    Magic,
+    #[error("unsupported format version {0}")]
+    Version(u32),
+    #[error("checksum mismatch")]
+    Checksum,
+    #[error("truncated or corrupt data")]
+    Corrupt,
+    #[error("invalid dataset: {0}")]
+    Json(#[from] serde_json::Error),
+    #[error("zip code {0:?} is not five digits")]
+    InvalidZipCode(String),
+    #[error("zip code {0} appears more than once")]
+    DuplicateZipCode(String),
+}
+
+/// A zipcode database in the binary layout the crate embeds, with its
+/// records decoded and its indexes built as queries first need them.
+///
+/// Build one from a JSON dataset with [`Database::compile`], then load it
+/// with [`Database::open`] to query newer data than the crate was built with:
+///
+/// ```no_run
+/// let db = zipcodes::Database::open("/var/lib/zips.bin")?;
+/// let windsor = db.with_fields(&[("city".to_string(), "Windsor".into())]);
+/// # Ok::<(), zipcodes::DatabaseError>(())
+/// ```
+pub struct Database {
+    dataset: Dataset,
+    substring: OnceLock<SubstringIndex>,
+    spatial: OnceLock<SpatialIndex>,
+    fields: [OnceLock<FieldIndex>; IndexedField::COUNT],
+    /// Owned copies of the records, for the 2.x API; see [`crate::database`].
+    zipcodes: OnceLock<Box<[Zipcode]>>,
+    preloaded: Once,
+    /// Set when [`Current`] publishes the database, so that a snapshot of
+    /// the current database carries its version.
+    version: u64,
+    /// The file [`Database::open`] mapped, which records point into. Declared
+    /// last so that it is unmapped only after everything borrowing it drops.
+    mapping: Option<Mmap>,
+}
+
+impl fmt::Debug for Database {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        f.debug_struct("Database")
+            .field("len", &self.len())
+            .field("loaded", &self.is_loaded())
+            .finish_non_exhaustive()
+    }
+}
+
+impl Database {
+    fn new(dataset: Dataset) -> Self {
+        Database {
+            dataset,
+            substring: OnceLock::new(),
+            spatial: OnceLock::new(),
+            fields: [const { OnceLock::new() }; IndexedField::COUNT],
+            zipcodes: OnceLock::new(),
+            preloaded: Once::new(),
+            version: 0,
+            mapping: None,
+        }
+    }
+
+    /// The database embedded at build time. Its checksum is not verified,
+    /// which would decode nothing but cost every first query a full read.
+    pub(crate) fn embedded() -> Self {
+        Database::new(
+            Dataset::parse(ZIPCODE_BYTES, false)
+                .unwrap_or_else(|e| panic!("failed to decode embedded zipcode database: {}", e)),
+        )
+    }
+
+    /// Map the database file at `path` into memory and check it as
+    /// [`Database::from_bytes`] does; records are decoded from the mapping as
+    /// they are queried.
+    ///
+    /// Records borrow their text from the mapping, which is unmapped when the
+    /// `Database` is dropped. The file must not be modified while mapped:
+    /// replace it by renaming a new file over it.
+    pub fn open(path: impl AsRef<Path>) -> std::result::Result<Self, DatabaseError> {
+        let file = std::fs::File::open(path)?;
+        let map = Mmap::map(&file)?;
+        // SAFETY: the mapped bytes do not move with `map`, which the database
+        // owns and drops last; records borrowing them are only handed out
+        // for as long as the database lives.
+        let bytes: &'static [u8] = unsafe { &*ptr::from_ref::<[u8]>(&map) };
+        let mut database = Database::from_bytes(bytes)?;
+        database.mapping = Some(map);
+        Ok(database)
+    }
+
+    /// Load a database from `bytes`, as produced by [`Database::compile`],
+    /// checking its header and checksum and reading every record once, so
+    /// that no query later trips over malformed data.
+    pub fn from_bytes(bytes: &'static [u8]) -> std::result::Result<Self, DatabaseError> {
+        let dataset = Dataset::parse(bytes, true)?;
+        dataset.validate()?;
+        Ok(Database::new(dataset))
+    }
+
+    /// Compile a dataset in the `zips.json` format the crate is built from
+    /// into the bytes [`Database::open`] and [`Database::from_bytes`] load.
+    ///
+    /// Records are sorted by zip code. Every zip code must be five digits
+    /// and appear once.
+    pub fn compile(json: &str) -> std::result::Result<Vec<u8>, DatabaseError> {
+        let mut records: Vec<SourceRecord> = serde_json::from_str(json)?;
+        if let Some(r) = records.iter().find(|r| Zip5::parse(&r.zip_code).is_none()) {
+            return Err(DatabaseError::InvalidZipCode(r.zip_code.clone()));
+        }
+        records.sort_by(|a, b| a.zip_code.cmp(&b.zip_code));
+        if let Some(pair) = records.windows(2).find(|w| w[0].zip_code == w[1].zip_code) {
+            return Err(DatabaseError::DuplicateZipCode(pair[0].zip_code.clone()));
+        }
+        Ok(format::encode(&records))
+    }
+
+    /// Number of records.
+    pub fn len(&self) -> usize {
+        self.dataset.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    /// Borrow every record, in zip code order.
+    pub fn records(&self) -> &[Record<'_>] {
+        self.dataset.all()
+    }
+
+    /// As [`crate::is_real`], on this database.
+    pub fn is_real(&self, zipcode: &str) -> Result<bool> {
+        let slot = zip_slot(clean_zipcode(zipcode)?);
+        Ok(slot.and_then(|slot| self.dataset.position(slot)).is_some())
+    }
+
+    /// As [`crate::lookup`], on this database.
+    pub fn lookup(&self, zip_code: &str) -> Option<&Record<'_>> {
+        let position = self.dataset.position(zip_slot(zip_code)?)?;
+        Some(self.dataset.get(position))
+    }
+
+    /// As [`crate::with_prefix`], on this database.
+    pub fn with_prefix(&self, prefix: &str) -> &[Record<'_>] {
+        self.dataset.range(self.prefix_range(prefix))
+    }
+
+    /// As [`crate::containing`], on this database.
+    pub fn containing(&self, fragment: &str) -> Vec<&Record<'_>> {
+        if fragment.is_empty() || fragment.len() >= ZIPCODE_LENGTH {
+            return self.with_prefix(fragment).iter().collect();
+        }
+        self.containing_ids(fragment)
+            .into_iter()
+            .map(|i| self.dataset.get(i as usize))
+            .collect()
+    }
+
+    /// As [`crate::filtered`], on this database.
+    pub fn filtered<F>(&self, predicate: F) -> Vec<&Record<'_>>
+    where
+        F: Fn(&Record<'_>) -> bool + Sync,
+    {
+        parallel::filter(self.records(), predicate)
+    }
+
+    /// As [`crate::with_fields`], on this database.
+    pub fn with_fields(&self, filters: &[(String, serde_json::Value)]) -> Vec<&Record<'_>> {
+        let mut postings = Vec::new();
+        let mut residual = Vec::new();
+        for (field, value) in filters {
+            match IndexedField::from_name(field) {
+                Some(indexed) => postings.push(self.field_index(indexed).postings(indexed, value)),
+                None => residual.push((field, value)),
+            }
+        }
+        let matches_residual = |z: &Record<'_>| {
+            residual
+                .iter()
+                .all(|(field, value)| z.field_matches(field, value))
+        };
+        // The field indexes were built over every record, so all are decoded.
+        let zipcodes = self.records();
+        if postings.is_empty() {
+            return parallel::filter(zipcodes, matches_residual);
+        }
+        index::intersect(postings)
+            .into_iter()
+            .map(|i| &zipcodes[i as usize])
+            .filter(|z| matches_residual(z))
+            .collect()
+    }
+
+    /// As [`crate::within`], on this database.
+    pub fn within(&self, lat: f64, long: f64, radius_in_miles: f64) -> Vec<&Record<'_>> {
+        let ids = self
+            .spatial()
+            .within(Point::new(long, lat), radius_in_miles);
+        let zipcodes = self.records();
+        ids.into_iter().map(|i| &zipcodes[i as usize]).collect()
+    }
+
+    /// As [`crate::nearest`], on this database.
+    pub fn nearest(
+        &self,
+        lat: f64,
+        long: f64,
+        k: usize,
+        max_radius_in_miles: Option<f64>,
+    ) -> Vec<(&Record<'_>, f64)> {
+        let ranked = self.spatial().nearest(
+            Point::new(long, lat),
+            k,
+            max_radius_in_miles.unwrap_or(f64::INFINITY),
+        );
+        let zipcodes = self.records();
+        ranked
+            .into_iter()
+            .map(|(i, miles)| (&zipcodes[i as usize], miles))
+            .collect()
+    }
+
+    /// As [`crate::preload`], on this database.
+    pub fn preload(&self) {
+        self.preloaded.call_once(|| {
+            self.records();
+            self.substring();
+            self.spatial();
+            for field in IndexedField::ALL {
+                self.field_index(field);
+            }
+        });
+    }
+
+    /// As [`crate::is_loaded`], on this database.
+    pub fn is_loaded(&self) -> bool {
+        self.preloaded.is_completed()
+    }
+
+    /// The [`crate::database_version`] this database was made current as,
+    /// or 0 if it never was.
+    pub fn version(&self) -> u64 {
+        self.version
+    }
+
+    pub(crate) fn get(&self, position: usize) -> &Record<'_> {
+        self.dataset.get(position)
+    }
+
+    /// Every record as an owned [`Zipcode`], copied on first use.
+    pub(crate) fn zipcodes(&self) -> &[Zipcode] {
+        self.zipcodes
+            .get_or_init(|| self.records().iter().map(Zipcode::from).collect())
+    }
+
+    #[cfg(test)]
+    pub(crate) fn dataset(&self) -> &Dataset {
+        &self.dataset
+    }
+
+    /// Built on the first substring query rather than with the database.
+    fn substring(&self) -> &SubstringIndex {
+        self.substring
+            .get_or_init(|| SubstringIndex::new(self.dataset.slots()))
+    }
+
+    /// Built on the first coordinate query rather than with the database.
+    pub(crate) fn spatial(&self) -> &SpatialIndex {
+        self.spatial
+            .get_or_init(|| SpatialIndex::new(self.records()))
+    }
+
+    /// One inverted index per [`IndexedField`], each built on first use.
+    pub(crate) fn field_index(&self, field: IndexedField) -> &FieldIndex {
+        self.fields[field as usize].get_or_init(|| FieldIndex::new(field, self.records()))
+    }
+
+    /// Ascending positions of the records whose `zip_code` contains `fragment`.
+    pub(crate) fn containing_ids(&self, fragment: &str) -> Vec<u32> {
+        let mut ids: Vec<u32> = self.prefix_range(fragment).map(|i| i as u32).collect();
+        if fragment.is_empty() || fragment.len() >= ZIPCODE_LENGTH {
+            return ids;
+        }
+        let index = self.substring();
+        for offset in 1..=ZIPCODE_LENGTH - fragment.len() {
+            ids.extend_from_slice(index.postings(fragment.as_bytes(), offset));
+        }
+        // A fragment can occur at several offsets of one zip code (e.g. "1" in "10001").
+        ids.sort_unstable();
+        ids.dedup();
+        ids
+    }
+
+    /// An upper bound on the length of [`Database::containing_ids`]: the
+    /// sizes of the runs it merges, without merging them.
+    pub(crate) fn containing_estimate(&self, fragment: &str) -> usize {
+        let prefixed = self.prefix_range(fragment).len();
+        if fragment.is_empty() || fragment.len() >= ZIPCODE_LENGTH {
+            return prefixed;
+        }
+        let index = self.substring();
+        let inner: usize = (1..=ZIPCODE_LENGTH - fragment.len())
+            .map(|offset| index.postings(fragment.as_bytes(), offset).len())
+            .sum();
+        prefixed + inner
+    }
+
+    /// Positions of the records whose `zip_code` starts with `prefix`.
+    ///
+    /// Every zip code is five digits, so the run is the records numerically
+    /// between `prefix` padded with zeros and the next prefix padded with zeros.
+    pub(crate) fn prefix_range(&self, prefix: &str) -> Range<usize> {
+        let bytes = prefix.as_bytes();
+        if bytes.len() > ZIPCODE_LENGTH || !bytes.iter().all(u8::is_ascii_digit) {
+            return 0..0;
+        }
+        let scale = 10usize.pow((ZIPCODE_LENGTH - bytes.len()) as u32);
+        let value = bytes
+            .iter()
+            .fold(0, |value, b| value * 10 + usize::from(b - b'0'));
+        self.dataset.rank(value * scale)..self.dataset.rank((value + 1) * scale)
+    }
+}
+
+/// Parsed on first access; each shard of records is decoded when first used.
+/// A static is never dropped, so the database can be both borrowed for
+/// `'static` and shared with [`Current`].
+static EMBEDDED: LazyLock<Arc<Database>> = LazyLock::new(|| Arc::new(Database::embedded()));
+
+/// The database embedded at build time.
+pub(crate) fn embedded() -> &'static Database {
+    &EMBEDDED
+}
+
+/// A swappable database: the embedded one until [`Current::set`] installs
+/// another.
+///
+/// Readers take a reference-counted snapshot with [`Current::get`] and keep
+/// querying it, indexes included, however many swaps happen meanwhile. A
+/// replaced database is freed once its last snapshot is dropped.
+pub(crate) struct Current {
+    /// None until a database is installed, standing for the embedded one.
+    database: RwLock<Option<Arc<Database>>>,
+    /// The last version published; held across a swap, so that swaps are
+    /// published in version order.
+    swap: Mutex<u64>,
+}
+
+impl Current {
+    pub(crate) const fn new() -> Self {
+        Current {
+            database: RwLock::new(None),
+            swap: Mutex::new(0),
+        }
+    }
+
+    pub(crate) fn get(&self) -> Arc<Database> {
+        let database = self.database.read().unwrap_or_else(PoisonError::into_inner);
+        Arc::clone(database.as_ref().unwrap_or(&EMBEDDED))
+    }
+
+    /// The version of the database [`Current::get`] returns.
+    pub(crate) fn version(&self) -> u64 {
+        let database = self.database.read().unwrap_or_else(PoisonError::into_inner);
+        database.as_ref().map_or(0, |database| database.version)
+    }
+
+    /// Make `database` current and return the new version. If the current
+    /// database was preloaded, `database` is too, before it is swapped in.
+    pub(crate) fn set(&self, mut database: Database) -> u64 {
+        let mut version = self.swap.lock().unwrap_or_else(PoisonError::into_inner);
+        if self.get().is_loaded() {
+            database.preload();
+        }
+        *version += 1;
+        database.version = *version;
+        let replaced = self
+            .database
+            .write()
+            .unwrap_or_else(PoisonError::into_inner)
+            .replace(Arc::new(database));
+        // If no snapshot of it remains, the replaced database is freed here,
+        // with the lock released.
+        drop(replaced);
+        *version
+    }
+}
@@ -0,0 +1,449 @@
+//! Decoding of the binary database laid out by [`crate::format`].
+//!
+//! Parsing only validates the header and shard directory; databases loaded
+//! at run time are also read through once by `Dataset::validate`. Records
+//! live in one preallocated array and each shard fills in its range the first
+//! time any of its records is asked for, so a point lookup decodes the
+//! records of a single 3-digit prefix and a full scan decodes the remaining
+//! shards.
+//!
+//! Decoded records point straight into the encoded bytes for their text.
+//! They are stored as `Record<'static>`, but only ever handed out borrowed
+//! from the dataset, so whoever owns the bytes must keep them alive until
+//! the dataset is dropped.
+
+use std::cell::UnsafeCell;
+use std::mem::MaybeUninit;
+use std::ops::Range;
+use std::sync::{Once, OnceLock};
+
+use crate::format::{crc32, CHECKSUMMED_FROM, MAGIC, SHARDS, SHARD_SLOTS, VERSION};
+use crate::parallel;
+use crate::{DatabaseError, Record, Str, Zip5, ZipCodeType};
+
+type Result<T> = std::result::Result<T, DatabaseError>;
+
+/// A cursor over the encoded bytes.
+struct Reader<'a> {
+    bytes: &'a [u8],
+}
+
+impl<'a> Reader<'a> {
+    fn take(&mut self, len: usize) -> Result<&'a [u8]> {
+        if len > self.bytes.len() {
+            return Err(DatabaseError::Corrupt);
+        }
+        let (head, tail) = self.bytes.split_at(len);
+        self.bytes = tail;
+        Ok(head)
+    }
+
+    fn u32(&mut self) -> Result<u32> {
+        Ok(u32::from_le_bytes(self.take(4)?.try_into().unwrap()))
+    }
+
+    fn u128(&mut self) -> Result<u128> {
+        Ok(u128::from_le_bytes(self.take(16)?.try_into().unwrap()))
+    }
+
+    fn u32s(&mut self, len: u32) -> Result<U32s<'a>> {
+        let bytes = self.take(len as usize * 4)?;
+        Ok(U32s(bytes))
+    }
+
+    fn varint(&mut self) -> Result<u32> {
+        let mut value = 0u32;
+        for shift in (0..32).step_by(7) {
+            let byte = *self.take(1)?.first().unwrap();
+            value |= u32::from(byte & 0x7f) << shift;
+            if byte & 0x80 == 0 {
+                return Ok(value);
+            }
+        }
+        Err(DatabaseError::Corrupt)
+    }
+}
+
+/// An unaligned array of little-endian `u32`s.
+#[derive(Clone, Copy)]
+struct U32s<'a>(&'a [u8]);
+
+impl U32s<'_> {
+    fn len(&self) -> usize {
+        self.0.len() / 4
+    }
+
+    fn get(&self, i: usize) -> Result<u32> {
+        let bytes = self.0.get(i * 4..i * 4 + 4).ok_or(DatabaseError::Corrupt)?;
+        Ok(u32::from_le_bytes(bytes.try_into().unwrap()))
+    }
+
+    /// The range between the end of item `i - 1` and the end of item `i`.
+    fn span(&self, i: usize) -> Result<Range<usize>> {
+        let start = if i == 0 { 0 } else { self.get(i - 1)? };
+        Ok(start as usize..self.get(i)? as usize)
+    }
+
+    fn last(&self) -> Result<u32> {
+        match self.len() {
+            0 => Ok(0),
+            len => self.get(len - 1),
+        }
+    }
+}
+
+/// The string and list tables the records refer to, as encoded.
+struct Tables {
+    string_ends: U32s<'static>,
+    blob: &'static [u8],
+    list_ends: U32s<'static>,
+    list_items: U32s<'static>,
+}
+
+impl Tables {
+    /// Validate the string blob and resolve every list item, which records
+    /// then share.
+    fn text(&self) -> Result<Text> {
+        let blob = std::str::from_utf8(self.blob).map_err(|_| DatabaseError::Corrupt)?;
+        let mut text = Text {
+            string_ends: self.string_ends,
+            blob,
+            list_ends: self.list_ends,
+            list_items: Box::default(),
+        };
+        text.list_items = (0..self.list_items.len())
+            .map(|i| text.string(self.list_items.get(i)?))
+            .collect::<Result<_>>()?;
+        Ok(text)
+    }
+}
+
+/// The decoded tables: strings and lists that records borrow.
+struct Text {
+    string_ends: U32s<'static>,
+    blob: &'static str,
+    list_ends: U32s<'static>,
+    /// Owned by the dataset, which drops it only after its records.
+    list_items: Box<[Str<'static>]>,
+}
+
+impl Text {
+    fn string(&self, id: u32) -> Result<Str<'static>> {
+        let span = self.string_ends.span(id as usize)?;
+        let s = self.blob.get(span).ok_or(DatabaseError::Corrupt)?;
+        Ok(Str::new(s))
+    }
+
+    fn list(&self, id: u32) -> Result<&'static [Str<'static>]> {
+        let span = self.list_ends.span(id as usize)?;
+        let items = self.list_items.get(span).ok_or(DatabaseError::Corrupt)?;
+        // SAFETY: the boxed items never move, and records borrowing them are
+        // only handed out for as long as the dataset holding `self` lives.
+        Ok(unsafe { &*std::ptr::from_ref(items) })
+    }
+}
+
+/// Reads records field by field, resolving ids against the tables.
+struct Records<'a> {
+    reader: Reader<'static>,
+    text: &'a Text,
+}
+
+impl Records<'_> {
+    fn string(&mut self) -> Result<Str<'static>> {
+        let id = self.reader.varint()?;
+        self.text.string(id)
+    }
+
+    fn list(&mut self) -> Result<&'static [Str<'static>]> {
+        let id = self.reader.varint()?;
+        self.text.list(id)
+    }
+
+    fn flag(&mut self) -> Result<bool> {
+        match self.reader.varint()? {
+            0 => Ok(false),
+            1 => Ok(true),
+            _ => Err(DatabaseError::Corrupt),
+        }
+    }
+
+    fn zip_code_type(&mut self) -> Result<ZipCodeType<'static>> {
+        let name = self.string()?;
+        Ok(ZipCodeType::from_name(&name).unwrap_or(ZipCodeType::Other(name)))
+    }
+
+    /// Fields are read in the order they are written, which is `zips.json` order.
+    fn record(&mut self, slot: usize) -> Result<Record<'static>> {
+        Ok(Record {
+            zip_code: Zip5::from_number(slot as u32),
+            zip_code_type: self.zip_code_type()?,
+            active: self.flag()?,
+            city: self.string()?,
+            acceptable_cities: self.list()?,
+            unacceptable_cities: self.list()?,
+            state: self.string()?,
+            county: self.string()?,
+            timezone: self.string()?,
+            area_codes: self.list()?,
+            world_region: self.string()?,
+            country: self.string()?,
+            lat: self.string()?,
+            long: self.string()?,
+        })
+    }
+}
+
+/// The records of one 3-digit zip code prefix.
+struct Shard {
+    /// Bit `k` is set if the zip code ending in the two digits `k` exists.
+    presence: u128,
+    /// Position of the shard's first record.
+    start: u32,
+    /// The shard's bytes within the records section.
+    bytes: Range<usize>,
+    decoded: Once,
+}
+
+impl Shard {
+    /// Slots of the shard's records, ascending.
+    fn slots(&self, shard: usize) -> impl Iterator<Item = usize> + Clone + '_ {
+        (0..SHARD_SLOTS)
+            .filter(|k| self.presence & (1 << k) != 0)
+            .map(move |k| shard * SHARD_SLOTS + k)
+    }
+}
+
+#[repr(transparent)]
+struct Slot(UnsafeCell<MaybeUninit<Record<'static>>>);
+
+// Decoded records are never dropped, which is only free while they own nothing.
+const _: () = assert!(!std::mem::needs_drop::<Record<'static>>());
+
+/// A parsed database whose shards are decoded on first use.
+pub(crate) struct Dataset {
+    tables: Tables,
+    /// Built when the first shard is decoded.
+    text: OnceLock<Text>,
+    records: &'static [u8],
+    shards: Box<[Shard]>,
+    slots: Box<[Slot]>,
+    /// Completed once every shard is decoded, letting lookups skip the shards.
+    complete: Once,
+}
+
+// SAFETY: a shard's slots are only written inside its `Once`, before any
+// reference to them is handed out, and never again until `drop`.
+unsafe impl Sync for Dataset {}
+
+impl Dataset {
+    /// Validate the header and shard directory of an encoded database, and
+    /// with `verify`, its checksum.
+    pub(crate) fn parse(bytes: &'static [u8], verify: bool) -> Result<Self> {
+        let mut reader = Reader { bytes };
+        if reader.take(MAGIC.len()).ok() != Some(&MAGIC[..]) {
+            return Err(DatabaseError::Magic);
+        }
+        match reader.u32()? {
+            VERSION => {}
+            version => return Err(DatabaseError::Version(version)),
+        }
+        let checksum = reader.u32()?;
+        if verify && crc32(&bytes[CHECKSUMMED_FROM..]) != checksum {
+            return Err(DatabaseError::Checksum);
+        }
+        let count = reader.u32()?;
+        let strings = reader.u32()?;
+        let lists = reader.u32()?;
+
+        let mut shards = Vec::with_capacity(SHARDS);
+        let (mut start, mut byte_start) = (0u32, 0usize);
+        for _ in 0..SHARDS {
+            let presence = reader.u128()?;
+            let end = reader.u32()? as usize;
+            if presence >> SHARD_SLOTS != 0 || end < byte_start {
+                return Err(DatabaseError::Corrupt);
+            }
+            shards.push(Shard {
+                presence,
+                start,
+                bytes: byte_start..end,
+                decoded: Once::new(),
+            });
+            start += presence.count_ones();
+            byte_start = end;
+        }
+        if start != count {
+            return Err(DatabaseError::Corrupt);
+        }
+
+        let string_ends = reader.u32s(strings)?;
+        let list_ends = reader.u32s(lists)?;
+        let list_items = reader.u32s(list_ends.last()?)?;
+        let blob = reader.take(string_ends.last()? as usize)?;
+        if reader.bytes.len() != byte_start {
+            return Err(DatabaseError::Corrupt);
+        }
+        Ok(Dataset {
+            tables: Tables {
+                string_ends,
+                blob,
+                list_ends,
+                list_items,
+            },
+            text: OnceLock::new(),
+            records: reader.bytes,
+            shards: shards.into_boxed_slice(),
+            slots: (0..count)
+                .map(|_| Slot(UnsafeCell::new(MaybeUninit::uninit())))
+                .collect(),
+            complete: Once::new(),
+        })
+    }
+
+    /// Number of records.
+    pub(crate) fn len(&self) -> usize {
+        self.slots.len()
+    }
+
+    /// Number of records whose 5-digit zip code is numerically below `slot`.
+    pub(crate) fn rank(&self, slot: usize) -> usize {
+        match self.shards.get(slot / SHARD_SLOTS) {
+            Some(shard) => {
+                let below = shard.presence & ((1 << (slot % SHARD_SLOTS)) - 1);
+                (shard.start + below.count_ones()) as usize
+            }
+            None => self.len(),
+        }
+    }
+
+    /// Position of the record for the 5-digit zip code `slot`, if it exists.
+    pub(crate) fn position(&self, slot: usize) -> Option<usize> {
+        let shard = self.shards.get(slot / SHARD_SLOTS)?;
+        (shard.presence & (1 << (slot % SHARD_SLOTS)) != 0).then(|| self.rank(slot))
+    }
+
+    /// The 5-digit zip code of every record, as a number, in order. Needs
+    /// no decoding.
+    pub(crate) fn slots(&self) -> impl Iterator<Item = usize> + Clone + '_ {
+        self.shards
+            .iter()
+            .enumerate()
+            .flat_map(|(i, shard)| shard.slots(i))
+    }
+
+    pub(crate) fn get(&self, position: usize) -> &Record<'_> {
+        &self.range(position..position + 1)[0]
+    }
+
+    pub(crate) fn all(&self) -> &[Record<'_>] {
+        // Shards are independent, so with several threads each decodes a run.
+        self.complete.call_once(|| {
+            parallel::map_runs(SHARDS, 64, |shards| shards.for_each(|i| self.decode(i)));
+        });
+        self.records_at(0..self.len())
+    }
+
+    /// The records at `positions`, decoding the shards they fall in.
+    pub(crate) fn range(&self, positions: Range<usize>) -> &[Record<'_>] {
+        assert!(positions.start <= positions.end && positions.end <= self.len());
+        if !positions.is_empty() && !self.complete.is_completed() {
+            let first = self.shard_of(positions.start);
+            let last = self.shard_of(positions.end - 1);
+            for shard in first..=last {
+                self.decode(shard);
+            }
+        }
+        self.records_at(positions)
+    }
+
+    /// The records at `positions`, which must all belong to decoded shards.
+    fn records_at(&self, positions: Range<usize>) -> &[Record<'_>] {
+        // SAFETY: every slot in `positions` belongs to a decoded shard, and
+        // `Slot` is layout-compatible with `Record`.
+        unsafe {
+            std::slice::from_raw_parts(
+                self.slots
+                    .as_ptr()
+                    .add(positions.start)
+                    .cast::<Record<'static>>(),
+                positions.len(),
+            )
+        }
+    }
+
+    #[cfg(test)]
+    pub(crate) fn decoded_shards(&self) -> usize {
+        self.shards
+            .iter()
+            .filter(|s| s.decoded.is_completed())
+            .count()
+    }
+
+    fn shard_of(&self, position: usize) -> usize {
+        self.shards
+            .partition_point(|s| s.start as usize <= position)
+            - 1
+    }
+
+    /// Read every record into a scratch value, so that a database loaded at
+    /// run time is rejected up front rather than when a query first reaches
+    /// a bad shard. Costs about as much as one full decode.
+    pub(crate) fn validate(&self) -> Result<()> {
+        let text = self.text()?;
+        for i in 0..SHARDS {
+            self.read_shard(i, text, |_, _| {})?;
+        }
+        Ok(())
+    }
+
+    /// The decoded tables, built the first time they are needed.
+    fn text(&self) -> Result<&Text> {
+        if let Some(text) = self.text.get() {
+            return Ok(text);
+        }
+        let text = self.tables.text()?;
+        Ok(self.text.get_or_init(|| text))
+    }
+
+    /// Read the records of shard `i` in order, passing each to `each` with
+    /// its position, and check that they fill the shard's bytes exactly.
+    fn read_shard(
+        &self,
+        i: usize,
+        text: &Text,
+        mut each: impl FnMut(usize, Record<'static>),
+    ) -> Result<()> {
+        let shard = &self.shards[i];
+        let mut records = Records {
+            reader: Reader {
+                bytes: &self.records[shard.bytes.clone()],
+            },
+            text,
+        };
+        let start = shard.start as usize;
+        for (position, slot) in (start..).zip(shard.slots(i)) {
+            each(position, records.record(slot)?);
+        }
+        if !records.reader.bytes.is_empty() {
+            return Err(DatabaseError::Corrupt);
+        }
+        Ok(())
+    }
+
+    /// Decode shard `i` into its slots, once. The embedded database is built
+    /// by `build.rs` and loaded ones are validated, so this cannot fail.
+    fn decode(&self, i: usize) {
+        self.shards[i].decoded.call_once(|| {
+            self.text()
+                .and_then(|text| {
+                    self.read_shard(i, text, |position, record| {
+                        // SAFETY: only this `Once` writes the shard's slots,
+                        // and no reference to them exists until it completes.
+                        unsafe { (*self.slots[position].0.get()).write(record) };
+                    })
+                })
+                .unwrap_or_else(|e| panic!("failed to decode zipcode database: {}", e));
+        });
+    }
+}
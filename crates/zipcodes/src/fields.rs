@@ -0,0 +1,209 @@
+//! Compact field types for [`Record`](crate::Record)s.
+//!
+//! Text fields reference strings stored once for the whole database, zip
+//! codes are stored inline and zip code types are an enum, so a record holds
+//! no heap allocations of its own. Each type dereferences to `str`, compares
+//! equal to string values and serializes as the string it stands for.
+
+use std::borrow::Borrow;
+use std::fmt;
+use std::ops::Deref;
+
+use serde::de::Error as _;
+use serde::{Deserialize, Deserializer, Serialize, Serializer};
+
+use crate::ZIPCODE_LENGTH;
+
+/// Implement the string-like traits for a type with an `as_str` method,
+/// generic over the lifetimes listed after `impl`, if any.
+macro_rules! str_like {
+    (impl<$($lt:lifetime),*> $ty:ty) => {
+        impl<$($lt),*> Deref for $ty {
+            type Target = str;
+
+            fn deref(&self) -> &str {
+                self.as_str()
+            }
+        }
+
+        impl<$($lt),*> AsRef<str> for $ty {
+            fn as_ref(&self) -> &str {
+                self.as_str()
+            }
+        }
+
+        impl<$($lt),*> fmt::Display for $ty {
+            fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+                fmt::Display::fmt(self.as_str(), f)
+            }
+        }
+
+        impl<$($lt),*> fmt::Debug for $ty {
+            fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+                fmt::Debug::fmt(self.as_str(), f)
+            }
+        }
+
+        impl<$($lt),*> PartialEq<str> for $ty {
+            fn eq(&self, other: &str) -> bool {
+                self.as_str() == other
+            }
+        }
+
+        impl<$($lt),*> PartialEq<&str> for $ty {
+            fn eq(&self, other: &&str) -> bool {
+                self.as_str() == *other
+            }
+        }
+
+        impl<$($lt),*> PartialEq<String> for $ty {
+            fn eq(&self, other: &String) -> bool {
+                self.as_str() == other
+            }
+        }
+
+        impl<$($lt),*> PartialEq<$ty> for str {
+            fn eq(&self, other: &$ty) -> bool {
+                self == other.as_str()
+            }
+        }
+
+        impl<$($lt),*> PartialEq<$ty> for &str {
+            fn eq(&self, other: &$ty) -> bool {
+                *self == other.as_str()
+            }
+        }
+
+        impl<$($lt),*> PartialEq<$ty> for String {
+            fn eq(&self, other: &$ty) -> bool {
+                self == other.as_str()
+            }
+        }
+
+        impl<$($lt),*> Serialize for $ty {
+            fn serialize<S: Serializer>(&self, serializer: S) -> Result<S::Ok, S::Error> {
+                serializer.serialize_str(self.as_str())
+            }
+        }
+    };
+    ($ty:ty) => {
+        str_like!(impl<> $ty);
+    };
+}
+
+/// An immutable string shared by every record holding the same value,
+/// borrowed from the database that stores it.
+#[derive(Clone, Copy, Default, PartialEq, Eq, Hash, PartialOrd, Ord)]
+pub struct Str<'a>(&'a str);
+
+impl<'a> Str<'a> {
+    /// Wrap a string without copying it.
+    pub const fn new(s: &'a str) -> Self {
+        Str(s)
+    }
+
+    pub const fn as_str(&self) -> &'a str {
+        self.0
+    }
+}
+
+str_like!(impl<'a> Str<'a>);
+
+impl Borrow<str> for Str<'_> {
+    fn borrow(&self) -> &str {
+        self.0
+    }
+}
+
+impl<'a> From<&'a str> for Str<'a> {
+    fn from(s: &'a str) -> Self {
+        Str(s)
+    }
+}
+
+/// A 5-digit zip code, stored inline.
+#[derive(Clone, Copy, PartialEq, Eq, Hash, PartialOrd, Ord)]
+pub struct Zip5([u8; ZIPCODE_LENGTH]);
+
+impl Zip5 {
+    /// The zip code whose digits spell `number`, zero-padded.
+    ///
+    /// Panics if `number` has more than five digits.
+    pub fn from_number(number: u32) -> Self {
+        assert!(number < 100_000, "{} is not a 5-digit zip code", number);
+        let mut digits = [b'0'; ZIPCODE_LENGTH];
+        let mut rest = number;
+        for digit in digits.iter_mut().rev() {
+            *digit = b'0' + (rest % 10) as u8;
+            rest /= 10;
+        }
+        Zip5(digits)
+    }
+
+    /// The zip code spelled by `s`, if it is exactly five ASCII digits.
+    pub fn parse(s: &str) -> Option<Self> {
+        let digits: [u8; ZIPCODE_LENGTH] = s.as_bytes().try_into().ok()?;
+        digits
+            .iter()
+            .all(u8::is_ascii_digit)
+            .then_some(Zip5(digits))
+    }
+
+    /// The number the zip code's digits spell.
+    pub fn number(&self) -> u32 {
+        self.0
+            .iter()
+            .fold(0, |number, b| number * 10 + u32::from(b - b'0'))
+    }
+
+    pub fn as_str(&self) -> &str {
+        std::str::from_utf8(&self.0).expect("zip codes are ASCII digits")
+    }
+}
+
+str_like!(Zip5);
+
+impl<'de> Deserialize<'de> for Zip5 {
+    fn deserialize<D: Deserializer<'de>>(deserializer: D) -> Result<Self, D::Error> {
+        let s = String::deserialize(deserializer)?;
+        Zip5::parse(&s).ok_or_else(|| D::Error::custom(format!("invalid zip code {:?}", s)))
+    }
+}
+
+/// The USPS classification of a zip code.
+#[derive(Clone, Copy, PartialEq, Eq, Hash)]
+#[non_exhaustive]
+pub enum ZipCodeType<'a> {
+    Standard,
+    PoBox,
+    Unique,
+    Military,
+    /// A type this version does not know, as named in the dataset.
+    Other(Str<'a>),
+}
+
+impl<'a> ZipCodeType<'a> {
+    /// The known type with the given dataset name, such as `"PO BOX"`.
+    pub fn from_name(name: &str) -> Option<Self> {
+        Some(match name {
+            "STANDARD" => ZipCodeType::Standard,
+            "PO BOX" => ZipCodeType::PoBox,
+            "UNIQUE" => ZipCodeType::Unique,
+            "MILITARY" => ZipCodeType::Military,
+            _ => return None,
+        })
+    }
+
+    /// The dataset name of the type, such as `"PO BOX"`.
+    pub const fn as_str(&self) -> &'a str {
+        match self {
+            ZipCodeType::Standard => "STANDARD",
+            ZipCodeType::PoBox => "PO BOX",
+            ZipCodeType::Unique => "UNIQUE",
+            ZipCodeType::Military => "MILITARY",
+            ZipCodeType::Other(name) => name.as_str(),
+        }
+    }
+}
+
+str_like!(impl<'a> ZipCodeType<'a>);
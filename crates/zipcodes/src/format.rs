@@ -0,0 +1,247 @@
+//! The binary layout the embedded database is compiled into by `build.rs`.
+//!
+//! This file is also included by the build script, so it depends on nothing
+//! from the rest of the crate. All integers are little-endian:
+//!
+//! ```text
+//! magic "ZIPC" | version u32 | checksum u32
+//! records u32  | strings u32 | lists u32
+//! shards       [(presence u128, end u32); SHARDS]
+//! string ends  [u32; strings]   byte offset one past each string in the blob
+//! list ends    [u32; lists]     index one past each list in the list items
+//! list items   [u32; ..]        string ids
+//! string blob  UTF-8
+//! records      per record, one LEB128 varint per field after `zip_code`, in
+//!              `zips.json` order: a string id, a list id, or 0/1 for `active`
+//! ```
+//!
+//! `checksum` is the CRC-32 of every byte after it, so that a database file
+//! loaded at run time can be checked before any of it is trusted.
+//!
+//! Records are sorted by zip code and grouped into one shard per 3-digit
+//! prefix. Bit `k` of a shard's `presence` is set if the zip code made of its
+//! prefix followed by the two digits `k` exists, which places every record
+//! without storing its zip code; `end` is the offset one past the shard's
+//! last record byte, so each shard decodes independently of the others.
+//!
+//! Strings and lists are deduplicated and numbered most frequent first, so
+//! the ids of common values (states, time zones, ...) fit in one byte.
+
+use std::collections::HashMap;
+
+use serde::Deserialize;
+
+pub(crate) const MAGIC: &[u8; 4] = b"ZIPC";
+pub(crate) const VERSION: u32 = 3;
+
+/// Bytes before the checksummed part: magic, version and checksum.
+pub(crate) const CHECKSUMMED_FROM: usize = 12;
+
+/// One shard per 3-digit zip code prefix.
+pub(crate) const SHARDS: usize = 1000;
+
+/// Zip codes per shard, one per value of the last two digits.
+pub(crate) const SHARD_SLOTS: usize = 100;
+
+/// A record as it appears in `zips.json`.
+#[derive(Deserialize)]
+pub(crate) struct SourceRecord {
+    pub zip_code: String,
+    pub zip_code_type: String,
+    pub active: bool,
+    pub city: String,
+    pub acceptable_cities: Vec<String>,
+    pub unacceptable_cities: Vec<String>,
+    pub state: String,
+    pub county: String,
+    pub timezone: String,
+    pub area_codes: Vec<String>,
+    pub world_region: String,
+    pub country: String,
+    pub lat: String,
+    pub long: String,
+}
+
+/// Numbers distinct values most frequent first, ties in first-seen order.
+struct Table<T> {
+    ids: HashMap<T, u32>,
+    values: Vec<T>,
+}
+
+impl<T: Clone + Eq + std::hash::Hash> Table<T> {
+    fn new<'a>(values: impl IntoIterator<Item = &'a T>) -> Self
+    where
+        T: 'a,
+    {
+        let mut counts: HashMap<&T, (usize, usize)> = HashMap::new();
+        for value in values {
+            let seen = counts.len();
+            counts.entry(value).or_insert((0, seen)).0 += 1;
+        }
+        let mut ranked: Vec<_> = counts.into_iter().collect();
+        ranked.sort_by_key(|&(_, (count, seen))| (std::cmp::Reverse(count), seen));
+        let values: Vec<T> = ranked.into_iter().map(|(v, _)| v.clone()).collect();
+        let ids = values
+            .iter()
+            .enumerate()
+            .map(|(id, v)| (v.clone(), id as u32))
+            .collect();
+        Table { ids, values }
+    }
+
+    fn id(&self, value: &T) -> u32 {
+        self.ids[value]
+    }
+}
+
+/// The CRC-32 (IEEE) of `bytes`.
+pub(crate) fn crc32(bytes: &[u8]) -> u32 {
+    const TABLE: [u32; 256] = {
+        let mut table = [0; 256];
+        let mut i = 0;
+        while i < 256 {
+            let mut crc = i as u32;
+            let mut bit = 0;
+            while bit < 8 {
+                crc = if crc & 1 == 1 {
+                    0xedb8_8320 ^ (crc >> 1)
+                } else {
+                    crc >> 1
+                };
+                bit += 1;
+            }
+            table[i] = crc;
+            i += 1;
+        }
+        table
+    };
+    !bytes.iter().fold(!0, |crc: u32, &b| {
+        TABLE[usize::from(crc as u8 ^ b)] ^ (crc >> 8)
+    })
+}
+
+fn push_u32(out: &mut Vec<u8>, value: u32) {
+    out.extend_from_slice(&value.to_le_bytes());
+}
+
+fn push_varint(out: &mut Vec<u8>, mut value: u32) {
+    while value >= 0x80 {
+        out.push(value as u8 | 0x80);
+        value >>= 7;
+    }
+    out.push(value as u8);
+}
+
+/// Lay out `records` in the format described above, in the order given.
+///
+/// Panics unless the zip codes are unique, sorted, 5-digit strings.
+pub(crate) fn encode(records: &[SourceRecord]) -> Vec<u8> {
+    let slots: Vec<usize> = records
+        .iter()
+        .map(|r| {
+            let zip = &r.zip_code;
+            assert!(
+                zip.len() == 5 && zip.bytes().all(|b| b.is_ascii_digit()),
+                "zip code {:?} is not five digits",
+                zip
+            );
+            zip.parse().unwrap()
+        })
+        .collect();
+    assert!(
+        slots.windows(2).all(|w| w[0] < w[1]),
+        "zip codes must be unique and sorted"
+    );
+
+    let lists = Table::new(
+        records
+            .iter()
+            .flat_map(|r| [&r.acceptable_cities, &r.unacceptable_cities, &r.area_codes]),
+    );
+    let strings = Table::new(
+        records
+            .iter()
+            .flat_map(|r| {
+                [
+                    &r.zip_code_type,
+                    &r.city,
+                    &r.state,
+                    &r.county,
+                    &r.timezone,
+                    &r.world_region,
+                    &r.country,
+                    &r.lat,
+                    &r.long,
+                ]
+            })
+            .chain(lists.values.iter().flatten()),
+    );
+
+    let mut out = Vec::new();
+    out.extend_from_slice(MAGIC);
+    push_u32(&mut out, VERSION);
+    push_u32(&mut out, 0); // The checksum, filled in last.
+    for n in [
+        records.len() as u32,
+        strings.values.len() as u32,
+        lists.values.len() as u32,
+    ] {
+        push_u32(&mut out, n);
+    }
+    let mut body = Vec::new();
+    let mut shards = vec![(0u128, 0u32); SHARDS];
+    for (r, slot) in records.iter().zip(slots) {
+        let string = |s: &String| strings.id(s);
+        let list = |l: &Vec<String>| lists.id(l);
+        for field in [
+            string(&r.zip_code_type),
+            u32::from(r.active),
+            string(&r.city),
+            list(&r.acceptable_cities),
+            list(&r.unacceptable_cities),
+            string(&r.state),
+            string(&r.county),
+            string(&r.timezone),
+            list(&r.area_codes),
+            string(&r.world_region),
+            string(&r.country),
+            string(&r.lat),
+            string(&r.long),
+        ] {
+            push_varint(&mut body, field);
+        }
+        shards[slot / SHARD_SLOTS].0 |= 1 << (slot % SHARD_SLOTS);
+        shards[slot / SHARD_SLOTS].1 = body.len() as u32;
+    }
+    // Shards without records end where the previous one did.
+    for i in 1..SHARDS {
+        if shards[i].0 == 0 {
+            shards[i].1 = shards[i - 1].1;
+        }
+    }
+    for (presence, end) in shards {
+        out.extend_from_slice(&presence.to_le_bytes());
+        push_u32(&mut out, end);
+    }
+
+    let mut end = 0;
+    for s in &strings.values {
+        end += s.len() as u32;
+        push_u32(&mut out, end);
+    }
+    let mut end = 0;
+    for list in &lists.values {
+        end += list.len() as u32;
+        push_u32(&mut out, end);
+    }
+    for s in lists.values.iter().flatten() {
+        push_u32(&mut out, strings.id(s));
+    }
+    for s in &strings.values {
+        out.extend_from_slice(s.as_bytes());
+    }
+    out.extend_from_slice(&body);
+    let checksum = crc32(&out[CHECKSUMMED_FROM..]);
+    out[CHECKSUMMED_FROM - 4..CHECKSUMMED_FROM].copy_from_slice(&checksum.to_le_bytes());
+    out
+}
@@ -0,0 +1,218 @@
+//! Secondary indexes over a zip-code-sorted slice of records.
+//!
+//! Indexes store record positions (`u32`) rather than references, so they can
+//! be built once and shared alongside the records they describe.
+
+use std::collections::HashMap;
+
+use serde_json::Value;
+
+use crate::{Record, ZIPCODE_LENGTH};
+
+/// Position-aware n-gram index over the 5-digit `zip_code` strings.
+///
+/// For every fragment length `1..ZIPCODE_LENGTH` and every offset greater
+/// than zero, it keeps a posting list of the records with that fragment at
+/// that offset. Offset zero needs no postings: those records are a
+/// contiguous prefix run of the sorted database. Full-length fragments are
+/// likewise answered by the prefix run.
+///
+/// Postings are stored CSR-style: `ids[offsets[key]..offsets[key + 1]]` is the
+/// ascending list of record positions for `key`.
+pub(crate) struct SubstringIndex {
+    offsets: Box<[u32]>,
+    ids: Box<[u32]>,
+}
+
+impl SubstringIndex {
+    /// Index the zip codes given as numbers, in record order.
+    pub(crate) fn new(zip_codes: impl Iterator<Item = usize> + Clone) -> Self {
+        let mut counts = vec![0u32; Self::key_count() + 1];
+        Self::for_each_key(zip_codes.clone(), |key, _| counts[key + 1] += 1);
+        for i in 1..counts.len() {
+            counts[i] += counts[i - 1];
+        }
+        let offsets = counts.clone().into_boxed_slice();
+        let mut ids = vec![0u32; *counts.last().unwrap_or(&0) as usize];
+        Self::for_each_key(zip_codes, |key, id| {
+            ids[counts[key] as usize] = id;
+            counts[key] += 1;
+        });
+        SubstringIndex {
+            offsets,
+            ids: ids.into_boxed_slice(),
+        }
+    }
+
+    /// Ascending record positions whose `zip_code` holds the digit string
+    /// `fragment` at byte offset `offset`. `offset` must be non-zero.
+    pub(crate) fn postings(&self, fragment: &[u8], offset: usize) -> &[u32] {
+        match Self::key(fragment, offset) {
+            Some(key) => &self.ids[self.offsets[key] as usize..self.offsets[key + 1] as usize],
+            None => &[],
+        }
+    }
+
+    /// Call `f(key, position)` for every indexed n-gram of every record.
+    fn for_each_key(zip_codes: impl Iterator<Item = usize>, mut f: impl FnMut(usize, u32)) {
+        for (id, zip_code) in zip_codes.enumerate() {
+            let zip = format!("{:05}", zip_code);
+            let zip = zip.as_bytes();
+            for len in 1..ZIPCODE_LENGTH {
+                for offset in 1..=zip.len().saturating_sub(len) {
+                    if let Some(key) = Self::key(&zip[offset..offset + len], offset) {
+                        f(key, id as u32);
+                    }
+                }
+            }
+        }
+    }
+
+    fn key_count() -> usize {
+        (1..ZIPCODE_LENGTH)
+            .map(|len| (ZIPCODE_LENGTH - len) * 10usize.pow(len as u32))
+            .sum()
+    }
+
+    /// Dense key for a digit `fragment` at a non-zero `offset`, grouped by
+    /// fragment length, then offset, then numeric value.
+    fn key(fragment: &[u8], offset: usize) -> Option<usize> {
+        let len = fragment.len();
+        if len == 0
+            || len >= ZIPCODE_LENGTH
+            || offset == 0
+            || offset + len > ZIPCODE_LENGTH
+            || !fragment.iter().all(u8::is_ascii_digit)
+        {
+            return None;
+        }
+        let base: usize = (1..len)
+            .map(|l| (ZIPCODE_LENGTH - l) * 10usize.pow(l as u32))
+            .sum();
+        let value = fragment
+            .iter()
+            .fold(0, |value, b| value * 10 + usize::from(b - b'0'));
+        Some(base + (offset - 1) * 10usize.pow(len as u32) + value)
+    }
+}
+
+/// The low-cardinality fields that get an inverted [`FieldIndex`].
+#[derive(Clone, Copy, Debug, PartialEq, Eq)]
+pub(crate) enum IndexedField {
+    State,
+    County,
+    City,
+    Timezone,
+    ZipCodeType,
+    Country,
+    WorldRegion,
+    Active,
+}
+
+impl IndexedField {
+    pub(crate) const COUNT: usize = 8;
+
+    pub(crate) const ALL: [IndexedField; IndexedField::COUNT] = [
+        IndexedField::State,
+        IndexedField::County,
+        IndexedField::City,
+        IndexedField::Timezone,
+        IndexedField::ZipCodeType,
+        IndexedField::Country,
+        IndexedField::WorldRegion,
+        IndexedField::Active,
+    ];
+
+    /// The indexed field with the given name, if any.
+    pub(crate) fn from_name(field: &str) -> Option<Self> {
+        Some(match field {
+            "state" => IndexedField::State,
+            "county" => IndexedField::County,
+            "city" => IndexedField::City,
+            "timezone" => IndexedField::Timezone,
+            "zip_code_type" => IndexedField::ZipCodeType,
+            "country" => IndexedField::Country,
+            "world_region" => IndexedField::WorldRegion,
+            "active" => IndexedField::Active,
+            _ => return None,
+        })
+    }
+
+    fn key_of(self, z: &Record<'_>) -> FieldKey {
+        let text = match self {
+            IndexedField::State => z.state.as_str(),
+            IndexedField::County => z.county.as_str(),
+            IndexedField::City => z.city.as_str(),
+            IndexedField::Timezone => z.timezone.as_str(),
+            IndexedField::ZipCodeType => z.zip_code_type.as_str(),
+            IndexedField::Country => z.country.as_str(),
+            IndexedField::WorldRegion => z.world_region.as_str(),
+            IndexedField::Active => return FieldKey::Bool(z.active),
+        };
+        FieldKey::Str(text.into())
+    }
+
+    /// The key a filter value would have to equal, following the same typing
+    /// rules as [`Record::field_matches`]; None if it can match no record.
+    fn key_for(self, value: &Value) -> Option<FieldKey> {
+        match self {
+            IndexedField::Active => value.as_bool().map(FieldKey::Bool),
+            _ => value.as_str().map(|s| FieldKey::Str(s.into())),
+        }
+    }
+}
+
+#[derive(Debug, PartialEq, Eq, Hash)]
+enum FieldKey {
+    Str(Box<str>),
+    Bool(bool),
+}
+
+/// Inverted index from the distinct values of one field to the ascending
+/// positions of the records holding them.
+pub(crate) struct FieldIndex {
+    postings: HashMap<FieldKey, Box<[u32]>>,
+}
+
+impl FieldIndex {
+    pub(crate) fn new(field: IndexedField, zipcodes: &[Record<'_>]) -> Self {
+        let mut postings: HashMap<FieldKey, Vec<u32>> = HashMap::new();
+        for (id, z) in zipcodes.iter().enumerate() {
+            postings.entry(field.key_of(z)).or_default().push(id as u32);
+        }
+        FieldIndex {
+            postings: postings
+                .into_iter()
+                .map(|(key, ids)| (key, ids.into_boxed_slice()))
+                .collect(),
+        }
+    }
+
+    /// Ascending positions of the records whose field equals `value`.
+    pub(crate) fn postings(&self, field: IndexedField, value: &Value) -> &[u32] {
+        field
+            .key_for(value)
+            .and_then(|key| self.postings.get(&key))
+            .map_or(&[], |ids| ids)
+    }
+}
+
+/// Intersect ascending id lists, walking the shortest and probing the rest.
+pub(crate) fn intersect(mut lists: Vec<&[u32]>) -> Vec<u32> {
+    lists.sort_unstable_by_key(|ids| ids.len());
+    let Some((smallest, rest)) = lists.split_first() else {
+        return Vec::new();
+    };
+    let mut cursors = vec![0usize; rest.len()];
+    smallest
+        .iter()
+        .copied()
+        .filter(|id| {
+            rest.iter().zip(cursors.iter_mut()).all(|(ids, cursor)| {
+                // Ids only grow, so each probe resumes where the last ended.
+                *cursor += ids[*cursor..].partition_point(|other| other < id);
+                ids.get(*cursor) == Some(id)
+            })
+        })
+        .collect()
+}
@@ -1,29 +1,54 @@
 //! Query U.S. zipcodes without SQLite.
 //!
-//! The full zipcode dataset is embedded into the binary at compile time via
-//! [`include_bytes!`] and lazily decompressed/parsed on first access, making
-//! this crate suitable for constrained environments (AWS Lambda, containers)
-//! with no runtime file I/O.
+//! The full zipcode dataset is compiled into a compact binary layout by the
+//! build script, embedded into the binary via [`include_bytes!`], and lazily
+//! decoded on first access, making this crate suitable for constrained
+//! environments (AWS Lambda, containers) with no runtime file I/O.
+//!
+//! Newer data can be loaded without rebuilding or restarting:
+//! [`Database::compile`] lays out a dataset in the same format, and
+//! [`load_database`] maps such a file in place of the current database,
+//! which the functions returning owned [`Zipcode`]s query. The functions
+//! borrowing [`Record`]s for `'static`, such as [`lookup`] and
+//! [`with_prefix`], always query the embedded database; query a
+//! [`current_database`] snapshot to borrow from a loaded one.
 
-use std::io::prelude::*;
-use std::sync::LazyLock;
+use std::path::Path;
+use std::sync::Arc;
 
-use bzip2::read::BzDecoder;
 use serde::{Deserialize, Serialize};
 
+pub use database::{Database, DatabaseError};
+pub use fields::{Str, Zip5, ZipCodeType};
+#[cfg(feature = "parallel")]
+pub use parallel::{set_threads, threads};
+pub use query::{query, Matches, Query, SharedMatches};
+
+use database::{embedded, Current};
+use spatial::Point;
+
+mod database;
+mod dataset;
+mod fields;
+mod format;
+mod index;
+mod mmap;
+mod parallel;
+mod query;
+mod spatial;
+
 const ZIPCODE_LENGTH: usize = 5;
 
-static ZIPCODE_BYTES_BZIP: &[u8] = include_bytes!("zips.json.bz2");
+/// `zips.json.bz2` as laid out by `build.rs`; see [`format`].
+static ZIPCODE_BYTES: &[u8] = include_bytes!(concat!(env!("OUT_DIR"), "/zips.bin"));
+
+/// The database the owned free functions query: the embedded one, parsed on
+/// first access, until [`set_database`] swaps in another.
+static DATABASE: Current = Current::new();
 
-static ZIPCODES: LazyLock<Vec<Zipcode>> = LazyLock::new(|| {
-    let mut decompressor = BzDecoder::new(ZIPCODE_BYTES_BZIP);
-    let mut zipcode_json = String::new();
-    decompressor
-        .read_to_string(&mut zipcode_json)
-        .expect("failed to decompress embedded zipcode database");
-    serde_json::from_str::<Vec<Zipcode>>(&zipcode_json)
-        .unwrap_or_else(|e| panic!("failed to deserialize zipcode database: {}", e))
-});
+fn db() -> Arc<Database> {
+    DATABASE.get()
+}
 
 /// Describes different types of errors with supplied zipcodes during parsing.
 #[derive(thiserror::Error, Debug)]
@@ -38,6 +63,10 @@ pub enum Error {
 pub type Result<T> = std::result::Result<T, Error>;
 
 /// A record in the zipcode database.
+///
+/// Queries returning owned records, such as [`matching`] and [`list_all`],
+/// copy them out of the database as `Zipcode`s. Borrowing queries, such as
+/// [`lookup`], return the database's own compact [`Record`]s instead.
 #[derive(Clone, Debug, PartialEq, Serialize, Deserialize)]
 pub struct Zipcode {
     pub acceptable_cities: Vec<String>,
@@ -91,41 +120,299 @@ impl Zipcode {
     }
 }
 
+impl From<&Record<'_>> for Zipcode {
+    fn from(z: &Record<'_>) -> Self {
+        let strings = |items: &[Str]| items.iter().map(|s| s.to_string()).collect();
+        Zipcode {
+            acceptable_cities: strings(z.acceptable_cities),
+            active: z.active,
+            area_codes: strings(z.area_codes),
+            city: z.city.to_string(),
+            country: z.country.to_string(),
+            county: z.county.to_string(),
+            lat: z.lat.to_string(),
+            long: z.long.to_string(),
+            state: z.state.to_string(),
+            timezone: z.timezone.to_string(),
+            unacceptable_cities: strings(z.unacceptable_cities),
+            world_region: z.world_region.to_string(),
+            zip_code: z.zip_code.to_string(),
+            zip_code_type: z.zip_code_type.to_string(),
+        }
+    }
+}
+
+impl PartialEq<Record<'_>> for Zipcode {
+    fn eq(&self, other: &Record<'_>) -> bool {
+        other == self
+    }
+}
+
+/// A record as the database stores it, borrowed from the database.
+///
+/// Records own no heap memory: text fields are [`Str`]s shared across the
+/// database, lists are shared slices, and the zip code and its type are
+/// stored inline. Fields are read through accessors named after the
+/// [`Zipcode`] fields; each text value dereferences to `str`, so
+/// `z.state() == "CT"` and `z.lat().parse::<f64>()` work as on a `Zipcode`.
+/// `Zipcode::from` copies one out.
+#[derive(Clone, Debug, PartialEq, Serialize)]
+pub struct Record<'a> {
+    pub(crate) acceptable_cities: &'a [Str<'a>],
+    pub(crate) active: bool,
+    pub(crate) area_codes: &'a [Str<'a>],
+    pub(crate) city: Str<'a>,
+    pub(crate) country: Str<'a>,
+    pub(crate) county: Str<'a>,
+    pub(crate) lat: Str<'a>,
+    pub(crate) long: Str<'a>,
+    pub(crate) state: Str<'a>,
+    pub(crate) timezone: Str<'a>,
+    pub(crate) unacceptable_cities: &'a [Str<'a>],
+    pub(crate) world_region: Str<'a>,
+    pub(crate) zip_code: Zip5,
+    pub(crate) zip_code_type: ZipCodeType<'a>,
+}
+
+impl<'a> Record<'a> {
+    pub fn acceptable_cities(&self) -> &'a [Str<'a>] {
+        self.acceptable_cities
+    }
+
+    pub fn active(&self) -> bool {
+        self.active
+    }
+
+    pub fn area_codes(&self) -> &'a [Str<'a>] {
+        self.area_codes
+    }
+
+    pub fn city(&self) -> &'a str {
+        self.city.as_str()
+    }
+
+    pub fn country(&self) -> &'a str {
+        self.country.as_str()
+    }
+
+    pub fn county(&self) -> &'a str {
+        self.county.as_str()
+    }
+
+    /// Latitude as it appears in the dataset, e.g. `"41.2913"`.
+    pub fn lat(&self) -> &'a str {
+        self.lat.as_str()
+    }
+
+    /// Longitude as it appears in the dataset, e.g. `"-72.3850"`.
+    pub fn long(&self) -> &'a str {
+        self.long.as_str()
+    }
+
+    pub fn state(&self) -> &'a str {
+        self.state.as_str()
+    }
+
+    pub fn timezone(&self) -> &'a str {
+        self.timezone.as_str()
+    }
+
+    pub fn unacceptable_cities(&self) -> &'a [Str<'a>] {
+        self.unacceptable_cities
+    }
+
+    pub fn world_region(&self) -> &'a str {
+        self.world_region.as_str()
+    }
+
+    pub fn zip_code(&self) -> &Zip5 {
+        &self.zip_code
+    }
+
+    pub fn zip_code_type(&self) -> &ZipCodeType<'a> {
+        &self.zip_code_type
+    }
+
+    /// Compare a named field against a JSON value, mirroring the Python
+    /// package's `filter_by(**kwargs)` semantics: an unknown field name or a
+    /// type mismatch is simply not a match.
+    pub fn field_matches(&self, field: &str, value: &serde_json::Value) -> bool {
+        use serde_json::Value;
+        fn eq_list(items: &[Str], value: &Value) -> bool {
+            match value {
+                Value::Array(arr) => {
+                    arr.len() == items.len()
+                        && arr
+                            .iter()
+                            .zip(items)
+                            .all(|(v, s)| v.as_str() == Some(s.as_str()))
+                }
+                _ => false,
+            }
+        }
+        match field {
+            "zip_code" => value.as_str() == Some(self.zip_code.as_str()),
+            "zip_code_type" => value.as_str() == Some(self.zip_code_type.as_str()),
+            "active" => value.as_bool() == Some(self.active),
+            "city" => value.as_str() == Some(self.city.as_str()),
+            "acceptable_cities" => eq_list(self.acceptable_cities, value),
+            "unacceptable_cities" => eq_list(self.unacceptable_cities, value),
+            "state" => value.as_str() == Some(self.state.as_str()),
+            "county" => value.as_str() == Some(self.county.as_str()),
+            "timezone" => value.as_str() == Some(self.timezone.as_str()),
+            "area_codes" => eq_list(self.area_codes, value),
+            "world_region" => value.as_str() == Some(self.world_region.as_str()),
+            "country" => value.as_str() == Some(self.country.as_str()),
+            "lat" => value.as_str() == Some(self.lat.as_str()),
+            "long" => value.as_str() == Some(self.long.as_str()),
+            _ => false,
+        }
+    }
+}
+
+impl PartialEq<Zipcode> for Record<'_> {
+    fn eq(&self, other: &Zipcode) -> bool {
+        let eq_list = |items: &[Str], other: &[String]| items.iter().eq(other);
+        eq_list(self.acceptable_cities, &other.acceptable_cities)
+            && self.active == other.active
+            && eq_list(self.area_codes, &other.area_codes)
+            && self.city == other.city
+            && self.country == other.country
+            && self.county == other.county
+            && self.lat == other.lat
+            && self.long == other.long
+            && self.state == other.state
+            && self.timezone == other.timezone
+            && eq_list(self.unacceptable_cities, &other.unacceptable_cities)
+            && self.world_region == other.world_region
+            && self.zip_code == other.zip_code
+            && self.zip_code_type == other.zip_code_type
+    }
+}
+
 /// Determine whether a supplied zipcode matches any existing zipcode. The supplied
 /// zipcode must be of the format: "#####", "#####-####", or "##### ####".
 pub fn matching(zipcode: &str, zipcodes: Option<Vec<Zipcode>>) -> Result<Vec<Zipcode>> {
     let zipcode = clean_zipcode(zipcode)?;
-    let zipcodes = zipcodes.as_deref().unwrap_or(&ZIPCODES);
-    Ok(zipcodes
-        .iter()
-        .filter(|z| z.zip_code == zipcode)
-        .cloned()
-        .collect())
+    match zipcodes {
+        Some(zipcodes) => Ok(zipcodes
+            .into_iter()
+            .filter(|z| z.zip_code == zipcode)
+            .collect()),
+        None => Ok(db()
+            .lookup(zipcode)
+            .into_iter()
+            .map(Zipcode::from)
+            .collect()),
+    }
+}
+
+/// Iterate over the records of `source` matching a supplied zipcode, which
+/// is cleaned and validated as by [`matching`], without copying them.
+///
+/// Pass [`iter_all()`] to search every record, or any slice or iterator of
+/// records, such as the result of another query, to narrow it.
+pub fn iter_matching<'a, I>(
+    zipcode: &str,
+    source: I,
+) -> Result<impl Iterator<Item = &'a Record<'a>> + use<'a, I>>
+where
+    I: IntoIterator<Item = &'a Record<'a>>,
+{
+    let zip = Zip5::parse(clean_zipcode(zipcode)?).ok_or(Error::InvalidFormat)?;
+    Ok(source.into_iter().filter(move |z| z.zip_code == zip))
 }
 
 /// Returns true if the supplied zipcode exists in the database.
 pub fn is_real(zipcode: &str) -> Result<bool> {
-    Ok(!matching(zipcode, None)?.is_empty())
+    db().is_real(zipcode)
+}
+
+/// Borrow the record for an exact 5-digit `zip_code` in constant time.
+///
+/// Unlike [`matching`], the input is not cleaned: anything other than exactly
+/// five ASCII digits (including zip+4 forms) is simply not found. Only the
+/// records sharing the zip code's 3-digit prefix are decoded.
+pub fn lookup(zip_code: &str) -> Option<&'static Record<'static>> {
+    embedded().lookup(zip_code)
 }
 
 /// Return the zipcodes whose `zip_code` starts with the supplied prefix.
 pub fn similar_to(prefix: &str, zipcodes: Option<Vec<Zipcode>>) -> Vec<Zipcode> {
-    let zipcodes = zipcodes.as_deref().unwrap_or(&ZIPCODES);
-    zipcodes
-        .iter()
-        .filter(|z| z.zip_code.starts_with(prefix))
-        .cloned()
-        .collect()
+    match zipcodes {
+        Some(zipcodes) => zipcodes
+            .into_iter()
+            .filter(|z| z.zip_code.starts_with(prefix))
+            .collect(),
+        None => db().with_prefix(prefix).iter().map(Zipcode::from).collect(),
+    }
+}
+
+/// Iterate over the records of `source` whose `zip_code` starts with the
+/// supplied prefix, without copying them.
+///
+/// Over the whole database, [`with_prefix`] finds the same records without
+/// scanning.
+pub fn iter_similar_to<'a, 'p, I>(
+    prefix: &'p str,
+    source: I,
+) -> impl Iterator<Item = &'a Record<'a>> + use<'a, 'p, I>
+where
+    I: IntoIterator<Item = &'a Record<'a>>,
+{
+    source
+        .into_iter()
+        .filter(move |z| z.zip_code.starts_with(prefix))
+}
+
+/// Borrow the contiguous run of records whose `zip_code` starts with `prefix`.
+///
+/// The database is sorted by `zip_code`, so the run is located from the shard
+/// directory without decoding anything, and only the shards it spans are
+/// decoded.
+pub fn with_prefix(prefix: &str) -> &'static [Record<'static>] {
+    embedded().with_prefix(prefix)
 }
 
 /// Return the zipcodes whose `zip_code` contains the supplied fragment anywhere.
 pub fn contains(fragment: &str, zipcodes: Option<Vec<Zipcode>>) -> Vec<Zipcode> {
-    let zipcodes = zipcodes.as_deref().unwrap_or(&ZIPCODES);
-    zipcodes
-        .iter()
-        .filter(|z| z.zip_code.contains(fragment))
-        .cloned()
-        .collect()
+    match zipcodes {
+        Some(zipcodes) => zipcodes
+            .into_iter()
+            .filter(|z| z.zip_code.contains(fragment))
+            .collect(),
+        None => db()
+            .containing(fragment)
+            .into_iter()
+            .map(Zipcode::from)
+            .collect(),
+    }
+}
+
+/// Iterate over the records of `source` whose `zip_code` contains the
+/// supplied fragment anywhere, without copying them.
+///
+/// Over the whole database, [`containing`] finds the same records without
+/// scanning.
+pub fn iter_contains<'a, 'f, I>(
+    fragment: &'f str,
+    source: I,
+) -> impl Iterator<Item = &'a Record<'a>> + use<'a, 'f, I>
+where
+    I: IntoIterator<Item = &'a Record<'a>>,
+{
+    source
+        .into_iter()
+        .filter(move |z| z.zip_code.contains(fragment))
+}
+
+/// Borrow the records whose `zip_code` contains `fragment`, in database order.
+///
+/// Occurrences at the start of the zip code come from the sorted prefix run;
+/// every other offset is a posting-list lookup in a position-aware n-gram
+/// index, so no record is compared against the fragment.
+pub fn containing(fragment: &str) -> Vec<&'static Record<'static>> {
+    embedded().containing(fragment)
 }
 
 /// Using a supplied list of filter-functions, return a filtered list of zipcodes.
@@ -136,7 +423,8 @@ pub fn filter_by<F>(filters: Vec<F>, zipcodes: Option<Vec<Zipcode>>) -> Result<V
 where
     F: Fn(&Zipcode) -> bool,
 {
-    let zipcodes = zipcodes.as_deref().unwrap_or(&ZIPCODES);
+    let db = db();
+    let zipcodes = zipcodes.as_deref().unwrap_or_else(|| db.zipcodes());
     Ok(zipcodes
         .iter()
         .filter(|z| filters.iter().all(|f| f(z)))
@@ -144,6 +432,32 @@ where
         .collect())
 }
 
+/// Iterate over the records of `source` that pass every one of the supplied
+/// filter-functions, without copying them.
+pub fn iter_filter_by<'a, 'f, F, I>(
+    filters: &'f [F],
+    source: I,
+) -> impl Iterator<Item = &'a Record<'a>> + use<'a, 'f, F, I>
+where
+    F: Fn(&Record<'_>) -> bool,
+    I: IntoIterator<Item = &'a Record<'a>>,
+{
+    source
+        .into_iter()
+        .filter(move |z| filters.iter().all(|f| f(z)))
+}
+
+/// Borrow the records satisfying `predicate`, in database order.
+///
+/// Unlike [`filter_by`], the predicate must be `Sync`, so that with the
+/// `parallel` feature the scan can be split across [`threads`] threads.
+pub fn filtered<F>(predicate: F) -> Vec<&'static Record<'static>>
+where
+    F: Fn(&Record<'_>) -> bool + Sync,
+{
+    embedded().filtered(predicate)
+}
+
 /// Return the zipcodes whose named fields equal the supplied JSON values.
 ///
 /// All `(field, value)` pairs must match. An unknown field name matches
@@ -152,33 +466,56 @@ pub fn filter_by_fields(
     filters: &[(String, serde_json::Value)],
     zipcodes: Option<Vec<Zipcode>>,
 ) -> Vec<Zipcode> {
-    let zipcodes = zipcodes.as_deref().unwrap_or(&ZIPCODES);
-    zipcodes
-        .iter()
-        .filter(|z| {
-            filters
-                .iter()
-                .all(|(field, value)| z.field_matches(field, value))
-        })
-        .cloned()
-        .collect()
+    match zipcodes {
+        Some(zipcodes) => zipcodes
+            .into_iter()
+            .filter(|z| {
+                filters
+                    .iter()
+                    .all(|(field, value)| z.field_matches(field, value))
+            })
+            .collect(),
+        None => db()
+            .with_fields(filters)
+            .into_iter()
+            .map(Zipcode::from)
+            .collect(),
+    }
+}
+
+/// Iterate over the records of `source` whose named fields equal the
+/// supplied JSON values, as [`filter_by_fields`] compares them, without
+/// copying them.
+///
+/// Over the whole database, [`with_fields`] answers the same filters from
+/// its indexes.
+pub fn iter_filter_by_fields<'a, 'f, I>(
+    filters: &'f [(String, serde_json::Value)],
+    source: I,
+) -> impl Iterator<Item = &'a Record<'a>> + use<'a, 'f, I>
+where
+    I: IntoIterator<Item = &'a Record<'a>>,
+{
+    source
+        .into_iter()
+        .filter(move |z| matches_fields(z, filters))
+}
+
+/// Borrow the records whose named fields equal the supplied JSON values, in
+/// database order.
+///
+/// Filters on `state`, `county`, `city`, `timezone`, `zip_code_type`,
+/// `country`, `world_region` and `active` are answered from lazily built
+/// inverted indexes, intersected smallest-first; any other filters are then
+/// checked against the surviving records only.
+pub fn with_fields(filters: &[(String, serde_json::Value)]) -> Vec<&'static Record<'static>> {
+    embedded().with_fields(filters)
 }
 
 /// Calculate the great circle distance in miles between two points on the
 /// earth, specified in decimal degrees.
 pub fn haversine(lon1: f64, lat1: f64, lon2: f64, lat2: f64) -> f64 {
-    let (lon1, lat1, lon2, lat2) = (
-        lon1.to_radians(),
-        lat1.to_radians(),
-        lon2.to_radians(),
-        lat2.to_radians(),
-    );
-    let dlon = lon2 - lon1;
-    let dlat = lat2 - lat1;
-    let a = (dlat / 2.0).sin().powi(2) + lat1.cos() * lat2.cos() * (dlon / 2.0).sin().powi(2);
-    let c = 2.0 * a.sqrt().asin();
-    let r = 3956.0; // Radius of earth in miles. Use 6371 for kilometers.
-    c * r
+    Point::new(lon1, lat1).miles_to(&Point::new(lon2, lat2))
 }
 
 /// Return the zipcodes within `radius_in_miles` of the supplied coordinates.
@@ -190,25 +527,148 @@ pub fn filter_by_coordinates(
     radius_in_miles: f64,
     zipcodes: Option<Vec<Zipcode>>,
 ) -> Vec<Zipcode> {
-    let zipcodes = zipcodes.as_deref().unwrap_or(&ZIPCODES);
-    zipcodes
-        .iter()
-        .filter(|z| match (z.lat.parse::<f64>(), z.long.parse::<f64>()) {
-            (Ok(z_lat), Ok(z_long)) => haversine(z_long, z_lat, long, lat) <= radius_in_miles,
-            _ => false,
-        })
-        .cloned()
-        .collect()
+    match zipcodes {
+        Some(zipcodes) => zipcodes
+            .into_iter()
+            .filter(|z| within_radius(&z.lat, &z.long, lat, long, radius_in_miles))
+            .collect(),
+        None => db()
+            .within(lat, long, radius_in_miles)
+            .into_iter()
+            .map(Zipcode::from)
+            .collect(),
+    }
+}
+
+/// Iterate over the records of `source` within `radius_in_miles` of the
+/// supplied coordinates, without copying them.
+///
+/// Records whose stored coordinates fail to parse are excluded. Over the
+/// whole database, [`within`] finds the same records from its grid index.
+pub fn iter_filter_by_coordinates<'a, I>(
+    lat: f64,
+    long: f64,
+    radius_in_miles: f64,
+    source: I,
+) -> impl Iterator<Item = &'a Record<'a>> + use<'a, I>
+where
+    I: IntoIterator<Item = &'a Record<'a>>,
+{
+    source
+        .into_iter()
+        .filter(move |z| within_radius(&z.lat, &z.long, lat, long, radius_in_miles))
+}
+
+/// Borrow the records within `radius_in_miles` of the supplied coordinates, in
+/// database order.
+///
+/// Coordinates are parsed once and bucketed into a one-degree grid on first
+/// use; only the cells overlapping the search radius are visited, and a
+/// bounding-box check precedes the exact haversine distance.
+pub fn within(lat: f64, long: f64, radius_in_miles: f64) -> Vec<&'static Record<'static>> {
+    embedded().within(lat, long, radius_in_miles)
+}
+
+/// Borrow the `k` records closest to the supplied coordinates, paired with
+/// their distance in miles, nearest first.
+///
+/// Only records within `max_radius_in_miles` are considered, when given.
+/// Records at equal distance are returned in database order, and records
+/// whose stored coordinates fail to parse are excluded.
+pub fn nearest(
+    lat: f64,
+    long: f64,
+    k: usize,
+    max_radius_in_miles: Option<f64>,
+) -> Vec<(&'static Record<'static>, f64)> {
+    embedded().nearest(lat, long, k, max_radius_in_miles)
 }
 
 /// Retrieve a list of all zipcodes in the database.
 pub fn list_all() -> Vec<Zipcode> {
-    ZIPCODES.clone()
+    db().records().iter().map(Zipcode::from).collect()
+}
+
+/// Iterate over every record in the embedded database without copying them.
+pub fn iter_all() -> std::slice::Iter<'static, Record<'static>> {
+    embedded().records().iter()
+}
+
+/// Decode the whole database and build every index now, instead of on the
+/// queries that first need them.
+///
+/// Call it at startup (or on a background thread) to keep that one-time cost
+/// off the request path. Concurrent and repeated calls do the work once;
+/// queries made meanwhile wait only for the parts they use.
+pub fn preload() {
+    db().preload()
+}
+
+/// Whether [`preload`] has finished, so that no query will pay a one-time
+/// decoding or indexing cost.
+pub fn is_loaded() -> bool {
+    db().is_loaded()
 }
 
-/// Borrow the full embedded zipcode database without copying it.
+/// Borrow the full embedded zipcode database as [`Zipcode`]s.
+///
+/// The owned copies are made on the first call, and kept; [`iter_all`]
+/// borrows the database's own records without copying them.
 pub fn database() -> &'static [Zipcode] {
-    &ZIPCODES
+    embedded().zipcodes()
+}
+
+/// Take a snapshot of the database the owned free functions currently query.
+///
+/// Queries made through it see the same data, and its records stay valid,
+/// even if [`set_database`] swaps in another database meanwhile.
+pub fn current_database() -> Arc<Database> {
+    db()
+}
+
+/// Atomically make `database` the one the owned free functions of this crate
+/// and [`current_database`] query, and return the new [`database_version`].
+///
+/// Queries already running and snapshots taken with [`current_database`]
+/// keep using the database they started with; no query sees a mix of the
+/// two. If the current database was [preloaded](preload), `database` is
+/// preloaded before it is swapped in, so no query pays for warming it up.
+/// The replaced database is freed once its last snapshot is dropped.
+pub fn set_database(database: Database) -> u64 {
+    DATABASE.set(database)
+}
+
+/// [Open](Database::open) the database file at `path`, which
+/// [`Database::compile`] produces, and [`set_database`] it.
+pub fn load_database(path: impl AsRef<Path>) -> std::result::Result<u64, DatabaseError> {
+    Ok(set_database(Database::open(path)?))
+}
+
+/// A number that changes whenever [`set_database`] swaps the database, for
+/// keying caches of query results. It starts at 0 with the embedded database.
+pub fn database_version() -> u64 {
+    DATABASE.version()
+}
+
+/// Whether `z` passes every `(field, value)` filter.
+fn matches_fields(z: &Record<'_>, filters: &[(String, serde_json::Value)]) -> bool {
+    filters
+        .iter()
+        .all(|(field, value)| z.field_matches(field, value))
+}
+
+/// Whether the stored coordinates `z_lat`, `z_long` lie within
+/// `radius_in_miles` of (`lat`, `long`).
+fn within_radius(z_lat: &str, z_long: &str, lat: f64, long: f64, radius_in_miles: f64) -> bool {
+    match (z_lat.parse::<f64>(), z_long.parse::<f64>()) {
+        (Ok(z_lat), Ok(z_long)) => haversine(z_long, z_lat, long, lat) <= radius_in_miles,
+        _ => false,
+    }
+}
+
+/// Map a zip code to its number, if it is exactly five ASCII digits.
+fn zip_slot(zip_code: &str) -> Option<usize> {
+    Zip5::parse(zip_code).map(|zip| zip.number() as usize)
 }
 
 fn clean_zipcode(zipcode: &str) -> Result<&str> {
@@ -228,6 +688,10 @@ mod tests {
     use super::*;
     use serde_json::json;
 
+    fn records() -> &'static [Record<'static>] {
+        embedded().records()
+    }
+
     #[test]
     fn should_find_real_zipcodes() {
         assert!(is_real("06903").unwrap());
@@ -242,7 +706,7 @@ mod tests {
 
     #[test]
     fn database_invariants() {
-        let db = database();
+        let db = records();
         assert!(
             db.len() > 40_000 && db.len() < 50_000,
             "unexpected database size: {}",
@@ -260,6 +724,24 @@ mod tests {
         );
     }
 
+    #[test]
+    fn lookup_agrees_with_a_full_scan() {
+        for z in records() {
+            assert_eq!(lookup(&z.zip_code), Some(z));
+        }
+        for zc in &[
+            "91239",
+            "00000",
+            "0690",
+            "069033",
+            "06903-1234",
+            "0690a",
+            "",
+        ] {
+            assert!(lookup(zc).is_none(), "{:?} should not be found", zc);
+        }
+    }
+
     #[test]
     fn should_not_find_fake_zipcodes() {
         assert!(!is_real("91239").unwrap());
@@ -311,11 +793,348 @@ mod tests {
         );
     }
 
+    #[test]
+    fn embedded_database_matches_source_json() {
+        use std::io::Read;
+        let mut json = String::new();
+        bzip2::read::BzDecoder::new(&include_bytes!("zips.json.bz2")[..])
+            .read_to_string(&mut json)
+            .unwrap();
+        let source: serde_json::Value = serde_json::from_str(&json).unwrap();
+        assert_eq!(serde_json::to_value(records()).unwrap(), source);
+        let owned: Vec<Zipcode> = serde_json::from_str(&json).unwrap();
+        assert_eq!(database(), owned);
+        assert!(owned.iter().eq(records()));
+    }
+
+    #[test]
+    fn should_reject_corrupt_databases() {
+        use dataset::Dataset;
+        assert!(matches!(
+            Dataset::parse(b"JSON", true),
+            Err(DatabaseError::Magic)
+        ));
+        let bytes = ZIPCODE_BYTES.to_vec().leak();
+        bytes[4] = 0xff;
+        assert!(matches!(
+            Dataset::parse(bytes, true),
+            Err(DatabaseError::Version(_))
+        ));
+        for len in [20, 1000, ZIPCODE_BYTES.len() - 1] {
+            assert!(matches!(
+                Dataset::parse(&ZIPCODE_BYTES[..len], false),
+                Err(DatabaseError::Corrupt)
+            ));
+        }
+        let bytes = ZIPCODE_BYTES.to_vec().leak();
+        *bytes.last_mut().unwrap() ^= 1;
+        assert!(Dataset::parse(bytes, false).is_ok());
+        assert!(matches!(
+            Database::from_bytes(bytes),
+            Err(DatabaseError::Checksum)
+        ));
+        // A well-formed header over a malformed record is caught on load, not
+        // by the first query to reach its shard.
+        let bytes = ZIPCODE_BYTES.to_vec().leak();
+        *bytes.last_mut().unwrap() = 0x80;
+        let checksum = format::crc32(&bytes[format::CHECKSUMMED_FROM..]);
+        bytes[8..12].copy_from_slice(&checksum.to_le_bytes());
+        assert!(matches!(
+            Database::from_bytes(bytes),
+            Err(DatabaseError::Corrupt)
+        ));
+    }
+
+    #[test]
+    fn should_reject_invalid_datasets() {
+        let records = serde_json::to_value(similar_to("0647", None)).unwrap();
+        let with_zip = |zip: &str| {
+            let mut records = records.clone();
+            records[1]["zip_code"] = zip.into();
+            records.to_string()
+        };
+        assert!(matches!(
+            Database::compile("{"),
+            Err(DatabaseError::Json(_))
+        ));
+        assert!(matches!(
+            Database::compile(&with_zip("6475")),
+            Err(DatabaseError::InvalidZipCode(zip)) if zip == "6475"
+        ));
+        assert!(matches!(
+            Database::compile(&with_zip(records[0]["zip_code"].as_str().unwrap())),
+            Err(DatabaseError::DuplicateZipCode(_))
+        ));
+        assert!(Database::compile(&with_zip("99999")).is_ok());
+    }
+
+    #[test]
+    fn should_decode_only_the_shards_queried() {
+        let db = dataset::Dataset::parse(ZIPCODE_BYTES, true).unwrap();
+        assert_eq!(db.decoded_shards(), 0);
+        let position = db.position(6903).unwrap();
+        assert_eq!(db.get(position).zip_code, "06903");
+        assert_eq!(db.decoded_shards(), 1);
+        assert_eq!(db.range(db.rank(6900)..db.rank(7100)).len(), 107);
+        assert_eq!(db.decoded_shards(), 2);
+        assert_eq!(db.all(), records());
+        assert!(db
+            .slots()
+            .map(|slot| format!("{:05}", slot))
+            .eq(records().iter().map(|z| z.zip_code.to_string())));
+    }
+
+    #[test]
+    fn compiled_databases_load_from_files() {
+        let json = serde_json::to_string(&similar_to("064", None)).unwrap();
+        let path = std::env::temp_dir().join(format!("zipcodes-{}.bin", std::process::id()));
+        std::fs::write(&path, Database::compile(&json).unwrap()).unwrap();
+        let db = Database::open(&path).unwrap();
+        std::fs::remove_file(&path).unwrap();
+
+        assert_eq!(db.records(), with_prefix("064"));
+        assert_eq!(db.lookup("06475"), lookup("06475"));
+        assert!(db.lookup("06903").is_none());
+        assert!(!db.is_real("06903").unwrap());
+        assert_eq!(
+            query().city("Old Saybrook").run_on(&db),
+            query().city("Old Saybrook").run()
+        );
+        assert_eq!(db.nearest(41.2913, -72.385, 1, None)[0].0.zip_code, "06475");
+
+        // Dropping the database unmaps the file.
+        #[cfg(target_os = "linux")]
+        {
+            let mapped = || {
+                let maps = std::fs::read_to_string("/proc/self/maps").unwrap();
+                maps.contains(path.to_str().unwrap())
+            };
+            assert!(mapped());
+            drop(db);
+            assert!(!mapped());
+        }
+        assert!(matches!(
+            Database::open("/nonexistent/zips.bin"),
+            Err(DatabaseError::Io(_))
+        ));
+    }
+
+    #[test]
+    fn unknown_zip_code_types_are_kept() {
+        let mut records = serde_json::to_value(similar_to("06475", None)).unwrap();
+        records[0]["zip_code_type"] = "FUTURE".into();
+        let compiled = Database::compile(&records.to_string()).unwrap().leak();
+        let db = Database::from_bytes(compiled).unwrap();
+        let z = db.lookup("06475").unwrap();
+        assert!(matches!(z.zip_code_type(), ZipCodeType::Other(_)));
+        assert_eq!(z.zip_code_type(), "FUTURE");
+        assert_eq!(serde_json::to_value(db.records()).unwrap(), records);
+    }
+
+    #[test]
+    fn swapped_databases_leave_snapshots_intact() {
+        // A local `Current`, so that other tests keep the embedded database.
+        let current = database::Current::new();
+        let embedded = current.get();
+        assert_eq!(current.version(), 0);
+        let json = serde_json::to_string(&similar_to("064", None)).unwrap();
+        let compiled = Database::compile(&json).unwrap().leak();
+        let pending = query().state("CT").iter_on(&embedded);
+        let mut shared = query().state("CT").iter_shared(current.get());
+
+        assert_eq!(current.set(Database::from_bytes(compiled).unwrap()), 1);
+        assert_eq!(current.version(), 1);
+        assert_eq!(current.get().version(), 1);
+        assert_eq!(current.get().records(), with_prefix("064"));
+        assert!(current.get().lookup("06903").is_none());
+        assert!(embedded.lookup("06903").is_some());
+        assert_eq!(pending.count(), query().state("CT").run().len());
+        let mut count = 0;
+        while shared.next().is_some() {
+            count += 1;
+        }
+        assert_eq!(count, query().state("CT").run().len());
+
+        let warm = current.get();
+        warm.preload();
+        let replaced = Arc::downgrade(&warm);
+        assert_eq!(current.set(Database::from_bytes(compiled).unwrap()), 2);
+        assert!(current.get().is_loaded());
+        assert_eq!(warm.with_prefix("0647"), with_prefix("0647"));
+        // The replaced database is freed with its last snapshot.
+        drop(warm);
+        assert!(replaced.upgrade().is_none());
+
+        // Concurrent swaps each publish a distinct version, the last one the
+        // database left current.
+        let versions: Vec<u64> = std::thread::scope(|s| {
+            let swaps: Vec<_> = (0..4)
+                .map(|_| s.spawn(|| current.set(Database::from_bytes(compiled).unwrap())))
+                .collect();
+            swaps.into_iter().map(|swap| swap.join().unwrap()).collect()
+        });
+        assert_eq!(
+            versions
+                .iter()
+                .copied()
+                .collect::<std::collections::BTreeSet<_>>(),
+            (3..=6).collect()
+        );
+        assert_eq!(current.version(), 6);
+    }
+
+    #[test]
+    fn records_share_their_strings() {
+        let stamford = lookup("06903").unwrap();
+        let greenwich = lookup("06830").unwrap();
+        assert_eq!(stamford.state.as_ptr(), greenwich.state.as_ptr());
+        assert_eq!(stamford.area_codes.as_ptr(), greenwich.area_codes.as_ptr());
+        assert_eq!(stamford.zip_code_type, ZipCodeType::Standard);
+        assert_eq!(stamford.zip_code_type, "STANDARD");
+        assert_eq!(Zip5::parse("06903"), Some(stamford.zip_code));
+        assert_eq!(Zip5::from_number(6903).number(), 6903);
+        assert_eq!(Zip5::parse("6903"), None);
+    }
+
+    #[test]
+    fn filtered_scans_keep_database_order() {
+        let north = |z: &Record| z.lat.parse::<f64>().is_ok_and(|lat| lat > 45.0);
+        let serial: Vec<&Record> = records().iter().filter(|z| north(z)).collect();
+        assert!(!serial.is_empty());
+        assert_eq!(filtered(north), serial);
+        #[cfg(feature = "parallel")]
+        {
+            set_threads(4);
+            assert_eq!(threads(), 4);
+            assert_eq!(filtered(north), serial);
+            assert_eq!(
+                parallel::map_runs(10_000, 1000, |run| run),
+                [0..2500, 2500..5000, 5000..7500, 7500..10_000]
+            );
+            assert_eq!(parallel::map_runs(1500, 1000, |run| run.len()), [1500]);
+            set_threads(1);
+        }
+    }
+
+    #[test]
+    fn queries_match_the_equivalent_chained_filters() {
+        let (lat, long) = (29.7604, -95.3698);
+        let expected: Vec<&Record> = within(lat, long, 25.0)
+            .into_iter()
+            .filter(|z| z.state == "TX" && z.active && z.zip_code.starts_with("77"))
+            .collect();
+        assert!(expected.len() > 5);
+        let houston = query()
+            .state("TX")
+            .active(true)
+            .within(lat, long, 25.0)
+            .prefix("77");
+        assert_eq!(houston.run(), expected);
+        assert_eq!(houston.clone().limit(5).run(), expected[..5]);
+
+        let closest: Vec<&Record> = nearest(lat, long, 10, None)
+            .into_iter()
+            .map(|(z, _)| z)
+            .collect();
+        assert_eq!(
+            query().order_by_distance(lat, long).limit(10).run(),
+            closest
+        );
+        assert_eq!(
+            query()
+                .containing("018")
+                .field("acceptable_cities", json!([]))
+                .run(),
+            containing("018")
+                .into_iter()
+                .filter(|z| z.acceptable_cities.is_empty())
+                .collect::<Vec<_>>()
+        );
+        assert!(query().state("ZZ").prefix("77").run().is_empty());
+    }
+
+    #[test]
+    fn candidate_estimates_bound_the_candidates() {
+        let db = db();
+        for fragment in ["", "0", "18", "018", "1018", "10185", "a"] {
+            let exact = db.containing_ids(fragment).len();
+            assert!(db.containing_estimate(fragment) >= exact, "{}", fragment);
+        }
+        let spatial = db.spatial();
+        for (lat, long, radius) in [
+            (29.7604, -95.3698, 25.0),
+            (41.2913, -72.385, 0.0),
+            (64.8378, -147.7164, 500.0),
+            (89.9, 0.0, 100.0),
+            (0.0, 0.0, 1.0e5),
+            (0.0, 0.0, -1.0),
+        ] {
+            let center = Point::new(long, lat);
+            let exact = spatial.within(center, radius).len();
+            let estimate = spatial.within_estimate(center, radius);
+            assert!(estimate >= exact, "{} {} {}", lat, long, radius);
+            assert!(radius > 1000.0 || estimate < db.len() / 10);
+        }
+    }
+
+    #[test]
+    fn query_pages_match_slices_of_the_full_result() {
+        let ct = query().state("CT");
+        let all = ct.run();
+        assert_eq!(ct.clone().offset(50).limit(50).run(), all[50..100]);
+        assert_eq!(ct.clone().offset(all.len()).run(), Vec::<&Record>::new());
+        assert_eq!(ct.iter().nth(3), Some(all[3]));
+
+        let (lat, long) = (41.2913, -72.385);
+        let ranked = query().order_by_distance(lat, long).limit(8).run();
+        assert_eq!(
+            query()
+                .order_by_distance(lat, long)
+                .offset(3)
+                .limit(5)
+                .run(),
+            ranked[3..]
+        );
+    }
+
+    #[test]
+    fn preload_builds_everything_once() {
+        preload();
+        assert!(is_loaded());
+        preload();
+        assert_eq!(db().dataset().decoded_shards(), format::SHARDS);
+    }
+
+    #[test]
+    fn with_prefix_agrees_with_a_full_scan() {
+        for prefix in &["", "0", "1", "1018", "10185", "101850", "99999", "9", "a"] {
+            let expected: Vec<&Record> = records()
+                .iter()
+                .filter(|z| z.zip_code.starts_with(prefix))
+                .collect();
+            assert_eq!(with_prefix(prefix).iter().collect::<Vec<_>>(), expected);
+        }
+    }
+
     #[test]
     fn should_find_zipcodes_containing_fragment() {
         assert!(contains("0185", None).iter().any(|z| z.zip_code == "10185"));
     }
 
+    #[test]
+    fn containing_agrees_with_a_full_scan() {
+        for fragment in &[
+            "", "0", "1", "9", "00", "18", "018", "0185", "1018", "10185", "0000", "101850", "1a",
+            "-",
+        ] {
+            let expected: Vec<&Record> = records()
+                .iter()
+                .filter(|z| z.zip_code.contains(fragment))
+                .collect();
+            assert_eq!(containing(fragment), expected, "fragment {:?}", fragment);
+        }
+    }
+
     #[test]
     fn should_filter_by_fields() {
         let filters = vec![
@@ -328,6 +1147,74 @@ mod tests {
         assert_eq!(similar_to("2", Some(windsor)).len(), 3);
     }
 
+    #[test]
+    fn iterators_borrow_what_the_owned_queries_copy() {
+        let ct: Vec<&'static Record<'static>> =
+            iter_filter_by_fields(&[("state".to_string(), json!("CT"))], records()).collect();
+        assert_eq!(ct, with_fields(&[("state".to_string(), json!("CT"))]));
+        let owned = filter_by_fields(&[("state".to_string(), json!("CT"))], None);
+        assert!(ct.iter().copied().eq(&owned));
+
+        let matched: Vec<_> = iter_matching("06475-1234", ct.iter().copied())
+            .unwrap()
+            .collect();
+        assert_eq!(matched, [lookup("06475").unwrap()]);
+        assert!(matches!(
+            iter_matching("123", records()).map(|zips| zips.count()),
+            Err(Error::InvalidFormat)
+        ));
+        assert!(iter_similar_to("064", ct.iter().copied()).eq(with_prefix("064")));
+        assert!(iter_contains("018", records()).eq(containing("018")));
+        assert!(iter_filter_by(&[|z: &Record| z.active], ct.iter().copied())
+            .eq(ct.iter().copied().filter(|z| z.active)));
+        assert!(
+            iter_filter_by_coordinates(41.3015, -72.3879, 10.0, iter_all())
+                .eq(within(41.3015, -72.3879, 10.0))
+        );
+        assert!(
+            iter_filter_by_coordinates(41.3015, -72.3879, 10.0, ct.iter().copied())
+                .eq(filter_by_coordinates(41.3015, -72.3879, 10.0, Some(owned)).iter())
+        );
+    }
+
+    #[test]
+    fn with_fields_agrees_with_a_full_scan() {
+        let cases = vec![
+            vec![],
+            vec![("state".to_string(), json!("TX"))],
+            vec![
+                ("state".to_string(), json!("NY")),
+                ("city".to_string(), json!("New York")),
+                ("active".to_string(), json!(false)),
+            ],
+            vec![
+                ("county".to_string(), json!("Middlesex County")),
+                ("area_codes".to_string(), json!(["860", "959"])),
+            ],
+            vec![("zip_code".to_string(), json!("06475"))],
+            vec![("active".to_string(), json!(1))],
+            vec![("state".to_string(), json!("ZZ"))],
+            vec![("timezone".to_string(), json!(null))],
+        ];
+        for filters in cases {
+            let expected: Vec<&Record> = records()
+                .iter()
+                .filter(|z| filters.iter().all(|(k, v)| z.field_matches(k, v)))
+                .collect();
+            assert_eq!(with_fields(&filters), expected, "filters {:?}", filters);
+        }
+    }
+
+    #[test]
+    fn intersect_keeps_common_ids_in_order() {
+        let a: &[u32] = &[1, 3, 5, 7, 9];
+        let b: &[u32] = &[3, 4, 5, 9, 10];
+        let c: &[u32] = &[0, 3, 9];
+        assert_eq!(index::intersect(vec![a, b, c]), vec![3, 9]);
+        assert!(index::intersect(vec![a, &[]]).is_empty());
+        assert!(index::intersect(vec![]).is_empty());
+    }
+
     #[test]
     fn should_not_match_unknown_filter_fields() {
         let filters = vec![("nonexistent".to_string(), json!("x"))];
@@ -343,6 +1230,81 @@ mod tests {
         assert!(filter_by_coordinates(42.2529, 71.0023, 100.0, None).is_empty());
     }
 
+    #[test]
+    fn within_agrees_with_a_full_scan() {
+        let centers = [
+            (41.3015, -72.3879),
+            (40.7128, -74.0060),
+            (61.2181, -149.9003), // Anchorage
+            (52.0, 179.9),        // Aleutians, across the antimeridian
+            (52.0, -179.9),
+            (13.4443, 144.7937), // Guam
+            (89.9, 0.0),
+            (-89.9, 10.0),
+            (0.0, 0.0),
+            (42.2529, 71.0023),
+            (95.0, -72.0),
+        ];
+        let radii = [0.0, 1.0, 5.0, 25.0, 250.0, 2500.0, 20000.0, -1.0, f64::NAN];
+        for &(lat, long) in &centers {
+            for &radius in &radii {
+                let expected: Vec<&Record> = records()
+                    .iter()
+                    .filter(|z| match (z.lat.parse::<f64>(), z.long.parse::<f64>()) {
+                        (Ok(z_lat), Ok(z_long)) => haversine(z_long, z_lat, long, lat) <= radius,
+                        _ => false,
+                    })
+                    .collect();
+                assert_eq!(
+                    within(lat, long, radius),
+                    expected,
+                    "center ({}, {}) radius {}",
+                    lat,
+                    long,
+                    radius
+                );
+            }
+        }
+    }
+
+    #[test]
+    fn nearest_agrees_with_a_full_sort() {
+        let centers = [
+            (41.3015, -72.3879),
+            (61.2181, -149.9003),
+            (52.0, 179.9),
+            (13.4443, 144.7937),
+            (0.0, 0.0),
+            (89.9, 0.0),
+        ];
+        for &(lat, long) in &centers {
+            let mut expected: Vec<(&Record, f64)> = records()
+                .iter()
+                .map(|z| {
+                    let (z_lat, z_long) = (z.lat.parse().unwrap(), z.long.parse().unwrap());
+                    (z, haversine(z_long, z_lat, long, lat))
+                })
+                .collect();
+            // The database is in zip order, so a stable sort breaks ties the same way.
+            expected.sort_by(|a, b| a.1.total_cmp(&b.1));
+            for &k in &[0, 1, 7, 100] {
+                assert_eq!(
+                    nearest(lat, long, k, None),
+                    expected[..k],
+                    "({}, {})",
+                    lat,
+                    long
+                );
+            }
+            let radius = 50.0;
+            let in_radius: Vec<_> = expected.iter().filter(|(_, d)| *d <= radius).collect();
+            let found = nearest(lat, long, 1_000_000, Some(radius));
+            assert_eq!(found.len(), in_radius.len());
+        }
+        assert_eq!(nearest(41.2913, -72.385, 1, None)[0].0.zip_code, "06475");
+        assert!(nearest(41.2913, -72.385, 5, Some(-1.0)).is_empty());
+    }
+
     #[test]
     fn haversine_known_distance() {
         // NYC (40.7128, -74.0060) to LA (34.0522, -118.2437) is ~2445 miles.
@@ -0,0 +1,113 @@
+//! Read-only file mappings for [`Database::open`](crate::Database::open).
+//!
+//! On unix the file is mapped with `mmap(2)`, so its pages are read as
+//! records are decoded and shared with every process mapping the same file.
+//! Elsewhere the file is read into memory up front.
+
+use std::fs::File;
+use std::io;
+use std::ops::Deref;
+
+/// The bytes of a file, mapped for reading.
+pub(crate) struct Mmap {
+    #[cfg(unix)]
+    ptr: *const u8,
+    #[cfg(unix)]
+    len: usize,
+    /// A leaked `Box`, so that moving the `Mmap` leaves borrows of the
+    /// bytes valid.
+    #[cfg(not(unix))]
+    bytes: *mut [u8],
+}
+
+// SAFETY: the mapping is read-only and never written through.
+unsafe impl Send for Mmap {}
+unsafe impl Sync for Mmap {}
+
+#[cfg(unix)]
+impl Mmap {
+    /// Map the whole of `file`. It must not be modified while mapped.
+    pub(crate) fn map(file: &File) -> io::Result<Self> {
+        use std::os::unix::io::AsRawFd;
+
+        let len = usize::try_from(file.metadata()?.len())
+            .map_err(|_| io::Error::new(io::ErrorKind::InvalidData, "file too large to map"))?;
+        if len == 0 {
+            // `mmap` rejects empty mappings.
+            return Ok(Mmap {
+                ptr: std::ptr::NonNull::dangling().as_ptr(),
+                len,
+            });
+        }
+        // SAFETY: a fresh private read-only mapping aliases no Rust memory.
+        let ptr = unsafe {
+            libc::mmap(
+                std::ptr::null_mut(),
+                len,
+                libc::PROT_READ,
+                libc::MAP_PRIVATE,
+                file.as_raw_fd(),
+                0,
+            )
+        };
+        if ptr == libc::MAP_FAILED {
+            return Err(io::Error::last_os_error());
+        }
+        Ok(Mmap {
+            ptr: ptr.cast(),
+            len,
+        })
+    }
+}
+
+#[cfg(unix)]
+impl Drop for Mmap {
+    fn drop(&mut self) {
+        if self.len != 0 {
+            // SAFETY: `ptr` and `len` describe a mapping made by `map`.
+            unsafe { libc::munmap(self.ptr.cast_mut().cast(), self.len) };
+        }
+    }
+}
+
+#[cfg(unix)]
+impl Deref for Mmap {
+    type Target = [u8];
+
+    fn deref(&self) -> &[u8] {
+        // SAFETY: the mapping is `len` readable bytes until dropped.
+        unsafe { std::slice::from_raw_parts(self.ptr, self.len) }
+    }
+}
+
+#[cfg(not(unix))]
+impl Mmap {
+    /// Read the whole of `file`.
+    pub(crate) fn map(file: &File) -> io::Result<Self> {
+        use std::io::Read;
+
+        let mut bytes = Vec::new();
+        (&*file).read_to_end(&mut bytes)?;
+        Ok(Mmap {
+            bytes: Box::into_raw(bytes.into_boxed_slice()),
+        })
+    }
+}
+
+#[cfg(not(unix))]
+impl Drop for Mmap {
+    fn drop(&mut self) {
+        // SAFETY: `bytes` was leaked by `map`, and is freed only here.
+        drop(unsafe { Box::from_raw(self.bytes) });
+    }
+}
+
+#[cfg(not(unix))]
+impl Deref for Mmap {
+    type Target = [u8];
+
+    fn deref(&self) -> &[u8] {
+        // SAFETY: `bytes` is valid until dropped.
+        unsafe { &*self.bytes }
+    }
+}
@@ -0,0 +1,87 @@
+//! Splitting whole-database work across threads.
+//!
+//! With the `parallel` feature, [`set_threads`] lets full scans and the full
+//! decode split their input into contiguous runs, one per scoped thread, and
+//! concatenate the results in input order, so the output is identical to the
+//! serial path. Without it, or with one thread (the default), everything runs
+//! on the calling thread.
+
+use std::ops::Range;
+
+#[cfg(feature = "parallel")]
+use std::sync::atomic::{AtomicUsize, Ordering};
+
+#[cfg(feature = "parallel")]
+static THREADS: AtomicUsize = AtomicUsize::new(1);
+
+/// Use up to `threads` threads for full-database scans and decoding, or one
+/// per available core if `threads` is 0. The default is 1, which keeps all
+/// work on the calling thread.
+#[cfg(feature = "parallel")]
+pub fn set_threads(threads: usize) {
+    THREADS.store(threads, Ordering::Relaxed);
+}
+
+/// The number of threads full-database scans and decoding may use.
+#[cfg(feature = "parallel")]
+pub fn threads() -> usize {
+    match THREADS.load(Ordering::Relaxed) {
+        0 => std::thread::available_parallelism().map_or(1, usize::from),
+        threads => threads,
+    }
+}
+
+#[cfg(not(feature = "parallel"))]
+fn threads() -> usize {
+    1
+}
+
+/// Apply `f` to consecutive runs covering `0..len`, each at least `min_run`
+/// long, on up to [`threads`] threads; results are in run order.
+///
+/// The first run is processed on the calling thread, and a panic in any run
+/// is propagated to the caller.
+pub(crate) fn map_runs<R: Send>(
+    len: usize,
+    min_run: usize,
+    f: impl Fn(Range<usize>) -> R + Sync,
+) -> Vec<R> {
+    let runs = threads().min(len / min_run.max(1)).max(1);
+    if runs == 1 {
+        return vec![f(0..len)];
+    }
+    let size = len.div_ceil(runs);
+    let f = &f;
+    std::thread::scope(|scope| {
+        let rest: Vec<_> = (size..len)
+            .step_by(size)
+            .map(|start| scope.spawn(move || f(start..len.min(start + size))))
+            .collect();
+        let mut results = Vec::with_capacity(runs);
+        results.push(f(0..size));
+        for handle in rest {
+            results.push(
+                handle
+                    .join()
+                    .unwrap_or_else(|panic| std::panic::resume_unwind(panic)),
+            );
+        }
+        results
+    })
+}
+
+/// The items of `items` satisfying `predicate`, in order.
+pub(crate) fn filter<T: Sync>(items: &[T], predicate: impl Fn(&T) -> bool + Sync) -> Vec<&T> {
+    // Below this many items per thread, spawning costs more than it saves.
+    const MIN_RUN: usize = 4096;
+    let runs = map_runs(items.len(), MIN_RUN, |run| {
+        items[run]
+            .iter()
+            .filter(|item| predicate(item))
+            .collect::<Vec<_>>()
+    });
+    if runs.len() == 1 {
+        return runs.into_iter().next().unwrap_or_default();
+    }
+    runs.concat()
+}
@@ -0,0 +1,370 @@
+//! Composable queries, evaluated in one pass over the most selective index.
+
+use std::ops::Range;
+use std::sync::Arc;
+
+use serde_json::Value;
+
+use crate::database::embedded;
+use crate::index::IndexedField;
+use crate::spatial::Point;
+use crate::{Database, Record};
+
+/// Start a [`Query`] matching every record.
+pub fn query() -> Query {
+    Query::default()
+}
+
+/// A combination of criteria that records must all meet, built fluently and
+/// evaluated by [`Query::run`]:
+///
+/// ```
+/// let houston = zipcodes::query()
+///     .state("TX")
+///     .active(true)
+///     .within(29.7604, -95.3698, 25.0)
+///     .prefix("77")
+///     .order_by_distance(29.7604, -95.3698)
+///     .limit(20)
+///     .run();
+/// assert_eq!(houston.len(), 20);
+/// ```
+///
+/// Criteria answered by an index (equality on the fields [`with_fields`]
+/// indexes, prefixes, substrings and radii) are candidates for driving the
+/// scan. Their sizes are estimated from the indexes, only the smallest
+/// one's candidates are built, and every other criterion is checked against
+/// each of its records in the same pass.
+///
+/// [`with_fields`]: crate::with_fields
+#[derive(Clone, Debug, Default)]
+pub struct Query {
+    criteria: Vec<Criterion>,
+    distance_from: Option<Point>,
+    offset: usize,
+    limit: Option<usize>,
+}
+
+#[derive(Clone, Debug)]
+enum Criterion {
+    Field(String, Value),
+    Prefix(String),
+    Fragment(String),
+    Within(Point, f64),
+}
+
+/// The records a criterion's index narrows the scan to.
+#[derive(Debug)]
+enum Candidates<'db> {
+    Positions(Range<usize>),
+    Ids(Vec<u32>),
+    Postings(&'db [u32]),
+}
+
+impl Candidates<'_> {
+    /// The position of the `i`th candidate record.
+    fn get(&self, i: usize) -> Option<usize> {
+        match self {
+            Candidates::Positions(positions) => positions.clone().nth(i),
+            Candidates::Ids(ids) => ids.get(i).map(|&id| id as usize),
+            Candidates::Postings(ids) => ids.get(i).map(|&id| id as usize),
+        }
+    }
+}
+
+impl Criterion {
+    /// The number of candidates [`Criterion::candidates`] would build, or an
+    /// upper bound on it, from index sizes alone.
+    fn estimate(&self, db: &Database) -> Option<usize> {
+        Some(match self {
+            Criterion::Field(field, value) => {
+                let indexed = IndexedField::from_name(field)?;
+                db.field_index(indexed).postings(indexed, value).len()
+            }
+            Criterion::Prefix(prefix) => db.prefix_range(prefix).len(),
+            Criterion::Fragment(fragment) => db.containing_estimate(fragment),
+            Criterion::Within(center, radius) => db.spatial().within_estimate(*center, *radius),
+        })
+    }
+
+    fn candidates<'db>(&self, db: &'db Database) -> Option<Candidates<'db>> {
+        Some(match self {
+            Criterion::Field(field, value) => {
+                let indexed = IndexedField::from_name(field)?;
+                Candidates::Postings(db.field_index(indexed).postings(indexed, value))
+            }
+            Criterion::Prefix(prefix) => Candidates::Positions(db.prefix_range(prefix)),
+            Criterion::Fragment(fragment) => Candidates::Ids(db.containing_ids(fragment)),
+            Criterion::Within(center, radius) => {
+                Candidates::Ids(db.spatial().within(*center, *radius))
+            }
+        })
+    }
+
+    fn matches(&self, db: &Database, position: usize, z: &Record<'_>) -> bool {
+        match self {
+            Criterion::Field(field, value) => z.field_matches(field, value),
+            Criterion::Prefix(prefix) => z.zip_code.starts_with(prefix.as_str()),
+            Criterion::Fragment(fragment) => z.zip_code.contains(fragment.as_str()),
+            Criterion::Within(center, radius) => db
+                .spatial()
+                .miles(position as u32, center)
+                .is_some_and(|miles| miles <= *radius),
+        }
+    }
+}
+
+impl Query {
+    /// Keep the records whose named field equals `value`, with the same
+    /// semantics as [`with_fields`](crate::with_fields).
+    pub fn field(mut self, field: &str, value: impl Into<Value>) -> Self {
+        self.criteria
+            .push(Criterion::Field(field.to_string(), value.into()));
+        self
+    }
+
+    pub fn state(self, state: &str) -> Self {
+        self.field("state", state)
+    }
+
+    pub fn city(self, city: &str) -> Self {
+        self.field("city", city)
+    }
+
+    pub fn county(self, county: &str) -> Self {
+        self.field("county", county)
+    }
+
+    pub fn timezone(self, timezone: &str) -> Self {
+        self.field("timezone", timezone)
+    }
+
+    pub fn zip_code_type(self, zip_code_type: &str) -> Self {
+        self.field("zip_code_type", zip_code_type)
+    }
+
+    pub fn country(self, country: &str) -> Self {
+        self.field("country", country)
+    }
+
+    pub fn world_region(self, world_region: &str) -> Self {
+        self.field("world_region", world_region)
+    }
+
+    pub fn active(self, active: bool) -> Self {
+        self.field("active", active)
+    }
+
+    /// Keep the records whose `zip_code` starts with `prefix`.
+    pub fn prefix(mut self, prefix: &str) -> Self {
+        self.criteria.push(Criterion::Prefix(prefix.to_string()));
+        self
+    }
+
+    /// Keep the records whose `zip_code` contains `fragment`.
+    pub fn containing(mut self, fragment: &str) -> Self {
+        self.criteria
+            .push(Criterion::Fragment(fragment.to_string()));
+        self
+    }
+
+    /// Keep the records within `radius_in_miles` of the supplied coordinates,
+    /// as [`within`](crate::within) does.
+    pub fn within(mut self, lat: f64, long: f64, radius_in_miles: f64) -> Self {
+        self.criteria
+            .push(Criterion::Within(Point::new(long, lat), radius_in_miles));
+        self
+    }
+
+    /// Return records nearest the supplied coordinates first, ties in
+    /// database order, instead of in database order. Records whose stored
+    /// coordinates fail to parse are then excluded.
+    pub fn order_by_distance(mut self, lat: f64, long: f64) -> Self {
+        self.distance_from = Some(Point::new(long, lat));
+        self
+    }
+
+    /// Return at most `limit` records.
+    pub fn limit(mut self, limit: usize) -> Self {
+        self.limit = Some(limit);
+        self
+    }
+
+    /// Skip the first `offset` matching records, e.g. to page through
+    /// results with [`limit`](Self::limit).
+    pub fn offset(mut self, offset: usize) -> Self {
+        self.offset = offset;
+        self
+    }
+
+    /// Borrow the matching records of the embedded database.
+    pub fn run(&self) -> Vec<&'static Record<'static>> {
+        self.run_on(embedded())
+    }
+
+    /// Borrow the records of `db` that match, rather than of the embedded
+    /// database.
+    pub fn run_on<'db>(&self, db: &'db Database) -> Vec<&'db Record<'db>> {
+        self.iter_on(db).collect()
+    }
+
+    /// Iterate over the matching records of the embedded database, scanning
+    /// only as far as each call to `next` needs.
+    ///
+    /// Without [`order_by_distance`](Self::order_by_distance), the scan
+    /// stops as soon as [`limit`](Self::limit) records have matched; with
+    /// it, every match is ranked up front.
+    pub fn iter(&self) -> Matches<'static> {
+        self.iter_on(embedded())
+    }
+
+    /// As [`Query::iter_on`], but holding on to the snapshot `db`, such as
+    /// one from [`current_database`](crate::current_database), rather than
+    /// borrowing it.
+    pub fn iter_shared(&self, db: Arc<Database>) -> SharedMatches {
+        // SAFETY: `matches` borrows the database `db` keeps alive, which an
+        // `Arc` never moves, and is dropped first; see `SharedMatches`.
+        let database: &'static Database = unsafe { &*Arc::as_ptr(&db) };
+        SharedMatches {
+            matches: self.iter_on(database),
+            db,
+        }
+    }
+
+    /// Iterate over the records of `db` that match, rather than of the
+    /// embedded database.
+    pub fn iter_on<'db>(&self, db: &'db Database) -> Matches<'db> {
+        let limit = self.limit.unwrap_or(usize::MAX);
+        if limit == 0 {
+            return Matches::new(db, Candidates::Positions(0..0), Vec::new(), 0, 0);
+        }
+        // Drive the scan from the criterion estimated to have the fewest
+        // candidates, or every record; only the driver's set is built.
+        let smallest = self
+            .criteria
+            .iter()
+            .enumerate()
+            .filter_map(|(i, criterion)| Some((i, criterion.estimate(db)?)))
+            .min_by_key(|&(_, size)| size);
+        let (driver, positions) =
+            match smallest.and_then(|(i, _)| Some((i, self.criteria[i].candidates(db)?))) {
+                Some((i, candidates)) => (Some(i), candidates),
+                None => (None, Candidates::Positions(0..db.len())),
+            };
+        let rest: Vec<Criterion> = self
+            .criteria
+            .iter()
+            .enumerate()
+            .filter(|&(i, _)| Some(i) != driver)
+            .map(|(_, criterion)| criterion.clone())
+            .collect();
+
+        let Some(origin) = self.distance_from else {
+            return Matches::new(db, positions, rest, self.offset, limit);
+        };
+        let spatial = db.spatial();
+        let mut ranked: Vec<(f64, u32)> = Matches::new(db, positions, rest, 0, usize::MAX)
+            .positions()
+            .filter_map(|position| Some((spatial.miles(position, &origin)?, position)))
+            .collect();
+        // Stable, so records at equal distance stay in database order.
+        ranked.sort_by(|a, b| a.0.total_cmp(&b.0));
+        let ranked = ranked.into_iter().map(|(_, position)| position).collect();
+        Matches::new(db, Candidates::Ids(ranked), Vec::new(), self.offset, limit)
+    }
+}
+
+/// The records matching a [`Query`], from [`Query::iter`].
+#[derive(Debug)]
+pub struct Matches<'db> {
+    db: &'db Database,
+    positions: Candidates<'db>,
+    next: usize,
+    rest: Vec<Criterion>,
+    skip: usize,
+    remaining: usize,
+}
+
+impl<'db> Matches<'db> {
+    fn new(
+        db: &'db Database,
+        positions: Candidates<'db>,
+        rest: Vec<Criterion>,
+        skip: usize,
+        remaining: usize,
+    ) -> Self {
+        Matches {
+            db,
+            positions,
+            next: 0,
+            rest,
+            skip,
+            remaining,
+        }
+    }
+
+    /// The positions of the matching records, ignoring `skip` and
+    /// `remaining`.
+    fn positions(mut self) -> impl Iterator<Item = u32> + 'db {
+        std::iter::from_fn(move || self.next_match().map(|(position, _)| position as u32))
+    }
+
+    fn next_match(&mut self) -> Option<(usize, &'db Record<'db>)> {
+        while let Some(position) = self.positions.get(self.next) {
+            self.next += 1;
+            let z = self.db.get(position);
+            if self
+                .rest
+                .iter()
+                .all(|criterion| criterion.matches(self.db, position, z))
+            {
+                return Some((position, z));
+            }
+        }
+        None
+    }
+}
+
+impl<'db> Iterator for Matches<'db> {
+    type Item = &'db Record<'db>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        while self.remaining > 0 {
+            let (_, z) = self.next_match()?;
+            if self.skip > 0 {
+                self.skip -= 1;
+                continue;
+            }
+            self.remaining -= 1;
+            return Some(z);
+        }
+        None
+    }
+}
+
+/// The records matching a [`Query`] in a database it holds a snapshot of,
+/// from [`Query::iter_shared`].
+///
+/// Records are borrowed from the iterator, so it is not an [`Iterator`]:
+/// call [`SharedMatches::next`] in a `while let` loop.
+#[derive(Debug)]
+pub struct SharedMatches {
+    /// Declared before `db`, so that it is dropped before the database it
+    /// borrows. Its `'static` never escapes: records are handed out
+    /// borrowed from `self`.
+    matches: Matches<'static>,
+    db: Arc<Database>,
+}
+
+impl SharedMatches {
+    /// The next matching record, scanning only as far as it needs.
+    #[allow(clippy::should_implement_trait)]
+    pub fn next(&mut self) -> Option<&Record<'_>> {
+        self.matches.next()
+    }
+
+    /// The database the records are matched in.
+    pub fn database(&self) -> &Arc<Database> {
+        &self.db
+    }
+}
@@ -0,0 +1,333 @@
+//! Pre-parsed coordinates and a uniform grid over them for radius queries.
+
+use std::cmp::{Ordering, Reverse};
+use std::collections::BinaryHeap;
+use std::f64::consts::{FRAC_PI_2, PI};
+use std::ops::RangeInclusive;
+
+use crate::Record;
+
+/// Radius of earth in miles. Use 6371 for kilometers.
+pub(crate) const EARTH_RADIUS_MILES: f64 = 3956.0;
+
+/// Grid cells per degree of latitude and of longitude.
+const CELLS_PER_DEGREE: f64 = 1.0;
+const LAT_CELLS: usize = (180.0 * CELLS_PER_DEGREE) as usize;
+const LON_CELLS: usize = (360.0 * CELLS_PER_DEGREE) as usize;
+
+/// Slack added to the bounding box so rounding never drops a point that the
+/// exact distance check would accept.
+const BOX_SLACK: f64 = 1e-9;
+
+/// A coordinate in radians with its latitude cosine precomputed.
+#[derive(Clone, Copy, Debug)]
+pub(crate) struct Point {
+    lat: f64,
+    lon: f64,
+    cos_lat: f64,
+}
+
+impl Point {
+    /// A point from decimal degrees.
+    pub(crate) fn new(lon: f64, lat: f64) -> Self {
+        let lat = lat.to_radians();
+        Point {
+            lat,
+            lon: lon.to_radians(),
+            cos_lat: lat.cos(),
+        }
+    }
+
+    fn parse(z: &Record<'_>) -> Option<Self> {
+        match (z.lat.parse::<f64>(), z.long.parse::<f64>()) {
+            (Ok(lat), Ok(lon)) => Some(Point::new(lon, lat)),
+            _ => None,
+        }
+    }
+
+    /// Great circle distance in miles (the haversine formula).
+    pub(crate) fn miles_to(&self, other: &Point) -> f64 {
+        let dlon = other.lon - self.lon;
+        let dlat = other.lat - self.lat;
+        let a =
+            (dlat / 2.0).sin().powi(2) + self.cos_lat * other.cos_lat * (dlon / 2.0).sin().powi(2);
+        let c = 2.0 * a.sqrt().asin();
+        c * EARTH_RADIUS_MILES
+    }
+
+    fn cell_row(lat: f64) -> usize {
+        let row = ((lat.to_degrees() + 90.0) * CELLS_PER_DEGREE).floor();
+        (row.max(0.0) as usize).min(LAT_CELLS - 1)
+    }
+
+    fn cell_col(lon: f64) -> usize {
+        let col = ((lon.to_degrees() + 180.0) * CELLS_PER_DEGREE).floor() as i64;
+        col.rem_euclid(LON_CELLS as i64) as usize
+    }
+
+    /// A lower bound, in radians, on the angular distance from this point to
+    /// anything inside grid `cell`.
+    fn gap_to_cell(&self, cell: usize) -> f64 {
+        let cell_size = (1.0 / CELLS_PER_DEGREE).to_radians();
+        let (row, col) = (cell / LON_CELLS, cell % LON_CELLS);
+        let south = row as f64 * cell_size - FRAC_PI_2;
+        let west = col as f64 * cell_size - PI;
+        let lat_gap = (south - self.lat)
+            .max(self.lat - (south + cell_size))
+            .max(0.0);
+        let lon_gap = if (self.lon - west).rem_euclid(2.0 * PI) <= cell_size {
+            0.0
+        } else {
+            let to_west = (west - self.lon).rem_euclid(2.0 * PI);
+            let to_east = (self.lon - (west + cell_size)).rem_euclid(2.0 * PI);
+            to_west.min(to_east)
+        };
+        let meridian_gap = if lon_gap == 0.0 {
+            0.0
+        } else if lon_gap <= FRAC_PI_2 {
+            // Distance to the great circle through the nearer edge meridian.
+            (self.cos_lat * lon_gap.sin()).asin()
+        } else {
+            // Past a quarter turn, the nearest point of a meridian is a pole.
+            FRAC_PI_2 - self.lat.abs()
+        };
+        (lat_gap.max(meridian_gap) - BOX_SLACK).max(0.0)
+    }
+}
+
+/// The part of the grid a radius query has to search.
+enum Area {
+    /// The query is malformed and matches nothing.
+    Empty,
+    /// The bounding box is undefined, so every point must be checked.
+    Everything,
+    /// The cells overlapping the bounding box, and its `(dlat, dlon)`
+    /// half-extents in radians.
+    Cells {
+        rows: RangeInclusive<usize>,
+        cols: Vec<usize>,
+        bounds: (f64, f64),
+    },
+}
+
+impl Area {
+    fn around(center: Point, radius: f64) -> Self {
+        if radius.is_nan() || radius < 0.0 || !center.lat.is_finite() || !center.lon.is_finite() {
+            return Area::Empty;
+        }
+        if center.lat.abs() > FRAC_PI_2 {
+            return Area::Everything;
+        }
+        // No point further than `dlat` in latitude, or (away from the poles)
+        // `dlon` in longitude, can be within the radius.
+        let dlat = radius / EARTH_RADIUS_MILES + BOX_SLACK;
+        let dlon = if center.lat.abs() + dlat < FRAC_PI_2 {
+            Some((dlat.sin() / center.cos_lat).min(1.0).asin() + BOX_SLACK)
+        } else {
+            None
+        };
+        let rows = Point::cell_row(center.lat - dlat)..=Point::cell_row(center.lat + dlat);
+        let cols: Vec<usize> = match dlon {
+            Some(dlon) if dlon < PI => {
+                let first = ((center.lon - dlon).to_degrees() + 180.0) * CELLS_PER_DEGREE;
+                let last = ((center.lon + dlon).to_degrees() + 180.0) * CELLS_PER_DEGREE;
+                (first.floor() as i64..=last.floor() as i64)
+                    .map(|col| col.rem_euclid(LON_CELLS as i64) as usize)
+                    .take(LON_CELLS)
+                    .collect()
+            }
+            _ => (0..LON_CELLS).collect(),
+        };
+        Area::Cells {
+            rows,
+            cols,
+            bounds: (dlat, dlon.unwrap_or(PI)),
+        }
+    }
+}
+
+/// A candidate ordered by distance, then by record position.
+#[derive(Clone, Copy, Debug, PartialEq)]
+struct Ranked(f64, u32);
+
+impl Eq for Ranked {}
+
+impl PartialOrd for Ranked {
+    fn partial_cmp(&self, other: &Self) -> Option<Ordering> {
+        Some(self.cmp(other))
+    }
+}
+
+impl Ord for Ranked {
+    fn cmp(&self, other: &Self) -> Ordering {
+        self.0.total_cmp(&other.0).then(self.1.cmp(&other.1))
+    }
+}
+
+/// The parsed coordinates of every record, bucketed into a lat/long grid.
+///
+/// `points[i]` is None when record `i` has unparseable coordinates; such
+/// records are in no cell. Cell contents are stored CSR-style, row-major,
+/// with record positions ascending within each cell.
+pub(crate) struct SpatialIndex {
+    points: Box<[Option<Point>]>,
+    offsets: Box<[u32]>,
+    ids: Box<[u32]>,
+    /// The cells holding at least one point, for best-first search.
+    occupied: Box<[u32]>,
+}
+
+impl SpatialIndex {
+    pub(crate) fn new(zipcodes: &[Record<'_>]) -> Self {
+        let points: Box<[Option<Point>]> = zipcodes.iter().map(Point::parse).collect();
+        let cell_of = |p: &Point| Point::cell_row(p.lat) * LON_CELLS + Point::cell_col(p.lon);
+        let mut counts = vec![0u32; LAT_CELLS * LON_CELLS + 1];
+        for p in points.iter().flatten() {
+            counts[cell_of(p) + 1] += 1;
+        }
+        for i in 1..counts.len() {
+            counts[i] += counts[i - 1];
+        }
+        let offsets = counts.clone().into_boxed_slice();
+        let mut ids = vec![0u32; *counts.last().unwrap_or(&0) as usize];
+        for (id, p) in points.iter().enumerate() {
+            if let Some(p) = p {
+                let cell = cell_of(p);
+                ids[counts[cell] as usize] = id as u32;
+                counts[cell] += 1;
+            }
+        }
+        let occupied = (0..LAT_CELLS * LON_CELLS)
+            .filter(|&cell| offsets[cell] != offsets[cell + 1])
+            .map(|cell| cell as u32)
+            .collect();
+        SpatialIndex {
+            points,
+            offsets,
+            ids: ids.into_boxed_slice(),
+            occupied,
+        }
+    }
+
+    /// Ascending positions of the records within `radius` miles of `center`,
+    /// matching an exhaustive haversine check exactly.
+    pub(crate) fn within(&self, center: Point, radius: f64) -> Vec<u32> {
+        match Area::around(center, radius) {
+            Area::Empty => Vec::new(),
+            // Off-globe centers are still well-defined for the haversine
+            // formula, but not for the bounding box: check every point.
+            Area::Everything => self
+                .matching(0..self.points.len() as u32, center, radius, None)
+                .collect(),
+            Area::Cells { rows, cols, bounds } => {
+                let mut hits = Vec::new();
+                for row in rows {
+                    for &col in &cols {
+                        let ids = self.cell(row * LON_CELLS + col);
+                        hits.extend(self.matching(
+                            ids.iter().copied(),
+                            center,
+                            radius,
+                            Some(bounds),
+                        ));
+                    }
+                }
+                hits.sort_unstable();
+                hits
+            }
+        }
+    }
+
+    /// An upper bound on the length of [`Self::within`], from the sizes of
+    /// the cells it would visit, without checking any point.
+    pub(crate) fn within_estimate(&self, center: Point, radius: f64) -> usize {
+        match Area::around(center, radius) {
+            Area::Empty => 0,
+            Area::Everything => self.ids.len(),
+            Area::Cells { rows, cols, .. } => rows
+                .flat_map(|row| cols.iter().map(move |&col| row * LON_CELLS + col))
+                .map(|cell| self.cell(cell).len())
+                .sum(),
+        }
+    }
+
+    /// Positions of the records in grid `cell`, ascending.
+    fn cell(&self, cell: usize) -> &[u32] {
+        &self.ids[self.offsets[cell] as usize..self.offsets[cell + 1] as usize]
+    }
+
+    /// Distance in miles from record `id` to `center`, or None if the record's
+    /// coordinates are unparseable. Agrees exactly with [`Self::within`].
+    pub(crate) fn miles(&self, id: u32, center: &Point) -> Option<f64> {
+        self.points[id as usize].map(|p| p.miles_to(center))
+    }
+
+    /// The `k` records closest to `center`, no further than `max_radius` miles,
+    /// as `(position, miles)` pairs by ascending distance (ties in database
+    /// order).
+    ///
+    /// Cells are visited best-first by a lower bound on their distance, and
+    /// the search stops once no unvisited cell can beat the current k-th hit.
+    pub(crate) fn nearest(&self, center: Point, k: usize, max_radius: f64) -> Vec<(u32, f64)> {
+        if k == 0 || max_radius.is_nan() || max_radius < 0.0 {
+            return Vec::new();
+        }
+        if !center.lat.is_finite() || !center.lon.is_finite() {
+            return Vec::new();
+        }
+        let mut cells: BinaryHeap<Reverse<Ranked>> = self
+            .occupied
+            .iter()
+            .map(|&cell| Reverse(Ranked(center.gap_to_cell(cell as usize), cell)))
+            .collect();
+        // Max-heap of the best k so far; its top is the one to evict.
+        let mut best: BinaryHeap<Ranked> = BinaryHeap::with_capacity(k + 1);
+        while let Some(Reverse(Ranked(gap, cell))) = cells.pop() {
+            let bound = gap * EARTH_RADIUS_MILES;
+            if bound > max_radius
+                || (best.len() == k && best.peek().is_some_and(|kth| bound > kth.0))
+            {
+                break;
+            }
+            for &id in self.cell(cell as usize) {
+                let Some(p) = &self.points[id as usize] else {
+                    continue;
+                };
+                let miles = p.miles_to(&center);
+                if miles <= max_radius {
+                    best.push(Ranked(miles, id));
+                    if best.len() > k {
+                        best.pop();
+                    }
+                }
+            }
+        }
+        best.into_sorted_vec()
+            .into_iter()
+            .map(|Ranked(miles, id)| (id, miles))
+            .collect()
+    }
+
+    /// The ids within `radius` of `center`, cheaply rejecting those outside
+    /// the `(dlat, dlon)` bounding box before the exact distance check.
+    fn matching<'a>(
+        &'a self,
+        ids: impl Iterator<Item = u32> + 'a,
+        center: Point,
+        radius: f64,
+        bounds: Option<(f64, f64)>,
+    ) -> impl Iterator<Item = u32> + 'a {
+        ids.filter(move |&id| {
+            let Some(p) = &self.points[id as usize] else {
+                return false;
+            };
+            if let Some((dlat, dlon)) = bounds {
+                let lon_gap = (p.lon - center.lon).rem_euclid(2.0 * PI);
+                if (p.lat - center.lat).abs() > dlat || lon_gap.min(2.0 * PI - lon_gap) > dlon {
+                    return false;
+                }
+            }
+            p.miles_to(&center) <= radius
+        })
+    }
+}
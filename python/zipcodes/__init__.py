@@ -12,7 +12,12 @@ The full-database scans run in the compiled Rust extension
 argument validation, exceptions, and the ``zips=`` chaining lists.
 """
 import re
+import sys
+import threading
 import warnings
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping, Sequence
 from math import asin, cos, radians, sin, sqrt
 
 from zipcodes import _zipcodes
@@ -26,15 +31,160 @@ _digits = re.compile(r"[^\d\-]")
 _valid_zipcode_length = 5
 
 _zips_cache = None
+_zips_lock = threading.Lock()
+
+ZipcodeView = _zipcodes.ZipcodeView
+Mapping.register(ZipcodeView)
+
+ZipSet = _zipcodes.ZipSet
+Sequence.register(ZipSet)
+
+Query = _zipcodes.Query
+
+CacheInfo = namedtuple(
+    "CacheInfo", ["hits", "misses", "entries", "bytes", "max_entries", "max_bytes"]
+)
+
+# memoryview formats of a native-endian C double.
+_double_formats = ("d", "@d", "=d", "<d" if sys.byteorder == "little" else ">d")
+
+DictionaryColumn = namedtuple("DictionaryColumn", ["codes", "categories"])
+DictionaryColumn.__doc__ = """A dictionary-encoded column: `categories` holds
+the sorted distinct values, and `codes` the index into it for each zipcode."""
 
 
 def _load_zips():
     global _zips_cache
+    # Double-checked so concurrent first callers (free-threaded builds
+    # included) build and share a single list.
     if _zips_cache is None:
-        _zips_cache = _zipcodes.list_all()
+        with _zips_lock:
+            if _zips_cache is None:
+                _zips_cache = _zipcodes.list_all()
     return _zips_cache
 
 
+def preload(background=False, shared=False):
+    """Decode the database and build every index now rather than on first use.
+
+    The work runs natively with the GIL released. With `background`, it runs
+    on a daemon thread, which is returned so callers can ``join()`` it; use
+    `is_loaded()` to gate readiness checks.
+
+    With `shared`, for the master process of a pre-fork server (gunicorn,
+    uWSGI), it also builds the `list_all()` dicts, so that workers forked
+    afterwards start with everything built. The native records and indexes
+    hold no Python objects and are never written once decoded, so workers
+    share them copy-on-write. The dicts are shared only until touched, as
+    every reference count update copies the page it is on; call
+    `gc.freeze()` before forking to at least keep the garbage collector off
+    them. It runs in the foreground, so a half-finished load is never
+    forked.
+    """
+    if shared:
+        if background:
+            raise ValueError("preload(shared=True) cannot run in the background")
+        _zipcodes.preload()
+        _load_zips()
+        return None
+    if not background:
+        _zipcodes.preload()
+        return None
+    thread = threading.Thread(
+        target=_zipcodes.preload, name="zipcodes-preload", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def is_loaded():
+    """True once `preload()` has finished, so no query pays a warm-up cost."""
+    return _zipcodes.is_loaded()
+
+
+def load_database(path):
+    """Atomically swap in the database file at `path`, e.g. to pick up newer
+    data without upgrading the wheel or restarting, and return the new
+    `database_version()`.
+
+    The file, compiled by the crate's ``compile_database`` example, is
+    memory-mapped rather than read, and its checksum and every record are
+    checked up front.
+    Queries already running finish on the old data, later ones see only the
+    new, and cached results (see `set_cache`) are dropped. If the old
+    database was preloaded, the new one is preloaded before the swap.
+
+    The old database is freed, and its file unmapped, once no record view,
+    `ZipSet` or query iterator taken from it remains. A missing or
+    unreadable file raises `OSError`, and a corrupt one `ValueError`.
+    """
+    global _zips_cache
+    version = _zipcodes.load_database(path)
+    with _zips_lock:
+        _zips_cache = None
+    return version
+
+
+def database_version():
+    """A number that changes whenever `load_database()` swaps the database,
+    for keying caches of query results; 0 for the built-in database."""
+    return _zipcodes.database_version()
+
+
+def set_threads(threads):
+    """Split full-database scans and decoding across up to `threads` native
+    threads, or one per core if 0.
+
+    The default of 1 runs each query on its calling thread. Results are the
+    same, in the same order, whatever the setting.
+    """
+    _zipcodes.set_threads(threads)
+
+
+def threads():
+    """The number of native threads full-database scans may use."""
+    return _zipcodes.threads()
+
+
+def set_cache(max_entries=256, max_bytes=None):
+    """Cache the results of up to `max_entries` distinct `filter_by`,
+    `similar_to`, `contains` and `filter_by_coordinates` queries, least
+    recently used first out, or disable caching if 0. Caching is off until
+    `set_cache` is first called.
+
+    `max_bytes` optionally also bounds the shallow size of the cached lists
+    and records. Only queries over the whole database are cached, and every
+    hit still returns fresh dicts (or new lists of the immutable views).
+    """
+    _zipcodes.set_cache(max_entries, max_bytes)
+
+
+def cache_info():
+    """A `CacheInfo` of the result cache's counters, size and limits."""
+    return CacheInfo(*_zipcodes.cache_info())
+
+
+def cache_clear():
+    """Drop every cached result and reset the hit and miss counters."""
+    _zipcodes.cache_clear()
+
+
+def use_record_views(enabled=True):
+    """Make queries return read-only `ZipcodeView` mappings instead of dicts.
+
+    A view converts a field to a Python object only when it is accessed, and
+    compares equal to the dict the query would otherwise have returned. Any
+    query's ``views=`` argument overrides this setting for that call. A
+    `ZipSet` takes the setting when it is created, and sets derived from it
+    keep theirs.
+    """
+    _zipcodes.use_record_views(bool(enabled))
+
+
+def _views(views):
+    return _zipcodes.record_views() if views is None else bool(views)
+
+
 def __getattr__(name):
     # `_zips` was a module-level list in 1.x; keep it importable, but
     # materialize the 42k dicts lazily instead of at import time.
@@ -43,23 +193,29 @@ def __getattr__(name):
     raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
+def _cleaned(zipcode):
+    if not zipcode or not isinstance(zipcode, str):
+        raise TypeError("Invalid type, zipcode must be a string.")
+
+    return _clean(zipcode, min(len(zipcode), _valid_zipcode_length))
+
+
 def _clean_zipcode(fn):
     def decorator(zipcode, *args, **kwargs):
-        if not zipcode or not isinstance(zipcode, str):
-            raise TypeError("Invalid type, zipcode must be a string.")
-
-        return fn(
-            _clean(zipcode, min(len(zipcode), _valid_zipcode_length)), *args, **kwargs
-        )
+        return fn(_cleaned(zipcode), *args, **kwargs)
 
     return decorator
 
 
-@_clean_zipcode
-def matching(zipcode, zips=None):
+# Without `zips`, the native functions validate `zipcode` themselves, raising
+# the same exceptions as `_clean_zipcode`, so a query is a single native call.
+def matching(zipcode, zips=None, views=None):
     """Retrieve zipcode dict for provided zipcode"""
     if zips is None:
-        return _zipcodes.matching(zipcode)
+        return _zipcodes.matching(zipcode, _views(views))
+    zipcode = _cleaned(zipcode)
+    if isinstance(zips, ZipSet):
+        return zips.matching(zipcode, views)
     return [z for z in zips if z["zip_code"] == zipcode]
 
 
@@ -69,46 +225,91 @@ def is_valid(zipcode):
     return is_real(zipcode)
 
 
-@_clean_zipcode
-def is_real(zipcode):
-    """Determine whether a given zip or zip+4 zipcode is real."""
-    return _zipcodes.is_real(zipcode)
+is_real = _zipcodes.is_real
 
 
-@_clean_zipcode
-def similar_to(partial_zipcode, zips=None):
+def similar_to(partial_zipcode, zips=None, views=None):
     """List of zipcode dicts where zipcode prefix matches `partial_zipcode`"""
     if zips is None:
-        return _zipcodes.similar_to(partial_zipcode)
+        return _zipcodes.similar_to(partial_zipcode, _views(views))
+    partial_zipcode = _cleaned(partial_zipcode)
+    if isinstance(zips, ZipSet):
+        return zips.similar_to(partial_zipcode, views)
     return [z for z in zips if z["zip_code"].startswith(partial_zipcode)]
 
 
-@_clean_zipcode
-def contains(partial_zipcode, zips=None):
+def contains(partial_zipcode, zips=None, views=None):
     """List of zipcode dicts where zipcode contains `partial_zipcode` fragment"""
     if zips is None:
-        return _zipcodes.contains(partial_zipcode)
+        return _zipcodes.contains(partial_zipcode, _views(views))
+    partial_zipcode = _cleaned(partial_zipcode)
+    if isinstance(zips, ZipSet):
+        return zips.contains(partial_zipcode, views)
     return [z for z in zips if partial_zipcode in z["zip_code"]]
 
 
-def filter_by_state(state, zips=None):
-    return filter_by(zips, state=state)
+@_clean_zipcode
+def iter_similar_to(partial_zipcode, zips=None, views=None):
+    """Iterator over `similar_to` results, scanning only as far as needed"""
+    if zips is None:
+        return query(views).prefix(partial_zipcode).iter()
+    return iter(similar_to(partial_zipcode, zips=zips, views=views))
 
 
-def filter_by_city(city, zips=None):
-    return filter_by(zips, city=city)
+@_clean_zipcode
+def iter_contains(partial_zipcode, zips=None, views=None):
+    """Iterator over `contains` results, scanning only as far as needed"""
+    if zips is None:
+        return query(views).contains(partial_zipcode).iter()
+    return iter(contains(partial_zipcode, zips=zips, views=views))
+
+
+def is_real_many(zipcodes):
+    """List of `is_real` results for each of `zipcodes`.
+
+    Invalid zipcodes yield the ``TypeError``/``ValueError`` instance that
+    `is_real` would have raised, rather than raising it.
+    """
+    return _zipcodes.is_real_many(zipcodes)
+
 
+def matching_many(zipcodes):
+    """List of `matching` results for each of `zipcodes`.
+
+    Invalid zipcodes yield the ``TypeError``/``ValueError`` instance that
+    `matching` would have raised, rather than raising it.
+    """
+    return _zipcodes.matching_many(zipcodes)
+
+
+def lookup_many(zipcodes):
+    """Dict mapping each of `zipcodes` to its zipcode dict, or None if it is
+    not real.
+
+    Invalid zipcodes map to the ``TypeError``/``ValueError`` instance that
+    `matching` would have raised, rather than raising it.
+    """
+    return _zipcodes.lookup_many(zipcodes)
 
-def filter_by_county(county, zips=None):
-    return filter_by(zips, county=county)
 
+def filter_by_state(state, zips=None, views=None):
+    return filter_by(zips, views, state=state)
 
-def filter_by_timezone(timezone, zips=None):
-    return filter_by(zips, timezone=timezone)
 
+def filter_by_city(city, zips=None, views=None):
+    return filter_by(zips, views, city=city)
 
-def filter_by_zip_code_type(zip_code_type, zips=None):
-    return filter_by(zips, zip_code_type=zip_code_type)
+
+def filter_by_county(county, zips=None, views=None):
+    return filter_by(zips, views, county=county)
+
+
+def filter_by_timezone(timezone, zips=None, views=None):
+    return filter_by(zips, views, timezone=timezone)
+
+
+def filter_by_zip_code_type(zip_code_type, zips=None, views=None):
+    return filter_by(zips, views, zip_code_type=zip_code_type)
 
 
 def haversine(lon1, lat1, lon2, lat2):
@@ -126,10 +327,67 @@ def haversine(lon1, lat1, lon2, lat2):
     return c * r
 
 
-def filter_by_coordinates(lat, long, radius_in_miles=10, zips=None):
+def _packed_doubles(values):
+    """`values` as native float64 bytes for the extension; numbers (including
+    NumPy scalars, which are not sequences) pass through as floats so they
+    broadcast."""
+    if not hasattr(values, "__len__"):
+        try:
+            return float(values)
+        except TypeError:
+            pass
+    try:
+        view = memoryview(values)
+    except TypeError:
+        view = None
+    if view is not None:
+        if view.ndim != 1:
+            raise ValueError(
+                "arrays must be one-dimensional, not %d-dimensional" % view.ndim
+            )
+        if view.format in _double_formats and view.c_contiguous:
+            return view.tobytes()
+    return array("d", values).tobytes()
+
+
+def _doubles(packed):
+    result = array("d")
+    result.frombytes(packed)
+    return result
+
+
+def haversine_many(lon1, lat1, lon2, lat2):
+    """
+    Calculate the great circle distances in miles between many pairs of
+    points, as an ``array("d")``.
+
+    Each argument is a sequence or buffer (e.g. a NumPy array) of decimal
+    degrees, or a single number to use for every pair.
+    """
+    return _doubles(
+        _zipcodes.haversine_many(*map(_packed_doubles, (lon1, lat1, lon2, lat2)))
+    )
+
+
+def distance_between_zips(zips_a, zips_b):
+    """
+    Great circle distances in miles between paired zipcodes, as an
+    ``array("d")``.
+
+    Either side may be a single zipcode to pair with every zipcode on the
+    other side. Pairs with an invalid or unknown zipcode get NaN.
+    """
+    return _doubles(_zipcodes.distance_between_zips(zips_a, zips_b))
+
+
+def filter_by_coordinates(lat, long, radius_in_miles=10, zips=None, views=None):
     """List of zipcode dicts within `radius_in_miles` of (`lat`, `long`)."""
     if zips is None:
-        return _zipcodes.filter_by_coordinates(lat, long, radius_in_miles)
+        return _zipcodes.filter_by_coordinates(
+            lat, long, radius_in_miles, _views(views)
+        )
+    if isinstance(zips, ZipSet):
+        return zips.filter_by_coordinates(lat, long, radius_in_miles, views)
     return [
         z
         for z in zips
@@ -137,10 +395,32 @@ def filter_by_coordinates(lat, long, radius_in_miles=10, zips=None):
     ]
 
 
-def filter_by(zips=None, **filters):
+def nearest(lat, long, k=1, max_radius=None, zips=None, views=None):
+    """List of the `k` (zipcode dict, distance in miles) pairs closest to
+    (`lat`, `long`), nearest first, optionally within `max_radius` miles."""
+    if zips is None:
+        return _zipcodes.nearest(lat, long, k, max_radius, _views(views))
+    if isinstance(zips, ZipSet):
+        return zips.nearest(lat, long, k, max_radius, views)
+    ranked = sorted(
+        (
+            (haversine(float(z["long"]), float(z["lat"]), long, lat), i)
+            for i, z in enumerate(zips)
+        )
+    )
+    return [
+        (zips[i], distance)
+        for distance, i in ranked
+        if max_radius is None or distance <= max_radius
+    ][:k]
+
+
+def filter_by(zips=None, views=None, **filters):
     """Use `kwargs` to select for desired attributes from list of zipcode dicts"""
     if zips is None:
-        return _zipcodes.filter_by(**filters)
+        return _zipcodes.filter_by(views=_views(views), **filters)
+    if isinstance(zips, ZipSet):
+        return zips.filter_by(views=views, **filters)
     return [
         z
         for z in zips
@@ -148,13 +428,56 @@ def filter_by(zips=None, **filters):
     ]
 
 
-def list_all(zips=None):
+def iter_filter_by(zips=None, views=None, **filters):
+    """Iterator over `filter_by` results, scanning only as far as needed"""
+    if zips is None:
+        return query(views).filter_by(**filters).iter()
+    return iter(filter_by(zips=zips, views=views, **filters))
+
+
+def list_all(zips=None, views=None):
     """Return a list containing all zip-code objects."""
     if zips is None:
+        if _views(views):
+            return _zipcodes.list_all(True)
         return _load_zips()
     return zips
 
 
+def query(views=None):
+    """Start a `Query` matching every zipcode.
+
+    Each step (``state``, ``city``, ``filter_by``, ``prefix``, ``contains``,
+    ``within``, ``order_by_distance``, ``limit``, ...) returns a new query,
+    and ``run()`` evaluates them all natively in one pass, e.g.
+    ``query().state("TX").within(lat, long, 25).order_by_distance().limit(20).run()``.
+    ``offset()`` and ``limit()`` page through results, and ``iter()`` yields
+    them lazily.
+    """
+    return Query(_views(views))
+
+
+def iter_all(views=None):
+    """Iterator over all zip-code objects, converting each only when reached."""
+    return query(views).iter()
+
+
+def columns():
+    """Dict of the whole database in columnar form, in zip code order.
+
+    ``lat`` and ``long`` are ``array("d")`` (NaN where unparseable),
+    ``active`` is ``array("B")`` of 0/1, and the low-cardinality string
+    fields are `DictionaryColumn`s with ``array("I")`` codes. ``zip_code`` and
+    the list fields are plain lists. The arrays support the buffer protocol,
+    so ``numpy.asarray`` wraps them without copying.
+    """
+    cols = _zipcodes.columns()
+    for name, column in cols.items():
+        if isinstance(column, tuple):
+            cols[name] = DictionaryColumn(*column)
+    return cols
+
+
 def _contains_nondigits(s):
     return bool(_digits.search(s))
 
@@ -1,14 +1,129 @@
-from typing import Any, Dict, List
+import os
+from typing import (
+    Any,
+    Dict,
+    ItemsView,
+    Iterable,
+    Iterator,
+    KeysView,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    ValuesView,
+)
 
 __version__: str
 
-def matching(zipcode: str) -> List[Dict[str, Any]]: ...
+Record = Union[Dict[str, Any], "ZipcodeView"]
+
+class ZipcodeView(Mapping[str, Any]):
+    def __getitem__(self, key: str) -> Any: ...
+    def __len__(self) -> int: ...
+    def __iter__(self) -> Iterator[str]: ...
+    def keys(self) -> KeysView[str]: ...
+    def values(self) -> ValuesView[Any]: ...
+    def items(self) -> ItemsView[str, Any]: ...
+    def to_dict(self) -> Dict[str, Any]: ...
+
+class ZipSet(Sequence[Record]):
+    def __init__(
+        self, zips: Optional[Iterable[Any]] = None, views: Optional[bool] = None
+    ) -> None: ...
+    def __len__(self) -> int: ...
+    def __getitem__(self, index: Any) -> Any: ...
+    def __iter__(self) -> Iterator[Record]: ...
+    def __contains__(self, value: object) -> bool: ...
+    def index(self, value: Any, start: int = 0, stop: Optional[int] = None) -> int: ...
+    def count(self, value: Any) -> int: ...
+    def zip_codes(self) -> List[str]: ...
+    def to_list(self, views: Optional[bool] = None) -> List[Record]: ...
+    def matching(self, zipcode: str, views: Optional[bool] = None) -> "ZipSet": ...
+    def similar_to(self, prefix: str, views: Optional[bool] = None) -> "ZipSet": ...
+    def contains(self, fragment: str, views: Optional[bool] = None) -> "ZipSet": ...
+    def filter_by(self, *, views: Optional[bool] = None, **filters: Any) -> "ZipSet": ...
+    def filter_by_coordinates(
+        self,
+        lat: float,
+        long: float,
+        radius_in_miles: float,
+        views: Optional[bool] = None,
+    ) -> "ZipSet": ...
+    def nearest(
+        self,
+        lat: float,
+        long: float,
+        k: int,
+        max_radius: Optional[float] = None,
+        views: Optional[bool] = None,
+    ) -> List[Tuple[Record, float]]: ...
+
+class Query:
+    def __init__(self, views: bool = False) -> None: ...
+    def state(self, state: str) -> "Query": ...
+    def city(self, city: str) -> "Query": ...
+    def county(self, county: str) -> "Query": ...
+    def timezone(self, timezone: str) -> "Query": ...
+    def zip_code_type(self, zip_code_type: str) -> "Query": ...
+    def country(self, country: str) -> "Query": ...
+    def world_region(self, world_region: str) -> "Query": ...
+    def active(self, active: bool) -> "Query": ...
+    def filter_by(self, **filters: Any) -> "Query": ...
+    def prefix(self, prefix: str) -> "Query": ...
+    def contains(self, fragment: str) -> "Query": ...
+    def within(self, lat: float, long: float, radius_in_miles: float) -> "Query": ...
+    def order_by_distance(
+        self, lat: Optional[float] = None, long: Optional[float] = None
+    ) -> "Query": ...
+    def limit(self, limit: int) -> "Query": ...
+    def offset(self, offset: int) -> "Query": ...
+    def run(self, views: Optional[bool] = None) -> List[Record]: ...
+    def iter(self, views: Optional[bool] = None) -> Iterator[Record]: ...
+    def zip_codes(self) -> List[str]: ...
+    def __iter__(self) -> Iterator[Record]: ...
+
+def matching(zipcode: str, views: bool = False) -> List[Record]: ...
 def is_real(zipcode: str) -> bool: ...
-def similar_to(prefix: str) -> List[Dict[str, Any]]: ...
-def contains(fragment: str) -> List[Dict[str, Any]]: ...
-def filter_by(**filters: Any) -> List[Dict[str, Any]]: ...
+def similar_to(prefix: str, views: bool = False) -> List[Record]: ...
+def contains(fragment: str, views: bool = False) -> List[Record]: ...
+def filter_by(*, views: bool = False, **filters: Any) -> List[Record]: ...
 def filter_by_coordinates(
-    lat: float, long: float, radius_in_miles: float
-) -> List[Dict[str, Any]]: ...
+    lat: float, long: float, radius_in_miles: float, views: bool = False
+) -> List[Record]: ...
+def nearest(
+    lat: float,
+    long: float,
+    k: int,
+    max_radius: Optional[float] = None,
+    views: bool = False,
+) -> List[Tuple[Record, float]]: ...
 def haversine(lon1: float, lat1: float, lon2: float, lat2: float) -> float: ...
-def list_all() -> List[Dict[str, Any]]: ...
+def list_all(views: bool = False) -> List[Record]: ...
+def preload() -> None: ...
+def is_loaded() -> bool: ...
+def load_database(path: Union[str, "os.PathLike[str]"]) -> int: ...
+def database_version() -> int: ...
+def set_threads(threads: int) -> None: ...
+def threads() -> int: ...
+def set_cache(max_entries: int, max_bytes: Optional[int] = None) -> None: ...
+def cache_info() -> Tuple[int, int, int, int, int, Optional[int]]: ...
+def cache_clear() -> None: ...
+def use_record_views(enabled: bool) -> None: ...
+def record_views() -> bool: ...
+def is_real_many(zips: Iterable[Any]) -> List[Union[bool, Exception]]: ...
+def matching_many(
+    zips: Iterable[Any],
+) -> List[Union[List[Dict[str, Any]], Exception]]: ...
+def lookup_many(
+    zips: Iterable[Any],
+) -> Dict[Any, Union[Dict[str, Any], None, Exception]]: ...
+def columns() -> Dict[str, Any]: ...
+def haversine_many(
+    lon1: Union[bytes, float],
+    lat1: Union[bytes, float],
+    lon2: Union[bytes, float],
+    lat2: Union[bytes, float],
+) -> bytes: ...
+def distance_between_zips(zips_a: Any, zips_b: Any) -> bytes: ...
@@ -1,6 +1,14 @@
+import gc
+import json
 import os
+import subprocess
 import sys
 import unittest
+from array import array
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from math import isnan
 
 # append module root directory to sys.path
 
@@ -28,6 +36,124 @@ def callable_raise_exc(function, exception, *args, **kwargs):
         return isinstance(e, exception)
 
 
+def _row_from_columns(columns, zip_code):
+    """Reassemble one zipcode's record from `zipcodes.columns()` output."""
+    i = columns["zip_code"].index(zip_code)
+    row = {}
+    for name, column in columns.items():
+        if isinstance(column, zipcodes.DictionaryColumn):
+            row[name] = column.categories[column.codes[i]]
+        elif name == "active":
+            row[name] = bool(column[i])
+        else:
+            row[name] = column[i]
+    return row
+
+
+def _in_threads(function, args, workers=8):
+    """Map `function` over `args` from a pool of threads, in order."""
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(function, args))
+
+
+def _with_threads(threads, function):
+    """Call `function` with `zipcodes.set_threads(threads)` in effect."""
+    zipcodes.set_threads(threads)
+    try:
+        return function()
+    finally:
+        zipcodes.set_threads(1)
+
+
+def _with_record_views(function):
+    """Call `function` with `zipcodes.use_record_views()` in effect."""
+    zipcodes.use_record_views()
+    try:
+        return function()
+    finally:
+        zipcodes.use_record_views(False)
+
+
+def _with_cache(max_entries, function, max_bytes=None):
+    """Call `function` with an empty `zipcodes.set_cache(...)` in effect."""
+    zipcodes.cache_clear()
+    zipcodes.set_cache(max_entries, max_bytes)
+    try:
+        return function()
+    finally:
+        zipcodes.set_cache(0)
+        zipcodes.cache_clear()
+
+
+def _mutated_then_requeried():
+    """Mutate a cached `filter_by` result, then return a second one."""
+    zipcodes.filter_by(state="CT")[0]["area_codes"].append("000")
+    return zipcodes.filter_by(state="CT")
+
+
+def _preloaded_shared():
+    # As a pre-fork master would: preload, then freeze what was built.
+    # Freezing is left to the caller, so the library must not have done it.
+    frozen = gc.get_freeze_count()
+    try:
+        assert zipcodes.preload(shared=True) is None
+        assert gc.get_freeze_count() == frozen
+        gc.freeze()
+        return zipcodes._zips_cache
+    finally:
+        gc.unfreeze()
+
+
+# The records of prefix 064, compiled from the JSON beside it with
+# `cargo run -p zipcodes --example compile_database -- zips-064.json zips-064.bin`.
+_fixture_database = os.path.join(os.path.dirname(__file__), "fixtures", "zips-064.bin")
+
+_swap_script = """
+import json, sys
+import zipcodes
+
+zipcodes.set_cache(8)
+before = len(zipcodes.filter_by(state="CT")), len(zipcodes.list_all())
+versions = [zipcodes.database_version(), zipcodes.load_database(sys.argv[1])]
+zips_cache_reset = zipcodes._zips_cache is None
+after = len(zipcodes.filter_by(state="CT")), len(zipcodes.list_all())
+versions += [zipcodes.load_database(sys.argv[1]), zipcodes.database_version()]
+print(json.dumps({
+    "versions": versions,
+    "zips_cache_reset": zips_cache_reset,
+    "before": before,
+    "after": after,
+    "is_real": [zipcodes.is_real("06475"), zipcodes.is_real("06903")],
+}))
+"""
+
+
+def _swapped_to_fixture():
+    """What changes when the fixture database is swapped in, observed in a
+    fresh interpreter so that this one keeps the built-in database."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    child = subprocess.run(
+        [sys.executable, "-c", _swap_script, _fixture_database],
+        capture_output=True,
+        check=True,
+        env=env,
+        text=True,
+    )
+    return json.loads(child.stdout)
+
+
+def _raised(function, *args):
+    """The type and message of the exception `function(*args)` raises, if any."""
+    try:
+        function(*args)
+    except Exception as e:
+        return type(e), str(e)
+    return None
+
+
+_invalid_zipcodes = [None, "", 6903, b"06903", "000000", "0000a", "1234-5678", "٠٦٩٠٣x"]
+
+
 def generate_unittest(name, assertion_callable, predicate):
     """
 
@@ -89,6 +215,123 @@ unittests_schema = [
             lambda: callable_raise_exc(
                 lambda: zipcodes._clean("0000a"), ValueError
             ),
+            # superscripts are numeric but not decimal digits, as in 1.x
+            lambda: callable_raise_exc(
+                lambda: zipcodes.matching("1\u00b2345"), ValueError
+            ),
+            lambda: zipcodes.matching("\uff10\uff16\uff14\uff17\uff15") == [],
+            # digits of any Unicode version the interpreter knows pass too
+            lambda: zipcodes.matching(chr(0x1E4F0) * 5) == []
+            if chr(0x1E4F0).isdecimal()
+            else callable_raise_exc(lambda: zipcodes.matching(chr(0x1E4F0) * 5), ValueError),
+            # unhashable items can't be keys of the lookup_many result
+            lambda: callable_raise_exc(
+                lambda: zipcodes.lookup_many(["06475", ["06475"]]), TypeError
+            ),
+            # mismatched array lengths
+            lambda: callable_raise_exc(
+                lambda: zipcodes.haversine_many([1.0, 2.0], [1.0], 0, 0), ValueError
+            ),
+            # any number broadcasts, but arrays must be flat
+            lambda: list(zipcodes.haversine_many([1.0], [2.0], Fraction(1), 2))
+            == list(zipcodes.haversine_many([1.0], [2.0], 1.0, 2.0)),
+            lambda: callable_raise_exc(
+                lambda: zipcodes.haversine_many(
+                    memoryview(array("d", [0.0] * 4)).cast("B").cast("d", (2, 2)), 0, 0, 0
+                ),
+                ValueError,
+            ),
+            # record views are read-only mappings
+            lambda: isinstance(zipcodes.matching("06475", views=True)[0], Mapping),
+            lambda: callable_raise_exc(
+                lambda: zipcodes.matching("06475", views=True)[0]["population"],
+                KeyError,
+            ),
+            # zip sets are sequences that chained queries keep native
+            lambda: isinstance(zipcodes.ZipSet(), Sequence),
+            lambda: isinstance(
+                zipcodes.filter_by_state("CT", zips=zipcodes.ZipSet()), zipcodes.ZipSet
+            ),
+            lambda: zipcodes.filter_by_state("CT", zips=zipcodes.ZipSet())
+            == zipcodes.filter_by_state("CT"),
+            lambda: zipcodes.matching("06475")[0]
+            in zipcodes.similar_to("0647", zips=zipcodes.ZipSet()),
+            lambda: callable_raise_exc(lambda: zipcodes.ZipSet(["00000"]), ValueError),
+            # and have list's index() and count()
+            lambda: zipcodes.ZipSet(["06475", "06905"]).index(zipcodes.matching("06905")[0])
+            == 1,
+            lambda: zipcodes.ZipSet(["06475", "06905"]).count(zipcodes.matching("06905")[0])
+            == 1,
+            lambda: zipcodes.ZipSet(["06475"]).count("06475") == 0,
+            lambda: callable_raise_exc(
+                lambda: zipcodes.ZipSet(["06475", "06905"]).index(
+                    zipcodes.matching("06475")[0], 1
+                ),
+                ValueError,
+            ),
+            # zip sets take the global views setting, or their source set's
+            lambda: not isinstance(
+                _with_record_views(
+                    lambda: zipcodes.filter_by_state("CT", zips=zipcodes.ZipSet())[0]
+                ),
+                dict,
+            ),
+            lambda: not isinstance(
+                zipcodes.ZipSet(zipcodes.ZipSet(["06475"], views=True))[0], dict
+            ),
+            lambda: isinstance(zipcodes.ZipSet(["06475"])[0], dict),
+            # queries are immutable builders run in one native pass
+            lambda: zipcodes.query().state("CT").limit(5).run()
+            == zipcodes.filter_by_state("CT")[:5],
+            lambda: zipcodes.query().filter_by(active=object()).run() == [],
+            lambda: callable_raise_exc(
+                lambda: zipcodes.query().order_by_distance(), ValueError
+            ),
+            # iterators yield what the list queries return, one at a time
+            lambda: list(zipcodes.iter_filter_by(state="CT", active=True))
+            == zipcodes.filter_by(state="CT", active=True),
+            lambda: list(zipcodes.iter_similar_to("064")) == zipcodes.similar_to("064"),
+            lambda: list(zipcodes.iter_contains("018")) == zipcodes.contains("018"),
+            lambda: next(zipcodes.iter_all()) == zipcodes.list_all()[0],
+            lambda: zipcodes.query().state("TX").offset(50).limit(50).run()
+            == zipcodes.filter_by_state("TX")[50:100],
+            # preloading is idempotent and reported
+            lambda: zipcodes.preload(background=True).join() or zipcodes.is_loaded(),
+            lambda: zipcodes.preload() is None and zipcodes.is_loaded(),
+            lambda: _preloaded_shared() is zipcodes.list_all(),
+            lambda: callable_raise_exc(
+                lambda: zipcodes.preload(background=True, shared=True), ValueError
+            ),
+            # a failed swap leaves the built-in database in place
+            lambda: callable_raise_exc(
+                lambda: zipcodes.load_database("/nonexistent/zips.bin"), OSError
+            ),
+            lambda: zipcodes.database_version() == 0,
+            # a successful swap moves the version forward and drops every
+            # cached result, the list_all() one included
+            lambda: _swapped_to_fixture()
+            == {
+                "versions": [0, 1, 2, 2],
+                "zips_cache_reset": True,
+                "before": [len(zipcodes.filter_by(state="CT")), len(zipcodes.list_all())],
+                "after": [66, 66],
+                "is_real": [True, False],
+            },
+            # concurrent queries agree with serial ones and share one list
+            lambda: _in_threads(zipcodes.filter_by_state, ["CT", "TX"] * 4)
+            == [zipcodes.filter_by_state(state) for state in ["CT", "TX"] * 4],
+            lambda: len({id(zips) for zips in _in_threads(zipcodes.list_all, [None] * 16)})
+            == 1,
+            # parallel scans return what serial ones do, in the same order
+            lambda: _with_threads(4, lambda: zipcodes.threads()) == 4,
+            lambda: _with_threads(0, lambda: zipcodes.filter_by(area_codes=["203"]))
+            == zipcodes.filter_by(area_codes=["203"]),
+            # cached results are fresh copies, and counted
+            lambda: _with_cache(8, _mutated_then_requeried)
+            == zipcodes.filter_by(state="CT"),
+            lambda: _with_cache(
+                8, lambda: zipcodes.similar_to("064") is not zipcodes.similar_to("064")
+            ),
             # ensure zips argument works
             lambda: len(
                 zipcodes.similar_to(
@@ -116,6 +359,48 @@ unittests_schema = [
             (lambda: zipcodes._clean("0646", 4), lambda: "0646"),
             # default behavior
             (lambda: zipcodes._clean("06469"), lambda: "06469"),
+            # native validation raises exactly what the shim's does
+            (
+                lambda: [
+                    [_raised(function, zipcode) for zipcode in _invalid_zipcodes]
+                    for function in (
+                        zipcodes.is_real,
+                        zipcodes.matching,
+                        zipcodes.similar_to,
+                        zipcodes.contains,
+                    )
+                ],
+                lambda: [[_raised(zipcodes._cleaned, z) for z in _invalid_zipcodes]] * 4,
+            ),
+            (lambda: zipcodes.is_real("06905-1234"), lambda: True),
+            (
+                lambda: _with_cache(
+                    2,
+                    lambda: [
+                        zipcodes.similar_to(prefix)
+                        for prefix in ["064", "065", "064", "066", "065"]
+                    ]
+                    and zipcodes.cache_info()[:3],
+                ),
+                lambda: (1, 4, 2),
+            ),
+            (
+                lambda: _with_cache(
+                    8,
+                    lambda: zipcodes.filter_by(state="CT", active=True)
+                    and zipcodes.filter_by(active=True, state="CT")
+                    and zipcodes.cache_info().hits,
+                ),
+                lambda: 1,
+            ),
+            (
+                lambda: _with_cache(
+                    8,
+                    lambda: zipcodes.filter_by(state="TX") and zipcodes.cache_info().entries,
+                    max_bytes=1024,
+                ),
+                lambda: 0,
+            ),
             (lambda: zipcodes.list_all(), lambda: zipcodes._zips),
             (
                 lambda: zipcodes.filter_by(city="Old Saybrook"),
@@ -231,6 +516,160 @@ unittests_schema = [
                 lambda: [
                 ],
             ),
+            (
+                lambda: [
+                    (z["zip_code"], distance)
+                    for z, distance in zipcodes.nearest(41.2913, -72.385)
+                ],
+                lambda: [("06475", 0.0)],
+            ),
+            (
+                lambda: zipcodes.nearest(41.3015, -72.3879, k=3),
+                lambda: zipcodes.nearest(
+                    41.3015, -72.3879, k=3, zips=zipcodes.filter_by_state("CT")
+                ),
+            ),
+            (
+                lambda: zipcodes.nearest(42.2529, 71.0023, k=5, max_radius=100),
+                lambda: [],
+            ),
+            (
+                lambda: [
+                    r if isinstance(r, bool) else type(r)
+                    for r in zipcodes.is_real_many(
+                        ["06903", "91239", "06903-1234", "0646", "0690a", None, "", "069030"]
+                    )
+                ],
+                lambda: [True, False, True, False, ValueError, TypeError, TypeError, ValueError],
+            ),
+            (
+                lambda: [str(e) for e in zipcodes.is_real_many(["0646a", "064690"])],
+                lambda: [
+                    'Invalid characters, zipcode may only contain digits and "-".',
+                    'Invalid format, zipcode must be of the format: "#####" or "#####-####"',
+                ],
+            ),
+            (
+                lambda: zipcodes.matching_many(iter(["06475", "06475-1234", "91239"])),
+                lambda: [zipcodes.matching("06475"), zipcodes.matching("06475"), []],
+            ),
+            (
+                lambda: zipcodes.lookup_many(["06475", "91239"]),
+                lambda: {"06475": zipcodes.matching("06475")[0], "91239": None},
+            ),
+            (
+                lambda: [
+                    round(d, 9)
+                    for d in zipcodes.haversine_many(
+                        [-74.0060, -72.385], array("d", [40.7128, 41.2913]), -118.2437, 34.0522
+                    )
+                ],
+                lambda: [
+                    round(zipcodes.haversine(-74.0060, 40.7128, -118.2437, 34.0522), 9),
+                    round(zipcodes.haversine(-72.385, 41.2913, -118.2437, 34.0522), 9),
+                ],
+            ),
+            (
+                lambda: [
+                    None if isnan(d) else round(d, 9)
+                    for d in zipcodes.distance_between_zips(
+                        ["06475", "06903", "91239", "0690a"], "06475"
+                    )
+                ],
+                lambda: [
+                    0.0,
+                    round(zipcodes.haversine(-73.5684, 41.1352, -72.385, 41.2913), 9),
+                    None,
+                    None,
+                ],
+            ),
+            (
+                lambda: zipcodes.matching("06475", views=True),
+                lambda: zipcodes.matching("06475"),
+            ),
+            (
+                lambda: dict(zipcodes.filter_by(views=True, city="Old Saybrook")[0]),
+                lambda: zipcodes.matching("06475")[0],
+            ),
+            (
+                lambda: [
+                    (z["zip_code"], z.get("city"), z.get("population"))
+                    for z in zipcodes.similar_to("0647", views=True)[3:6]
+                ],
+                lambda: [
+                    ("06473", "North Haven", None),
+                    ("06474", "North Westchester", None),
+                    ("06475", "Old Saybrook", None),
+                ],
+            ),
+            (
+                lambda: zipcodes.filter_by_coordinates(
+                    41.2913, -72.385, 10, zips=zipcodes.filter_by_state("CT", zips=zipcodes.ZipSet())
+                ).to_list(),
+                lambda: zipcodes.filter_by_coordinates(
+                    41.2913, -72.385, 10, zips=zipcodes.filter_by_state("CT")
+                ),
+            ),
+            (
+                lambda: [
+                    (z["zip_code"], round(miles, 9))
+                    for z, miles in zipcodes.nearest(
+                        41.2913, -72.385, 3, zips=zipcodes.ZipSet(zipcodes.similar_to("064"))
+                    )
+                ],
+                lambda: [
+                    (z["zip_code"], round(miles, 9))
+                    for z, miles in zipcodes.nearest(
+                        41.2913, -72.385, 3, zips=zipcodes.similar_to("064")
+                    )
+                ],
+            ),
+            (
+                lambda: zipcodes.contains(
+                    "47", zips=zipcodes.ZipSet(["06475", "06473", "06903", "06475"])
+                ).zip_codes(),
+                lambda: ["06473", "06475"],
+            ),
+            (
+                lambda: zipcodes.query()
+                .state("CT")
+                .within(41.2913, -72.385, 10)
+                .prefix("064")
+                .run(),
+                lambda: zipcodes.similar_to(
+                    "064",
+                    zips=zipcodes.filter_by_coordinates(
+                        41.2913, -72.385, 10, zips=zipcodes.filter_by_state("CT")
+                    ),
+                ),
+            ),
+            (
+                lambda: zipcodes.query()
+                .within(41.2913, -72.385, 10)
+                .order_by_distance()
+                .limit(3)
+                .zip_codes(),
+                lambda: [z["zip_code"] for z, _ in zipcodes.nearest(41.2913, -72.385, 3)],
+            ),
+            (
+                lambda: _row_from_columns(zipcodes.columns(), "06475"),
+                lambda: {
+                    "zip_code": "06475",
+                    "zip_code_type": "STANDARD",
+                    "active": True,
+                    "city": "Old Saybrook",
+                    "acceptable_cities": [],
+                    "unacceptable_cities": ["Fenwick"],
+                    "state": "CT",
+                    "county": "Middlesex County",
+                    "timezone": "America/New_York",
+                    "area_codes": ["860", "959"],
+                    "world_region": "NA",
+                    "country": "US",
+                    "lat": 41.2913,
+                    "long": -72.385,
+                },
+            ),
         ],
     },
 ]